@@ -0,0 +1,245 @@
+'''
+axislimits works out the velocity and acceleration limits of servo driven
+axes from the motors and the mechanics between them and the axes.
+
+Copyright (C) 2023, 2024, 2025, 2026 Gregory D Carl
+
+This program is free software; you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with this program; if not, write to the Free Software Foundation, Inc.,
+51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+'''
+
+import sys
+import os
+import re
+import io
+import json
+import math
+from inimodel import IniFile
+
+# Standard gravity in in/s^2, a force in lbf accelerates a mass in lb by force / mass of it
+gravity = 386.089
+
+# The room the stepgen has over the planned motion (STEPGEN_MAX_VEL / MAX_VELOCITY and
+# STEPGEN_MAXACCEL / MAX_ACCELERATION) in Tormach's configs, used for an axis that has none yet
+stepgenHeadroom = {'velocity': 1.2, 'acceleration': 2.5}
+
+axisLetters = 'XYZABCUVW'
+linearLetters = 'XYZUVW'
+
+limitKeys = ['MAX_VELOCITY', 'MAX_ACCELERATION', 'STEPGEN_MAX_VEL', 'STEPGEN_MAXACCEL', 'MAX_JOG_VELOCITY_UPS']
+# every key an overlay sets, [TRAJ] has MAX_VELOCITY and MAX_LINEAR_VELOCITY
+settingKeys = limitKeys + ['MAX_LINEAR_VELOCITY']
+
+# Every axis of a drives file: {'AXIS_0': {'rpm', 'torque', 'pitch', 'mass', 'ratio', 'inertia', 'efficiency'}}
+#   rpm: top speed of the motor, torque: what it has left at that speed for accelerating (oz-in),
+#   pitch: travel per turn of the ballscrew (machine units), mass: what the axis moves (lb),
+#   ratio: motor turns per ballscrew turn (default 1), inertia: of the rotor, pulleys and ballscrew
+#   seen at the motor shaft (oz-in-s^2, default 0), efficiency: of the ballscrew and belt (default 0.9)
+driveKeys = ['rpm', 'torque', 'pitch', 'mass']
+
+def loadDrives(path):
+    with io.open(path, 'r', encoding='utf-8') as jsonFile:
+        try:
+            drives = json.load(jsonFile)
+        except ValueError as error:
+            raise ValueError('{}: {}'.format(path, error))
+    if not isinstance(drives, dict):
+        raise ValueError('{}: expected {{"AXIS_n": {{...}}}}'.format(path))
+    for section, drive in drives.items():
+        if not re.match(r'^AXIS_\d+$', section) or not isinstance(drive, dict):
+            raise ValueError('{}: {} is not an [AXIS_n] drive'.format(path, section))
+        missing = [key for key in driveKeys if key not in drive]
+        if missing:
+            raise ValueError('{}: {} has no {}'.format(path, section, ', '.join(missing)))
+        for key, value in drive.items():
+            if not isinstance(value, (int, float)) or value < 0 or (value == 0 and key != 'inertia'):
+                raise ValueError('{}: {} {} must be a positive number'.format(path, section, key))
+    return dict((str(section), drive) for section, drive in drives.items())
+
+# A limit as it is written to an INI, 4 decimals at most
+def formatLimit(value):
+    return '{:.4f}'.format(value).rstrip('0').rstrip('.')
+
+def floatOrNone(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def metricUnits(values):
+    return values.get('TRAJ', {}).get('LINEAR_UNITS', 'inch').lower() in ['mm', 'metric', 'millimeter']
+
+# [AXIS_n] of every linear axis in [TRAJ]COORDINATES (X Y Z if the INI has none), an axis listed
+# twice (gantry) only once
+def linearAxes(values):
+    coordinates = values.get('TRAJ', {}).get('COORDINATES', 'X Y Z').replace(' ', '').upper()
+    sections = []
+    for letter in coordinates:
+        if letter in linearLetters:
+            section = 'AXIS_{}'.format(axisLetters.index(letter))
+            if section not in sections and values.get(section, {}).get('TYPE', 'LINEAR').upper() != 'ANGULAR':
+                sections.append(section)
+    return sections
+
+# The feed ceiling of the UI in units/min: the fastest linear axis, rounded up to 50
+def uiCeiling(values):
+    velocities = [floatOrNone(values.get(section, {}).get('MAX_VELOCITY')) for section in linearAxes(values)]
+    velocities = [velocity for velocity in velocities if velocity is not None]
+    if not velocities:
+        return None
+    return math.ceil(max(velocities) * 60 / 50 - 1e-6) * 50.0
+
+class AxisLimits:
+
+    # drives as loadDrives() gives them, stepLimits {section: velocity} caps an axis at what its
+    # step timing allows (see steptiming.py)
+    def __init__(self, drives, stepLimits=None):
+        self.drives = drives
+        self.stepLimits = stepLimits or {}
+
+    # Top speed (units/s) and acceleration (units/s^2) the motor can give the axis at that speed. The
+    # rotating inertia counts as the mass that would take the same force at the ballscrew nut.
+    def motion(self, drive, metric):
+        ratio = drive.get('ratio', 1.0)
+        speed = drive['rpm'] / 60.0 / ratio * drive['pitch']
+        pitch = drive['pitch'] / 25.4 if metric else drive['pitch']
+        radians = 2 * math.pi * ratio / pitch
+        force = drive['torque'] / 16.0 * radians * drive.get('efficiency', 0.9)
+        mass = drive['mass'] / gravity + drive.get('inertia', 0.0) / 16.0 * radians ** 2
+        acceleration = force / mass
+        if metric:
+            acceleration *= 25.4
+        return speed, acceleration
+
+    # One entry per drive of an [AXIS_n] in {section: {key: value}}:
+    #   {'axis', 'speed', 'acceleration', 'binding', 'current', 'limits'}
+    # The stepgen gets all of the motor and the planner its share of it by the stepgen headroom of
+    # the INI, the jog velocity keeps its ratio to MAX_VELOCITY.
+    def axes(self, values):
+        metric = metricUnits(values)
+        axes = []
+        for section in sorted(self.drives, key=lambda name: int(name.split('_')[1])):
+            if section not in values:
+                continue
+            current = dict((key, floatOrNone(values[section].get(key))) for key in limitKeys)
+            speed, acceleration = self.motion(self.drives[section], metric)
+            binding = 'motor speed'
+            if section in self.stepLimits and self.stepLimits[section] < speed:
+                speed = self.stepLimits[section]
+                binding = 'step rate'
+            velocityHeadroom = stepgenHeadroom['velocity']
+            if current['STEPGEN_MAX_VEL'] and current['MAX_VELOCITY']:
+                velocityHeadroom = current['STEPGEN_MAX_VEL'] / current['MAX_VELOCITY']
+            accelerationHeadroom = stepgenHeadroom['acceleration']
+            if current['STEPGEN_MAXACCEL'] and current['MAX_ACCELERATION']:
+                accelerationHeadroom = current['STEPGEN_MAXACCEL'] / current['MAX_ACCELERATION']
+            limits = {'STEPGEN_MAX_VEL': speed, 'MAX_VELOCITY': speed / velocityHeadroom,
+                      'STEPGEN_MAXACCEL': acceleration, 'MAX_ACCELERATION': acceleration / accelerationHeadroom}
+            if current['MAX_JOG_VELOCITY_UPS'] is not None and current['MAX_VELOCITY']:
+                limits['MAX_JOG_VELOCITY_UPS'] = limits['MAX_VELOCITY'] * current['MAX_JOG_VELOCITY_UPS'] / current['MAX_VELOCITY']
+            axes.append({'axis': section, 'speed': speed, 'acceleration': acceleration, 'binding': binding,
+                         'current': current, 'limits': limits})
+        return axes
+
+    # [TRAJ] limits that go with the axes: the vector of the MAX_VELOCITY of every linear axis, as
+    # in Tormach's configs. MAX_LINEAR_VELOCITY only if the INI has it.
+    def traj(self, values, axes):
+        velocities = dict((section, floatOrNone(values.get(section, {}).get('MAX_VELOCITY'))) for section in linearAxes(values))
+        velocities.update((axis['axis'], axis['limits']['MAX_VELOCITY']) for axis in axes if axis['axis'] in velocities)
+        velocities = [velocity for velocity in velocities.values() if velocity is not None]
+        if not axes or not velocities:
+            return {}
+        velocity = math.sqrt(sum(velocity ** 2 for velocity in velocities))
+        traj = {'MAX_VELOCITY': velocity}
+        if 'MAX_LINEAR_VELOCITY' in values.get('TRAJ', {}):
+            traj['MAX_LINEAR_VELOCITY'] = velocity
+        return traj
+
+    # The values the axes and [TRAJ] get, as {section: {key: INI text}}
+    def settings(self, axes, traj):
+        settings = dict((axis['axis'], dict((key, formatLimit(value)) for key, value in axis['limits'].items())) for axis in axes)
+        if traj:
+            settings['TRAJ'] = dict((key, formatLimit(value)) for key, value in traj.items())
+        return settings
+
+    # Lines that explain the limits of every axis
+    def explain(self, axes, traj):
+        lines = []
+        for axis in axes:
+            drive = self.drives[axis['axis']]
+            lines.append('{}: {:g} rpm, {:g} oz-in, {:g}:1 to a {:g} pitch ballscrew moving {:g} lb'.format(
+                axis['axis'], drive['rpm'], drive['torque'], drive.get('ratio', 1.0), drive['pitch'], drive['mass']))
+            lines.append('    {:.3f} units/s limited by the {}, {:.1f} units/s^2 from the torque'.format(
+                axis['speed'], axis['binding'], axis['acceleration']))
+            for key in limitKeys:
+                if key in axis['limits']:
+                    current = axis['current'][key]
+                    lines.append('    {} {} (was {})'.format(key, formatLimit(axis['limits'][key]),
+                                                             '-' if current is None else formatLimit(current)))
+        for key in sorted(traj):
+            lines.append('TRAJ {} {}'.format(key, formatLimit(traj[key])))
+        return lines
+
+    # INI text with the limits of every axis and [TRAJ], laid over a specific INI by apply()
+    def overlay(self, axes, traj, name):
+        lines = ['# Axis limits for {} written by PathPirate'.format(name)]
+        lines.extend('# {}'.format(line) for line in self.explain(axes, traj))
+        settings = self.settings(axes, traj)
+        for section in [axis['axis'] for axis in axes] + (['TRAJ'] if traj else []):
+            lines.append('')
+            lines.append('[{}]'.format(section))
+            lines.extend('{} = {}'.format(key, settings[section][key]) for key in settingKeys if key in settings[section])
+        return '\n'.join(lines) + '\n'
+
+    # Set the limits in an IniFile, returns the number of keys that changed
+    def apply(self, iniFile, axes, traj):
+        changed = 0
+        for section, entries in sorted(self.settings(axes, traj).items()):
+            for key in settingKeys:
+                if key in entries and iniFile.get(section, key) != entries[key]:
+                    iniFile.set(section, key, entries[key])
+                    changed += 1
+        return changed
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Work out the axis and [TRAJ] velocity and acceleration limits of an INI from the '
+                                     'motors, pulleys and ballscrews of its servo driven axes.')
+    parser.add_argument('ini', help='INI to read the current limits and stepgen headroom from')
+    parser.add_argument('drives', help='JSON file with the drive of each axis: {"AXIS_0": {"rpm": ..., "torque": <oz-in>, '
+                        '"pitch": <units/turn>, "mass": <lb>, "ratio": <motor turns/screw turn>, "inertia": <oz-in-s^2>, '
+                        '"efficiency": ...}}')
+    parser.add_argument('-o', '--overlay', help='write the limits as an INI overlay to this file')
+    parser.add_argument('--apply', action='store_true', help='write the limits into the INI itself')
+    args = parser.parse_args()
+    try:
+        axisLimits = AxisLimits(loadDrives(args.drives))
+    except (IOError, OSError, ValueError) as error:
+        sys.exit(str(error))
+    iniFile = IniFile.read(args.ini)
+    values = iniFile.values()
+    axes = axisLimits.axes(values)
+    if not axes:
+        sys.exit('{} has none of the axes of {}'.format(args.ini, args.drives))
+    traj = axisLimits.traj(values, axes)
+    print('\n'.join(axisLimits.explain(axes, traj)))
+    changed = axisLimits.apply(iniFile, axes, traj)
+    ceiling = uiCeiling(iniFile.values())
+    if ceiling is not None:
+        print('UI feed ceiling {:.1f} units/min'.format(ceiling))
+    if args.overlay:
+        with open(args.overlay, 'w') as file:
+            file.write(axisLimits.overlay(axes, traj, os.path.basename(args.ini)))
+    if args.apply and changed:
+        iniFile.write(args.ini)
@@ -0,0 +1,291 @@
+'''
+backupstore keeps the files PathPirate changes in a content addressed store
+so they can be restored without keeping a full .bak copy of every file.
+
+Copyright (C) 2023, 2024, 2025, 2026 Gregory D Carl
+
+This program is free software; you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with this program; if not, write to the Free Software Foundation, Inc.,
+51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+'''
+
+from shutil import copyfile, rmtree
+import os
+import json
+import time
+import hashlib
+
+def fileDigest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(65536), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+# sha256 of files keyed by path, reused while the size and mtime have not changed
+class DigestCache:
+
+    def __init__(self, cacheFile):
+        self.cacheFile = cacheFile
+        self.entries = None
+        self.changed = False
+
+    def load(self):
+        if self.entries is None:
+            self.entries = {}
+            if os.path.exists(self.cacheFile):
+                try:
+                    with open(self.cacheFile, 'r') as jsonFile:
+                        self.entries = json.load(jsonFile)
+                except ValueError:
+                    self.entries = {}
+        return self.entries
+
+    def save(self):
+        if not self.changed:
+            return
+        folder = os.path.dirname(self.cacheFile)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        tempFile = '{}.{}.tmp'.format(self.cacheFile, os.getpid())
+        with open(tempFile, 'w') as jsonFile:
+            json.dump(self.entries, jsonFile, indent=4, sort_keys=True)
+        os.rename(tempFile, self.cacheFile)
+        self.changed = False
+
+    def digest(self, path):
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        entry = self.load().get(path)
+        if entry is not None and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+            return entry['digest']
+        digest = fileDigest(path)
+        self.entries[path] = {'size': stat.st_size, 'mtime': stat.st_mtime, 'digest': digest}
+        self.changed = True
+        return digest
+
+# Layout under <root>/.pathpirate:
+#   objects/<xx>/<sha256>  one blob per distinct file content, shared by every path that had it
+#   state.json             list of generations, oldest first. Each generation is one button
+#                          operation and maps the paths it changed (relative to root) to the
+#                          digest and mode they had before the change, or None if the operation
+#                          created them.
+# The first generation holds the original PathPilot files and is never pruned. Later generations
+# are merged together once there are more than maxGenerations of them.
+class BackupStore:
+
+    def __init__(self, root, maxGenerations=5):
+        self.root = root
+        self.storeDir = os.path.join(root, '.pathpirate')
+        self.objectDir = os.path.join(self.storeDir, 'objects')
+        self.stateFile = os.path.join(self.storeDir, 'state.json')
+        self.maxGenerations = maxGenerations
+        self.generations = None
+        self.pendingLabel = None
+        self.openGeneration = None
+
+    def load(self):
+        if self.generations is None:
+            self.generations = []
+            if os.path.exists(self.stateFile):
+                with open(self.stateFile, 'r') as jsonFile:
+                    self.generations = json.load(jsonFile)['generations']
+        return self.generations
+
+    def save(self):
+        if not os.path.exists(self.storeDir):
+            os.makedirs(self.storeDir)
+        tempFile = '{}.tmp'.format(self.stateFile)
+        with open(tempFile, 'w') as jsonFile:
+            json.dump({'generations': self.generations}, jsonFile, indent=4, sort_keys=True)
+        os.rename(tempFile, self.stateFile)
+
+    def relative(self, path):
+        return os.path.relpath(path, self.root)
+
+    def absolute(self, path):
+        return os.path.join(self.root, path)
+
+    def blobPath(self, digest):
+        return os.path.join(self.objectDir, digest[:2], digest)
+
+    # Start a restore point for one operation, it is only written once something is recorded
+    def beginGeneration(self, label):
+        self.load()
+        self.pendingLabel = label
+        self.openGeneration = None
+
+    def currentGeneration(self):
+        generations = self.load()
+        if self.pendingLabel is not None:
+            generations.append({'label': self.pendingLabel, 'time': time.time(), 'files': {}})
+            self.openGeneration = generations[-1]
+            self.pendingLabel = None
+            self.prune()
+        if not generations:
+            generations.append({'label': 'unnamed', 'time': time.time(), 'files': {}})
+        return generations[-1]
+
+    # Drop the restore point begun last once its operation was undone, the files are back the way the
+    # generation before it left them. Blobs no other generation uses are removed with it.
+    def discardGeneration(self):
+        self.pendingLabel = None
+        generations = self.load()
+        if self.openGeneration is not None and generations and generations[-1] is self.openGeneration:
+            generations.pop()
+            keep = set()
+            for generation in generations:
+                keep.update(entry['digest'] for entry in generation['files'].values() if entry)
+            self.removeUnused(keep)
+            self.save()
+        self.openGeneration = None
+
+    # Record the content a file has before it is changed, once per generation. Returns the entry
+    # ({'digest', 'mode'}, or None if the generation created the file).
+    def backup(self, path):
+        generation = self.currentGeneration()
+        relPath = self.relative(path)
+        if relPath in generation['files']:
+            return generation['files'][relPath]
+        digest = fileDigest(path)
+        mode = os.stat(path).st_mode & 0o7777
+        blob = self.blobPath(digest)
+        if not os.path.exists(blob):
+            if not os.path.exists(os.path.dirname(blob)):
+                os.makedirs(os.path.dirname(blob))
+            tempFile = '{}.tmp'.format(blob)
+            copyfile(path, tempFile)
+            os.rename(tempFile, blob)
+        generation['files'][relPath] = {'digest': digest, 'mode': mode}
+        self.save()
+        return generation['files'][relPath]
+
+    # Record that an operation is about to create a file that did not exist before
+    def created(self, path):
+        if os.path.exists(path):
+            return self.backup(path)
+        generation = self.currentGeneration()
+        relPath = self.relative(path)
+        if relPath not in generation['files']:
+            generation['files'][relPath] = None
+            self.save()
+        return generation['files'][relPath]
+
+    # Put one file back the way a backup entry recorded it (removed if the entry is None), through
+    # a temp file so it is never left half written. Returns False if it already was that way.
+    def restoreFile(self, path, entry):
+        if entry is None:
+            if os.path.exists(path):
+                os.remove(path)
+                return True
+            return False
+        blob = self.blobPath(entry['digest'])
+        if os.path.exists(path) and os.path.getsize(path) == os.path.getsize(blob) and fileDigest(path) == entry['digest']:
+            return False
+        tempFile = '{}.pathpirate.tmp'.format(path)
+        copyfile(blob, tempFile)
+        os.chmod(tempFile, entry['mode'])
+        os.rename(tempFile, path)
+        return True
+
+    def isTracked(self, path):
+        relPath = self.relative(path)
+        return any(relPath in generation['files'] for generation in self.load())
+
+    # Blob holding the original (pre PathPirate) content of a file, or None
+    def original(self, path):
+        relPath = self.relative(path)
+        for generation in self.load():
+            if relPath in generation['files']:
+                entry = generation['files'][relPath]
+                return self.blobPath(entry['digest']) if entry else None
+        return None
+
+    # Merge the second oldest generation into the next one so the original is always kept
+    def prune(self):
+        while len(self.generations) > self.maxGenerations:
+            older = self.generations.pop(1)
+            newer = self.generations[1]
+            for relPath, entry in older['files'].items():
+                newer['files'][relPath] = entry
+            newer['label'] = '{} + {}'.format(older['label'], newer['label'])
+
+    # Put every file back the way it was before generation 'index' (0 = before PathPirate) and
+    # drop that generation and everything after it. Files that already match are skipped, the
+    # last path needing a blob gets the blob renamed into place, any others get a copy renamed
+    # into place, so no file is ever left half written. Returns (restored, removed) path lists.
+    def restore(self, index=0):
+        generations = self.load()
+        target = {}
+        for generation in generations[index:]:
+            for relPath, entry in generation['files'].items():
+                target.setdefault(relPath, entry)
+        del generations[index:]
+        keep = set()
+        for generation in generations:
+            keep.update(entry['digest'] for entry in generation['files'].values() if entry)
+        uses = {}
+        for entry in target.values():
+            if entry:
+                uses[entry['digest']] = uses.get(entry['digest'], 0) + 1
+        restored = []
+        removed = []
+        for relPath in sorted(target):
+            path = self.absolute(relPath)
+            entry = target[relPath]
+            if entry is None:
+                if os.path.exists(path):
+                    os.remove(path)
+                    removed.append(path)
+                continue
+            digest = entry['digest']
+            uses[digest] -= 1
+            blob = self.blobPath(digest)
+            if os.path.exists(path) and os.path.getsize(path) == os.path.getsize(blob) and fileDigest(path) == digest:
+                continue
+            tempFile = '{}.pathpirate.tmp'.format(path)
+            if uses[digest] == 0 and digest not in keep:
+                try:
+                    os.rename(blob, tempFile)
+                except OSError:
+                    copyfile(blob, tempFile)
+            else:
+                copyfile(blob, tempFile)
+            os.chmod(tempFile, entry['mode'])
+            os.rename(tempFile, path)
+            restored.append(path)
+        self.removeUnused(keep)
+        if generations:
+            self.save()
+        else:
+            # the store folder is shared with the manifest, only remove it once it is empty
+            if os.path.exists(self.objectDir):
+                rmtree(self.objectDir)
+            if os.path.exists(self.stateFile):
+                os.remove(self.stateFile)
+            if os.path.exists(self.storeDir) and not os.listdir(self.storeDir):
+                os.rmdir(self.storeDir)
+            self.generations = []
+        return restored, removed
+
+    def removeUnused(self, keep):
+        if not os.path.exists(self.objectDir):
+            return
+        for folder in os.listdir(self.objectDir):
+            for digest in os.listdir(os.path.join(self.objectDir, folder)):
+                if digest not in keep:
+                    os.remove(os.path.join(self.objectDir, folder, digest))
+
+    # (label, time, number of files) for each restore point, oldest first
+    def listGenerations(self):
+        return [(generation['label'], generation['time'], len(generation['files'])) for generation in self.load()]
@@ -0,0 +1,172 @@
+'''
+dryrun checks every PathPirate text replacement against captured copies of
+each supported PathPilot version without changing any file.
+
+Copyright (C) 2023, 2024, 2025, 2026 Gregory D Carl
+
+This program is free software; you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with this program; if not, write to the Free Software Foundation, Inc.,
+51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+'''
+
+from multiprocessing import Pool
+import sys
+import os
+import io
+import json
+import hashlib
+import argparse
+from pathpirate import PathPirate
+from backupstore import DigestCache
+
+# A PathPirate for one version of a fixture tree laid out as <fixtures>/<version>/tmc/...,
+# only the paths and the edit plan are used
+class DryRunPathPirate(PathPirate):
+
+    machines = ['1100-3', '15L Slant-PRO']
+
+    def __init__(self, home, version):
+        self.setup(home)
+        self.currentVer = version
+        self.majorVer, self.minorVer, self.patchVer = self.versionTuple(version)
+
+    # The edit plans of every machine type, each file and set of edits only once
+    def plan(self):
+        plan = []
+        seen = set()
+        for machine in self.machines:
+            for operation, path, patch in self.textEditPlan(machine):
+                edits = patch['edits']
+                key = (path, json.dumps(edits))
+                if key not in seen:
+                    seen.add(key)
+                    plan.append((operation, path, edits))
+        return plan
+
+def editsDigest(edits):
+    return hashlib.sha256(json.dumps(edits, sort_keys=True).encode('utf-8')).hexdigest()
+
+# Pool worker, counts the matches of every replacement in the files of one version
+def checkVersion(args):
+    home, version, todo = args
+    pathPirate = DryRunPathPirate(home, version)
+    results = []
+    for operation, relPath, path, edits, key in todo:
+        with io.open(path, 'r', encoding='utf-8', errors='replace') as file:
+            text = file.read()
+        _, counts = pathPirate.replaceText(text, edits)
+        results.append((operation, relPath, edits, key, counts))
+    return version, results
+
+def loadCache(cacheFile):
+    if os.path.exists(cacheFile):
+        try:
+            with open(cacheFile, 'r') as jsonFile:
+                return json.load(jsonFile)
+        except ValueError:
+            pass
+    return {}
+
+def saveCache(cacheFile, cache):
+    folder = os.path.dirname(cacheFile)
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    tempFile = '{}.tmp'.format(cacheFile)
+    with open(tempFile, 'w') as jsonFile:
+        json.dump(cache, jsonFile, indent=4, sort_keys=True)
+    os.rename(tempFile, cacheFile)
+
+# Returns {version: [(operation, relPath, edits, counts or None if missing, cached)]} and the
+# versions that have no fixture. Results are cached by version, file digest and edits digest.
+def dryRun(fixtureDir, versions, jobs=None):
+    storeDir = os.path.join(fixtureDir, '.pathpirate')
+    digests = DigestCache(os.path.join(storeDir, 'digests.json'))
+    cacheFile = os.path.join(storeDir, 'dryrun.json')
+    cache = loadCache(cacheFile)
+    # versions not checked this time keep their entries
+    newCache = dict((key, counts) for key, counts in cache.items() if key.split('|')[0] not in versions)
+    results = {}
+    skipped = []
+    work = []
+    for version in versions:
+        home = os.path.join(fixtureDir, version)
+        if not os.path.isdir(os.path.join(home, 'tmc')):
+            skipped.append(version)
+            continue
+        results[version] = []
+        todo = []
+        for operation, path, edits in DryRunPathPirate(home, version).plan():
+            relPath = os.path.relpath(path, home)
+            if not os.path.exists(path):
+                results[version].append((operation, relPath, edits, None, False))
+                continue
+            key = '|'.join([version, relPath, digests.digest(path), editsDigest(edits)])
+            if key in cache:
+                newCache[key] = cache[key]
+                results[version].append((operation, relPath, edits, cache[key], True))
+            else:
+                todo.append((operation, relPath, path, edits, key))
+        if todo:
+            work.append((home, version, todo))
+    digests.save()
+    if work:
+        pool = Pool(jobs)
+        try:
+            checked = pool.map(checkVersion, work)
+        finally:
+            pool.close()
+            pool.join()
+        for version, versionResults in checked:
+            for operation, relPath, edits, key, counts in versionResults:
+                newCache[key] = counts
+                results[version].append((operation, relPath, edits, counts, False))
+    # checked versions only keep entries for their files as they are now
+    saveCache(cacheFile, newCache)
+    return results, skipped
+
+def main():
+    parser = argparse.ArgumentParser(description='Check that every PathPirate text replacement still matches each PathPilot '
+                                     'version, using fixture trees laid out as <fixtures>/<version>/tmc/...')
+    parser.add_argument('fixtures', help='folder holding one captured home folder per version')
+    parser.add_argument('--version', action='append', help='only check this version, can be repeated')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='parallel processes (default: one per CPU)')
+    args = parser.parse_args()
+    versionList = DryRunPathPirate.versionList
+    versions = args.version or versionList
+    unknown = [version for version in versions if version not in versionList]
+    if unknown:
+        parser.error('unsupported version(s): {}'.format(', '.join(unknown)))
+    results, skipped = dryRun(os.path.abspath(args.fixtures), versions, args.jobs)
+    failed = 0
+    for version in versions:
+        for operation, relPath, edits, counts, cached in sorted(results.get(version, []), key=lambda result: result[1]):
+            if counts is None:
+                status = 'MISSING'
+            elif 0 in counts:
+                status = 'NO MATCH'
+            else:
+                status = 'OK'
+            if status != 'OK':
+                failed += 1
+            print('{:8} {:7} {:56} {:10} {}{}'.format(version, operation, relPath, status,
+                                                     counts if counts is not None else '', ' (cached)' if cached else ''))
+            for (old, _), count in zip(edits, counts or []):
+                if count == 0:
+                    print('    not found: {}'.format(old.strip().splitlines()[0]))
+    if skipped:
+        print('No fixture for: {}'.format(', '.join(skipped)))
+    print('{} file(s) failed'.format(failed))
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,306 @@
+'''
+ethtiming profiles the packet timing of a hm2_eth board (7i92/7i92T) in the
+servo thread and sets up queued reads and the DPLL timer to shorten it.
+
+Copyright (C) 2023, 2024, 2025, 2026 Gregory D Carl
+
+This program is free software; you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with this program; if not, write to the Free Software Foundation, Inc.,
+51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+'''
+
+import sys
+import os
+import re
+import json
+import math
+from inimodel import IniFile, IniCache, replaceFile
+from backupstore import BackupStore
+from servolatency import ServoLatency
+
+# hostmot2 functions of an Ethernet board that wait on the network
+ethFunctions = ['read-request', 'read', 'write']
+
+# HAL file ethtiming writes next to the INI. read-request goes to the front of the servo thread and
+# motion-command-handler, which needs nothing from the board, runs while the reply is on the wire.
+# read() then only waits for what is left of the round trip. The file is only listed in the [HAL] of
+# the 7i92 specific INI, a 5i25 mill loads the same tormach_mill_mesa.hal and has no read-request.
+queuedReadHal = 'pathpirate_eth_timing.hal'
+queuedReadLines = ['# Added by PathPirate ethtiming: queued reads, see ethtiming.py',
+                   'addf hm2_[HOSTMOT2](BOARD).0.read-request servo-thread 1',
+                   'delf motion-command-handler servo-thread',
+                   'addf motion-command-handler servo-thread 2']
+
+# Names in the last column of a halcmd 'show' table
+def showNames(out):
+    return [line.split()[-1] for line in out.splitlines() if len(line.split()) >= 2]
+
+# HALFILE list of the base INI of a specific INI
+def baseHalFiles(iniFile):
+    base = iniFile.base()
+    if base is None or not os.path.exists(base):
+        return []
+    return IniFile.read(base).getAll('HAL', 'HALFILE')
+
+# List the queued read HAL file in the [HAL] of a specific INI, right after the mill HAL file. A key
+# of the specific INI takes the place of the one of its base, so a specific INI without a HALFILE list
+# of its own first gets a copy of the base list. Raises ValueError if there is no mill HAL file.
+def addQueuedRead(iniFile):
+    if queuedReadHal in iniFile.getAll('HAL', 'HALFILE'):
+        return False
+    if not iniFile.getAll('HAL', 'HALFILE'):
+        iniFile.addLines('HAL', ['HALFILE = {}'.format(name) for name in baseHalFiles(iniFile)])
+    if not iniFile.insertAfter('HAL', 'HALFILE', queuedReadHal, 'HALFILE', 'tormach_mill_mesa.hal'):
+        raise ValueError('{} has no HALFILE = tormach_mill_mesa.hal to load {} after'.format(iniFile.path, queuedReadHal))
+    return True
+
+# Take the queued read HAL file out of the [HAL] of a specific INI again, along with the copy of the
+# base list if that is all that is left. Returns False if it was not there.
+def removeQueuedRead(iniFile):
+    if not iniFile.removeLines('HAL', 'HALFILE', queuedReadHal):
+        return False
+    if iniFile.getAll('HAL', 'HALFILE') == baseHalFiles(iniFile):
+        iniFile.removeLines('HAL', 'HALFILE')
+    return True
+
+# Records the hostmot2 functions of one Ethernet board (e.g. hm2_7i92.0) along with the servo
+# thread. Times HAL gives in CPU clocks are kept in ns. try() changes the thread and the DPLL the
+# way the INI and HAL file would after --apply, restore() puts back what it changed.
+class EthTiming:
+
+    def __init__(self, session, board, period, thread='servo-thread', clock=None):
+        self.session = session
+        self.board = board
+        self.period = period
+        self.thread = thread
+        self.clock = clock
+        self.changes = []
+
+    def run(self, *args):
+        out, err = self.session.command(*args)
+        if err.strip():
+            raise ValueError('{}: {}'.format(' '.join(args), err.strip()))
+        return out
+
+    def function(self, name):
+        return '{}.{}'.format(self.board, name)
+
+    def functions(self):
+        return showNames(self.run('show', 'funct'))
+
+    # Functions of the thread in the order they run
+    def threadOrder(self):
+        order = []
+        inThread = False
+        for line in self.run('show', 'thread').splitlines():
+            tokens = line.split()
+            if self.thread in tokens:
+                inThread = True
+            elif inThread and len(tokens) == 2 and tokens[0].isdigit():
+                order.append(tokens[1])
+            elif inThread and tokens:
+                break
+        return order
+
+    def getp(self, name):
+        out, err = self.session.command('getp', name)
+        if err.strip():
+            return None
+        try:
+            return float(out.strip())
+        except ValueError:
+            return None
+
+    # {'queued', 'timerNumber', 'timerUs', 'jitter', 'thread', 'functions': {name: {'mean', 'max'}},
+    #  'phaseError', 'packetErrors', 'samples', 'dropped'} over a number of seconds, times in ns
+    def profile(self, seconds):
+        snapshot = self.session.snapshot()
+        functions = [name for name in ethFunctions if self.function(name) in self.functions()]
+        phase = '{}.dpll.phase-error-us'.format(self.board)
+        packetErrors = '{}.packet-error-level'.format(self.board)
+        watch = ['{}.time'.format(self.function(name)) for name in functions]
+        watch += [pin for pin in [phase, packetErrors] if snapshot.has_pin(pin)]
+        latency = ServoLatency(self.session, self.period, self.thread, self.clock, watch)
+        latency.record(seconds)
+        self.clock = latency.clock
+        scale = 1e9 / self.clock
+        profile = {'queued': self.function('read-request') in self.threadOrder(),
+                   'timerNumber': self.getp('{}.stepgen.timer-number'.format(self.board)),
+                   'timerUs': self.getp('{}.dpll.01.timer-us'.format(self.board)),
+                   'jitter': latency.jitter.maximum or 0.0, 'thread': latency.tmax or 0.0, 'functions': {},
+                   'phaseError': max([abs(value) for value in latency.watched.get(phase, [])] or [None]),
+                   'packetErrors': max(latency.watched.get(packetErrors, []) or [None]),
+                   'samples': latency.jitter.count, 'dropped': latency.dropped}
+        for name in functions:
+            times = [value * scale for value in latency.watched['{}.time'.format(self.function(name))]]
+            longest = max(times + [latency.functions.get(self.function(name), 0.0)])
+            profile['functions'][name] = {'mean': sum(times) / len(times) if times else 0.0, 'max': longest}
+        return profile
+
+    # setp that is undone by restore()
+    def setp(self, name, value):
+        old = self.getp(name)
+        if old is None:
+            return False
+        self.run('setp', name, str(value))
+        self.changes.append(('setp', name, '{:g}'.format(old)))
+        return True
+
+    # Queue the read and sample the stepgens on DPLL timer 1 timerUs from the read, in the running HAL
+    def tryQueued(self, timerUs):
+        if self.function('read-request') in self.functions() and self.function('read-request') not in self.threadOrder():
+            self.run('addf', self.function('read-request'), self.thread, '1')
+            self.changes.append(('delf', self.function('read-request'), self.thread))
+            if 'motion-command-handler' in self.threadOrder():
+                position = self.threadOrder().index('motion-command-handler') + 1
+                self.run('delf', 'motion-command-handler', self.thread)
+                self.run('addf', 'motion-command-handler', self.thread, '2')
+                self.changes.append(('move', 'motion-command-handler', str(position)))
+        self.setp('{}.dpll.01.timer-us'.format(self.board), timerUs)
+        self.setp('{}.stepgen.timer-number'.format(self.board), 1)
+
+    def restore(self):
+        for change in reversed(self.changes):
+            if change[0] == 'move':
+                self.session.command('delf', change[1], self.thread)
+                self.session.command('addf', change[1], self.thread, change[2])
+            else:
+                self.session.command(*change)
+        self.changes = []
+
+# DPLL timer (us, negative is before the read) that samples before the earliest the read request
+# can reach the board: the worst late start of the thread plus sending the request, with 20 us
+# spare, rounded up to 10 us, at least 50 us and within the first half of the period
+def dpllTimer(profile, period):
+    request = profile['functions'].get('read-request', profile['functions'].get('read', {})).get('max', 0.0)
+    lead = int(math.ceil(((profile['jitter'] + request) / 1000.0 + 20) / 10.0)) * 10
+    return -min(max(lead, 50), period // 2000)
+
+def formatUs(value):
+    return '-' if value is None else '{:.1f} us'.format(value / 1000.0)
+
+# Lines that compare a profile before and after a change, after can be None
+def report(board, period, before, after=None):
+    profiles = [profile for profile in [before, after] if profile is not None]
+    lines = ['{} in a {:.0f} us servo thread'.format(board, period / 1000.0)]
+    rows = [('queued reads', ['yes' if profile['queued'] else 'no' for profile in profiles]),
+            ('DPLL timer', ['off' if profile['timerNumber'] in [None, -1] else '{:g} us'.format(profile['timerUs'] or 0)
+                            for profile in profiles])]
+    for name in ethFunctions:
+        if any(name in profile['functions'] for profile in profiles):
+            rows.append(('{} mean'.format(name), [formatUs(profile['functions'].get(name, {}).get('mean')) for profile in profiles]))
+            rows.append(('{} max'.format(name), [formatUs(profile['functions'].get(name, {}).get('max')) for profile in profiles]))
+    rows.append(('thread tmax', [formatUs(profile['thread']) for profile in profiles]))
+    rows.append(('thread tmax of period', ['{:.0f}%'.format(profile['thread'] / period * 100) for profile in profiles]))
+    rows.append(('period jitter max', [formatUs(profile['jitter']) for profile in profiles]))
+    rows.append(('DPLL phase error max', ['-' if profile['phaseError'] is None else '{:.1f} us'.format(profile['phaseError'])
+                                          for profile in profiles]))
+    rows.append(('packet error level max', ['-' if profile['packetErrors'] is None else '{:g}'.format(profile['packetErrors'])
+                                            for profile in profiles]))
+    lines.append('    {:24}{}'.format('', ''.join('{:>16}'.format(title) for title in ['before', 'after'][:len(profiles)])))
+    lines.extend('    {:24}{}'.format(name, ''.join('{:>16}'.format(value) for value in values)) for name, values in rows)
+    for profile in profiles:
+        if profile['dropped']:
+            lines.append('WARNING: {} samples were dropped'.format(profile['dropped']))
+    return lines
+
+if __name__ == '__main__':
+    import argparse
+    from halsession import HalSession
+    parser = argparse.ArgumentParser(description='Profile the Ethernet packet timing of a 7i92/7i92T in the servo thread while PathPilot '
+                                     'runs, try queued reads and the DPLL timer, and report before and after.')
+    parser.add_argument('ini', help='the *_7i92_specific.ini PathPilot runs (merged over its base INI)')
+    parser.add_argument('--board', help='HAL name of the board, e.g. hm2_7i92.0 (default: the hostmot2 board HAL has)')
+    parser.add_argument('--seconds', type=float, default=30, help='how long to record each profile (default: 30)')
+    parser.add_argument('--try', dest='tryQueued', action='store_true', help='queue the read and use the DPLL in the running HAL, '
+                        'profile again and put it back')
+    parser.add_argument('--timer-us', type=int, help='DPLL timer to try or apply (default: worked out from the profile)')
+    parser.add_argument('--before', help='compare with a profile saved with --save instead of the one recorded now')
+    parser.add_argument('--save', help='write the last profile as JSON to this file')
+    parser.add_argument('--apply', action='store_true', help='write the DPLL timer into the INI and the queued read into {}, '
+                        'which only the INI loads'.format(queuedReadHal))
+    parser.add_argument('--revert', action='store_true', help='take {} out of the INI again and exit'.format(queuedReadHal))
+    parser.add_argument('--halcmd', default=os.path.expanduser('~/tmc/bin/halcmd'), help='halcmd (halsampler is expected next to it)')
+    args = parser.parse_args()
+    configDir = os.path.dirname(os.path.abspath(args.ini))
+    halPath = os.path.join(configDir, queuedReadHal)
+    values = IniCache().values(args.ini)
+    if values.get('HOSTMOT2', {}).get('DRIVER') != 'hm2_eth':
+        sys.exit('{} does not run a hm2_eth board'.format(args.ini))
+    # restore points go where PathPirate keeps its own (~/tmc/.pathpirate for ~/tmc/configs/tormach_mill)
+    backups = BackupStore(os.path.dirname(os.path.dirname(configDir)))
+    if args.revert:
+        iniFile = IniFile.read(args.ini)
+        backups.beginGeneration('ETH TIMING REVERT')
+        if removeQueuedRead(iniFile):
+            backups.backup(args.ini)
+            iniFile.write()
+        if os.path.exists(halPath):
+            backups.backup(halPath)
+            os.remove(halPath)
+        sys.exit(0)
+    try:
+        period = int(float(values.get('EMCMOT', {}).get('SERVO_PERIOD', 1000000)))
+    except ValueError:
+        period = 1000000
+    session = HalSession(args.halcmd)
+    try:
+        board = args.board
+        if board is None:
+            boards = [match.group(1) for match in [re.match(r'^(hm2_\w+\.\d+)\.read$', name) for name in showNames(session.command('show', 'funct')[0])] if match]
+            if not boards:
+                raise ValueError('no hostmot2 board found, is PathPilot running?')
+            board = boards[0]
+        ethTiming = EthTiming(session, board, period)
+        before = ethTiming.profile(args.seconds) if not args.before else None
+        if args.before:
+            with open(args.before, 'r') as file:
+                before = json.load(file)
+        timerUs = args.timer_us if args.timer_us is not None else dpllTimer(before, period)
+        after = None
+        if args.before:
+            after = ethTiming.profile(args.seconds)
+        elif args.tryQueued:
+            print('Trying queued reads and a DPLL timer of {} us'.format(timerUs))
+            try:
+                ethTiming.tryQueued(timerUs)
+                after = ethTiming.profile(args.seconds)
+            finally:
+                ethTiming.restore()
+    except ValueError as error:
+        sys.exit(str(error))
+    finally:
+        session.close()
+    print('\n'.join(report(board, period, before, after)))
+    print('Recommended: DPLL_TIMER_NUMBER = 1, DPLL_TIMER_US = {}{}'.format(timerUs, ', queued reads' if 'read-request' in before['functions'] else
+                                                                          ' (this LinuxCNC has no read-request, reads can not be queued)'))
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump(after or before, file, indent=4, sort_keys=True)
+    if args.apply:
+        iniFile = IniFile.read(args.ini)
+        iniFile.set('HOSTMOT2', 'DPLL_TIMER_NUMBER', '1')
+        iniFile.set('HOSTMOT2', 'DPLL_TIMER_US', str(timerUs))
+        queued = 'read-request' in before['functions']
+        try:
+            if queued:
+                addQueuedRead(iniFile)
+        except ValueError as error:
+            sys.exit(str(error))
+        backups.beginGeneration('ETH TIMING')
+        backups.backup(args.ini)
+        if queued:
+            backups.created(halPath)
+            replaceFile(halPath, '\n'.join(queuedReadLines).encode('utf-8') + b'\n')
+        iniFile.write()
+        print('Restart PathPilot for the changes to take effect, --revert takes the queued read out again')
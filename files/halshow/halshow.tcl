@@ -86,6 +86,8 @@ proc saveIni {} {
             }
             puts $fc "set ::workmode $::workmode"
             puts $fc "set ::watchInterval $::watchInterval"
+            puts $fc "set ::recordInterval $::recordInterval"
+            puts $fc "set ::recordBufferSize $::recordBufferSize"
             puts $fc "set ::col1_width $::col1_width"
             puts $fc "set ::ffmts $::ffmts"
             puts $fc "set ::ifmts $::ifmts"
@@ -150,6 +152,7 @@ bind . <FocusOut> {saveIni}
 wm protocol . WM_DELETE_WINDOW askKill
 proc askKill {} {
     saveIni
+    stopRecording
     killHalConfig
 }
 
@@ -274,6 +277,11 @@ set watchmenu [menu $menubar.watch -tearoff 1]
                 watchReset all
                 setStatusbar [msgcat::mc "Watchlist cleared"]
             }
+        $watchmenu add separator
+        $watchmenu add command -label [msgcat::mc "Start Recording"] \
+            -command {startRecording}
+        $watchmenu add command -label [msgcat::mc "Stop Recording"] \
+            -command {stopRecording}
 
 . configure -menu $menubar
 
@@ -722,6 +730,8 @@ proc makeSettings {} {
     pack $f1 -expand 0 -side left
     addTextSetting $f1 ::watchInterval [msgcat::mc "Update interval (in ms)"]
     addTextSetting $f1 ::col1_width [msgcat::mc "Column width for value in watch tab"]
+    addTextSetting $f1 ::recordInterval [msgcat::mc "Recording interval (in ms)"]
+    addTextSetting $f1 ::recordBufferSize [msgcat::mc "Recording buffer (samples)"]
     pack [label $f1.label -text [msgcat::mc "Override format string (leave empty for default)"] \
         -justify left]  -anchor w -pady 2 -padx 2
     addTextSetting $f1 ::ffmts "    [msgcat::mc "Float"]"
@@ -1085,9 +1095,14 @@ set ::watchInterval 100
 proc watchLoop {} {
     set ::watching 1
     set which $::watchstring
+    set values [batchRead $::watchlist]
     foreach var $which {
         scan $var {%i %s %s} cnum vartype varname
-        refreshItem $cnum $vartype $varname
+        if {[dict exists $values $vartype+$varname]} {
+            refreshItem $cnum $vartype $varname {*}[dict get $values $vartype+$varname]
+        } else {
+            refreshItem $cnum $vartype $varname
+        }
     }
     if {$::workmode == "watchhal"} {
         after $::watchInterval watchLoop
@@ -1111,8 +1126,11 @@ proc setWatchInterval {} {
     }
 }
 
-proc refreshItem {cnum vartype varname} {
-    if {$vartype == "sig" } {
+# value and type come from batchRead, without them the item is read on its own
+proc refreshItem {cnum vartype varname {ret ""} {varnumtype ""}} {
+    if {$varnumtype != ""} {
+        # already read by batchRead
+    } elseif {$vartype == "sig" } {
         set ret [hal gets $varname]
         set varnumtype [hal stype $varname]
     } else {
@@ -1150,6 +1168,178 @@ proc refreshItem {cnum vartype varname} {
     }
 }
 
+# batchRead answers a whole watch list with one 'hal show' per type
+# of item in it instead of a getp and ptype per item. Returns a dict of
+# type+name -> {value type} for the items HAL has.
+set ::haltypes {bit float s32 u32 s64 u64 port}
+
+# 'hal show' prints integer params in hex, getp and the pins print
+# them in decimal. Signed types are read back as two's complement.
+proc halDecimal {value type} {
+    if {![string match -nocase 0x* $value] \
+            || ![string is entier -strict $value]} {
+        return $value
+    }
+    switch -- $type {
+        s32 {set bits 32}
+        s64 {set bits 64}
+        default {return [expr {$value + 0}]}
+    }
+    return [expr {$value >= 2**($bits - 1) ? $value - 2**$bits : $value}]
+}
+proc batchRead {items} {
+    set values [dict create]
+    foreach item $items {
+        set wanted($item) 1
+        set types([lindex [split $item +] 0]) 1
+    }
+    foreach vartype [array names types] {
+        if {[catch {hal show $vartype} ret]} continue
+        foreach line [split $ret "\n"] {
+            set tokens [regexp -all -inline {\S+} $line]
+            # sig lines are 'type value name', pin and param lines
+            # are 'owner type dir value name ...'
+            if {$vartype == "sig"} {
+                lassign $tokens type value name
+            } else {
+                lassign $tokens owner type dir value name
+            }
+            if {[lsearch -exact $::haltypes $type] >= 0 \
+                    && [info exists wanted($vartype+$name)]} {
+                dict set values $vartype+$name \
+                    [list [halDecimal $value $type] $type]
+            }
+        }
+    }
+    return $values
+}
+
+# Recording streams the watch list to a file every ::recordInterval ms,
+# read with batchRead. Each sample is the time in microseconds since
+# the start and one value per item, bits as 1 and 0 and items HAL no
+# longer has as nan. Samples are held in memory until
+# ::recordBufferSize of them are waiting, then written out. A .csv file
+# gets a header line and a line per sample, any other file a text
+# header line and then per sample a little-endian 64 bit integer time
+# and a 64 bit float per item.
+set ::recording 0
+set ::recordInterval 10
+set ::recordBufferSize 1000
+set ::recordtypes { {{CSV} {.csv}}\
+                    {{Binary} {.bin}}\
+                  }
+proc startRecording {} {
+    if {$::recording} {
+        setStatusbar [msgcat::mc "Already recording"]
+        return
+    }
+    if {$::watchlist == ""} {
+        setStatusbar [msgcat::mc "Add items to the watch list to record them"]
+        return
+    }
+    if {![string is integer -strict $::recordInterval] || $::recordInterval < 1} {
+        set ::recordInterval 1
+    }
+    if {![string is integer -strict $::recordBufferSize] || $::recordBufferSize < 1} {
+        set ::recordBufferSize 1
+    }
+    set rfile [tk_getSaveFile \
+            -filetypes   $::recordtypes\
+            -initialdir  $::last_watchfile_dir\
+            -initialfile halshow_recording.csv\
+            -title       [msgcat::mc "Record the watch list to"]\
+            ]
+    if {"$rfile" == ""} return
+    if {[catch {set ::recordfid [open $rfile w]} message]} {
+        setStatusbar $message
+        return
+    }
+    set ::recordFile $rfile
+    set ::recordCsv [expr {[string tolower [file extension $rfile]] == ".csv"}]
+    set ::recordItems $::watchlist
+    if {$::recordCsv} {
+        puts $::recordfid [join [concat time_us $::recordItems] ","]
+    } else {
+        puts $::recordfid "# halshow recording [llength $::recordItems]\
+            int64 time_us float64 [join $::recordItems " "]"
+        fconfigure $::recordfid -translation binary
+    }
+    set ::recordBuffer {}
+    set ::recordCount 0
+    set ::recordLate 0
+    set ::recordStart [clock microseconds]
+    set ::recordNext $::recordStart
+    set ::recording 1
+    setStatusbar "[msgcat::mc "Recording to"] $rfile"
+    recordLoop
+}
+
+# each tick is timed from the start, a tick that is more than a whole
+# interval late is counted and the ones it missed are skipped
+proc recordLoop {} {
+    if {!$::recording} return
+    set values [batchRead $::recordItems]
+    set now [clock microseconds]
+    set sample [list [expr {$now - $::recordStart}]]
+    foreach item $::recordItems {
+        set value nan
+        if {[dict exists $values $item]} {
+            set value [lindex [dict get $values $item] 0]
+            if {$value == "TRUE"} {
+                set value 1
+            } elseif {$value == "FALSE"} {
+                set value 0
+            }
+        }
+        lappend sample $value
+    }
+    lappend ::recordBuffer $sample
+    incr ::recordCount
+    if {[llength $::recordBuffer] >= $::recordBufferSize} {
+        flushRecording
+    }
+    set interval [expr {$::recordInterval * 1000}]
+    incr ::recordNext $interval
+    if {$now - $::recordNext > $interval} {
+        incr ::recordLate
+        set ::recordNext [expr {$now + $interval}]
+    }
+    set delay [expr {max(0, ($::recordNext - [clock microseconds]) / 1000)}]
+    set ::recordAfter [after $delay recordLoop]
+}
+
+proc flushRecording {} {
+    foreach sample $::recordBuffer {
+        if {$::recordCsv} {
+            puts $::recordfid [join $sample ","]
+        } else {
+            set values {}
+            foreach value [lrange $sample 1 end] {
+                if {![string is double -strict $value]} {set value NaN}
+                lappend values $value
+            }
+            puts -nonewline $::recordfid \
+                [binary format wq* [lindex $sample 0] $values]
+        }
+    }
+    set ::recordBuffer {}
+    setStatusbar "[msgcat::mc "Recording to"] $::recordFile:\
+        $::recordCount [msgcat::mc "samples"]"
+}
+
+proc stopRecording {} {
+    if {!$::recording} return
+    set ::recording 0
+    after cancel $::recordAfter
+    flushRecording
+    close $::recordfid
+    set message "$::recordCount [msgcat::mc "samples written to"] $::recordFile"
+    if {$::recordLate} {
+        append message ", $::recordLate [msgcat::mc "ticks were late"]"
+    }
+    setStatusbar $message
+}
+
 proc watchReset {del} {
     $::cisp delete all
     switch -- $del {
@@ -0,0 +1,251 @@
+'''
+halcapture records HAL pins once per period of a realtime thread, through
+the sampler component, into a bounded ring buffer.
+
+Copyright (C) 2023, 2024, 2025, 2026 Gregory D Carl
+
+This program is free software; you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with this program; if not, write to the Free Software Foundation, Inc.,
+51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+'''
+
+from subprocess import Popen, PIPE
+from collections import deque
+import os
+import time
+import select
+
+# sampler cfg letter of each HAL pin type
+samplerTypes = {'bit': 'b', 'float': 'f', 's32': 's', 'u32': 'u'}
+
+# The sampler component copies its pins into a realtime FIFO once every period of the thread it is
+# added to and halsampler prints each sample as a line: its sample number and the values. The pins
+# are only connected for the capture: the sampler pin of a pin that is on a signal is linked to that
+# signal, an unlinked output pin gets a signal of its own. stop() removes all of it again.
+# An input pin that is set from userspace instead of by its signal (setp on an unlinked pin is not
+# seen by the sampler) is driven: detach() moves it and its sampler pin onto a signal of their own
+# that keeps the value the pin had, drive() sets that signal and attach() links the pin to a signal
+# again. Pins in driven are detached by start(), a driven pin is left unlinked with its last value
+# by stop().
+# Samples are kept as (sample number, [values]) in a ring buffer of the newest maxSamples, a gap
+# in the sample numbers is a sample the FIFO dropped because halsampler was not read in time.
+class HalCapture:
+
+    # session is a HalSession, pins the HAL pins to record
+    def __init__(self, session, pins, thread='servo-thread', maxSamples=600000, depth=16384, driven=()):
+        self.session = session
+        self.pins = list(pins)
+        self.driven = dict((pin, None) for pin in driven)
+        self.thread = thread
+        self.depth = depth
+        self.samples = deque(maxlen=maxSamples)
+        self.process = None
+        self.pending = ''
+        self.signals = []
+        self.loaded = False
+        self.added = False
+        self.lastNumber = None
+        self.count = 0
+        self.dropped = 0
+        self.startTime = None
+
+    def halsampler(self):
+        return os.path.join(os.path.dirname(self.session.halcmd), 'halsampler')
+
+    def run(self, *args):
+        out, err = self.session.command(*args)
+        if err.strip():
+            raise ValueError('{}: {}'.format(' '.join(args), err.strip()))
+        return out
+
+    # Load and connect the sampler and start reading it, everything is undone if a step fails
+    def start(self):
+        snapshot = self.session.snapshot()
+        if not snapshot.is_running():
+            raise ValueError('HAL is not running')
+        if 'sampler' in snapshot.components:
+            raise ValueError('a sampler component is already loaded')
+        types = []
+        for pin in self.pins:
+            if not snapshot.has_pin(pin):
+                raise ValueError('pin {} not found'.format(pin))
+            entry = snapshot.pins[pin]
+            if entry['type'] not in samplerTypes:
+                raise ValueError('pin {} is a {}, the sampler can not record it'.format(pin, entry['type']))
+            # a signal without a writer would take the value the pin has now
+            if entry['signal'] is None and entry['dir'] != 'OUT' and pin not in self.driven:
+                raise ValueError('pin {} is an unlinked input, there is nothing to record'.format(pin))
+            types.append(samplerTypes[entry['type']])
+        self.run('loadrt', 'sampler', 'depth={}'.format(self.depth), 'cfg={}'.format(''.join(types)))
+        self.loaded = True
+        try:
+            for index, pin in enumerate(self.pins):
+                samplerPin = 'sampler.0.pin.{}'.format(index)
+                signal = snapshot.linked_signal(pin)
+                if pin in self.driven:
+                    self.detach(pin, snapshot)
+                elif signal is None:
+                    signal = 'pathpirate-capture-{}'.format(index)
+                    self.run('net', signal, pin, samplerPin)
+                    self.signals.append(signal)
+                else:
+                    self.run('linksp', signal, samplerPin)
+            self.run('addf', 'sampler.0', self.thread)
+            self.added = True
+            self.process = Popen([self.halsampler(), '-c', '0', '-t'], stdout=PIPE)
+            self.startTime = time.time()
+        except Exception:
+            self.stop()
+            raise
+
+    # Move a pin and its sampler pin onto a signal of their own that has the value of the pin
+    def detach(self, pin, snapshot=None):
+        if self.driven.get(pin) is not None:
+            return
+        snapshot = snapshot or self.session.snapshot()
+        index = self.pins.index(pin)
+        samplerPin = 'sampler.0.pin.{}'.format(index)
+        signal = 'pathpirate-drive-{}'.format(index)
+        if snapshot.linked_signal(pin) is not None:
+            self.run('unlinkp', pin)
+        if snapshot.linked_signal(samplerPin) is not None:
+            self.run('unlinkp', samplerPin)
+        self.run('newsig', signal, snapshot.pins[pin]['type'])
+        self.signals.append(signal)
+        self.driven[pin] = signal
+        self.run('sets', signal, snapshot.pin_value(pin))
+        self.run('linksp', signal, pin)
+        self.run('linksp', signal, samplerPin)
+
+    def drive(self, pin, value):
+        if self.driven.get(pin) is None:
+            raise ValueError('pin {} is not driven by the capture'.format(pin))
+        self.run('sets', self.driven[pin], value)
+
+    # Link a detached pin to a signal again, its sampler pin follows it
+    def attach(self, pin, signal):
+        own = self.driven.get(pin)
+        if own is None:
+            raise ValueError('pin {} is not driven by the capture'.format(pin))
+        samplerPin = 'sampler.0.pin.{}'.format(self.pins.index(pin))
+        self.run('unlinkp', pin)
+        self.run('unlinkp', samplerPin)
+        self.run('linkps', pin, signal)
+        self.run('linksp', signal, samplerPin)
+        self.run('delsig', own)
+        self.signals.remove(own)
+        del self.driven[pin]
+
+    # Period of the thread in seconds, from 'show thread'
+    def period(self, default=0.001):
+        out, err = self.session.command('show', 'thread')
+        for line in out.splitlines():
+            tokens = line.split()
+            if self.thread in tokens and tokens[0].isdigit():
+                return int(tokens[0]) / 1e9
+        return default
+
+    # Read whatever halsampler has printed, waiting up to timeout seconds for the first of it.
+    # Returns the number of samples read.
+    def poll(self, timeout=0.0):
+        if self.process is None:
+            return 0
+        read = 0
+        while True:
+            ready, _, _ = select.select([self.process.stdout], [], [], timeout)
+            if not ready:
+                return read
+            data = os.read(self.process.stdout.fileno(), 65536)
+            if not data:
+                return read
+            if not isinstance(data, str):
+                data = data.decode('utf-8', 'replace')
+            lines = (self.pending + data).split('\n')
+            self.pending = lines.pop()
+            for line in lines:
+                if self.addLine(line):
+                    read += 1
+            timeout = 0.0
+
+    def addLine(self, line):
+        tokens = line.split()
+        if len(tokens) != len(self.pins) + 1:
+            return False
+        try:
+            number = int(tokens[0])
+            values = [float(token) for token in tokens[1:]]
+        except ValueError:
+            return False
+        if self.lastNumber is not None and number > self.lastNumber + 1:
+            self.dropped += number - self.lastNumber - 1
+        self.lastNumber = number
+        self.samples.append((number, values))
+        self.count += 1
+        return True
+
+    # Record for a number of seconds, or until until() returns True
+    def record(self, seconds, until=None):
+        end = time.time() + seconds
+        while time.time() < end and not (until and until()):
+            self.poll(min(0.1, max(end - time.time(), 0.0)))
+
+    # Stop reading and take the sampler out of HAL again. Only what start() set up is removed and
+    # every step is tried even if one fails.
+    def stop(self):
+        if self.process is not None:
+            self.poll()
+            try:
+                self.process.terminate()
+                self.process.wait()
+            except OSError:
+                pass
+            self.process = None
+        if self.added:
+            self.session.command('delf', 'sampler.0', self.thread)
+            self.added = False
+        if self.loaded:
+            for pin, signal in self.driven.items():
+                if signal is not None:
+                    self.session.command('unlinkp', pin)
+                    self.driven[pin] = None
+            for index in range(len(self.pins)):
+                self.session.command('unlinkp', 'sampler.0.pin.{}'.format(index))
+            for signal in self.signals:
+                self.session.command('delsig', signal)
+            self.signals = []
+            self.session.command('unloadrt', 'sampler')
+            self.loaded = False
+
+    # {pin: [values]} of the samples in the buffer
+    def columns(self):
+        return dict((pin, [values[index] for _, values in self.samples]) for index, pin in enumerate(self.pins))
+
+    # Write the buffer as CSV: a header of 'sample' and the pins, then one line per sample
+    def save(self, path):
+        with open(path, 'w') as file:
+            file.write(','.join(['sample'] + self.pins) + '\n')
+            for number, values in self.samples:
+                file.write(','.join([str(number)] + ['{:.9g}'.format(value) for value in values]) + '\n')
+
+# (pins, [(sample number, [values])]) of a capture written by HalCapture.save()
+def loadCapture(path):
+    with open(path, 'r') as file:
+        header = file.readline().strip().split(',')
+        if not header or header[0] != 'sample':
+            raise ValueError('{} is not a PathPirate capture'.format(path))
+        samples = []
+        for line in file:
+            fields = line.strip().split(',')
+            if len(fields) == len(header):
+                samples.append((int(fields[0]), [float(field) for field in fields[1:]]))
+    return header[1:], samples
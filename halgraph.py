@@ -0,0 +1,416 @@
+'''
+halgraph parses PathPilot HAL files into a graph of components, functions,
+pins and signals so a config can be checked before PathPilot is restarted.
+
+Copyright (C) 2023, 2024, 2025, 2026 Gregory D Carl
+
+This program is free software; you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with this program; if not, write to the Free Software Foundation, Inc.,
+51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+'''
+
+import sys
+import os
+import io
+import re
+import json
+import hashlib
+from inimodel import IniCache
+
+# Read an INI file into {section: {key: value}}. A file with [INI_CONFIG]BASE_INI_FILE is laid over
+# its base file the same way PathPilot merges the *_specific.ini files over the base INI. Pass the
+# IniCache of the run so every file is only parsed once.
+def readIni(path, cache=None):
+    return (cache or IniCache()).values(path)
+
+# Layout of the graph, everything is keyed by the name HAL would use after INI substitution and
+# alias resolution, file/line point at the line that created the entry:
+#   instances  {name: {'component', 'file', 'line', 'functions'}}  one per loadrt instance
+#   functions  [[thread, function, file, line]]                    in addf order
+#   pins       {pin: {'signal', 'arrow', 'file', 'line'}}          pins linked with net
+#   signals    {signal: {'pins', 'type', 'value', 'file', 'line'}}
+#   params     {name: [value, file, line]}                         setp of params and unlinked pins
+class HalGraph:
+
+    iniReference = re.compile(r'\[([A-Za-z0-9_]+)\](?:\(([A-Za-z0-9_]+)\)|([A-Za-z0-9_]+))')
+    arrows = ['=>', '<=', '<=>']
+    # components without realtime functions
+    noFunctions = ['hostmot2']
+    # motion functions come from [EMCMOT]EMCMOT (motmod)
+    motionFunctions = ['motion-command-handler', 'motion-controller']
+    # INI keys PathPilot fills in when it starts, every *_7i92_specific.ini leaves BOARD empty on purpose.
+    # An empty or missing one is not a problem, it stands for the value here (None keeps the reference
+    # as it is, so hm2_[HOSTMOT2](BOARD).0 names match the instance loadrt creates for the board)
+    runtimeKeys = {('HOSTMOT2', 'BOARD'): None, ('EMCMOT', 'EMCMOT'): 'motmod'}
+    # directions of pins that are used without arrows, first match wins
+    knownDirections = [
+        (re.compile(r'^hm2_[^.]+\.\d+\.gpio\.\d+\.in(_not)?$'), 'out'),
+        (re.compile(r'^hm2_[^.]+\.\d+\.gpio\.\d+\.out$'), 'in'),
+        (re.compile(r'^hm2_[^.]+\.\d+\.encoder\.\d+\.(count|position|position-latched|velocity|rawcounts|input-[ab]|input-index)$'), 'out'),
+        (re.compile(r'^hm2_[^.]+\.\d+\.encoder\.\d+\.index-enable$'), 'io'),
+        (re.compile(r'^hm2_[^.]+\.\d+\.stepgen\.\d+\.(counts|position-fb|velocity-fb)$'), 'out'),
+        (re.compile(r'^hm2_[^.]+\.\d+\.stepgen\.\d+\.(enable|position-cmd|velocity-cmd|control-type)$'), 'in'),
+        (re.compile(r'^hm2_[^.]+\.\d+\.watchdog\.has_bit$'), 'io'),
+        (re.compile(r'^pid\.\d+\.(output|error|saturated|saturated-s|saturated-count)$'), 'out'),
+        (re.compile(r'^pid\.\d+\.(command|feedback|enable|command-deriv|feedback-deriv|index-enable)$'), 'in'),
+        (re.compile(r'^axis\.\d+\.(motor-pos-cmd|amp-enable-out|joint-pos-cmd|joint-vel-cmd|homing|homed|is-unlocked|unlock)$'), 'out'),
+        (re.compile(r'^axis\.\d+\.(motor-pos-fb|amp-fault-in|home-sw-in|index-enable|neg-lim-sw-in|pos-lim-sw-in)$'), 'in'),
+        (re.compile(r'^(?!hm2_)[^.]+(\.\d+)*\..*[.-]out(\d+)?$'), 'out'),
+        (re.compile(r'^(?!hm2_)[^.]+(\.\d+)*\..*[.-]in(\d+)?$'), 'in'),
+    ]
+
+    # sourceDir is the folder halcmd runs in (the installed config folder), sourced files are found
+    # there. Default is the folder of the first file parsed.
+    def __init__(self, ini=None, sourceDir=None):
+        self.ini = ini or {}
+        self.sourceDir = sourceDir
+        self.instances = {}
+        self.functions = []
+        self.pins = {}
+        self.signals = {}
+        self.params = {}
+        self.aliases = {}
+        self.userComponents = []
+        self.sources = {}
+        self.unresolved = []
+        self.errors = []
+
+    # Replace [SECTION]KEY and Tormach's [SECTION](KEY) with their INI values
+    def substitute(self, text, fileName, number):
+        def replace(match):
+            key = match.group(2) or match.group(3)
+            value = self.ini.get(match.group(1), {}).get(key)
+            if not value and (match.group(1), key) in self.runtimeKeys:
+                return self.runtimeKeys[(match.group(1), key)] or match.group(0)
+            if value is None:
+                self.unresolved.append([fileName, number, match.group(0)])
+                return match.group(0)
+            return value.strip('"')
+        return self.iniReference.sub(replace, text)
+
+    def resolve(self, name):
+        return self.aliases.get(name, name)
+
+    def parseFile(self, path):
+        with io.open(path, 'r', encoding='utf-8', errors='replace') as file:
+            text = file.read()
+        self.parseText(text, path)
+
+    def parseText(self, text, fileName):
+        if self.sourceDir is None:
+            self.sourceDir = os.path.dirname(os.path.abspath(fileName))
+        for number, line in enumerate(text.splitlines(), 1):
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            tokens = self.substitute(line, fileName, number).split()
+            handler = getattr(self, 'parse_{}'.format(tokens[0]), None)
+            if handler is not None:
+                handler(tokens[1:], fileName, number)
+
+    # Instance names created by loadrt: names=, count=, num_chan=, cfg= (debounce) or one instance
+    def parse_loadrt(self, args, fileName, number):
+        if not args:
+            return
+        component = args[0]
+        options = dict(arg.split('=', 1) for arg in args[1:] if '=' in arg)
+        base = component.replace('_', '-')
+        if component.endswith('kins') or component in self.noFunctions:
+            return
+        if component == (self.ini.get('EMCMOT', {}).get('EMCMOT') or 'motmod'):
+            self.addInstance('motion', component, self.motionFunctions, fileName, number)
+            return
+        if component.startswith('hm2_'):
+            board = self.ini.get('HOSTMOT2', {}).get('BOARD') or '[HOSTMOT2](BOARD)'
+            name = 'hm2_{}.0'.format(board)
+            self.addInstance(name, component, ['{}.read'.format(name), '{}.write'.format(name)], fileName, number)
+            return
+        if 'names' in options:
+            names = options['names'].split(',')
+        elif 'count' in options:
+            names = ['{}.{}'.format(base, index) for index in range(int(options['count']))]
+        elif 'num_chan' in options:
+            names = ['{}.{}'.format(base, index) for index in range(int(options['num_chan']))]
+        elif 'cfg' in options and component == 'debounce':
+            names = ['{}.{}'.format(base, index) for index in range(len(options['cfg'].split(',')))]
+        else:
+            names = ['{}.0'.format(base)]
+        for name in names:
+            self.addInstance(name, component, [name], fileName, number)
+
+    # functions are the names (or name prefixes) one of which has to be added to a thread
+    def addInstance(self, name, component, functions, fileName, number):
+        if name in self.instances:
+            self.errors.append([fileName, number, 'instance {} is loaded twice'.format(name)])
+        self.instances[name] = {'component': component, 'file': fileName, 'line': number, 'functions': functions}
+
+    def parse_loadusr(self, args, fileName, number):
+        for index, arg in enumerate(args[:-1]):
+            if arg in ['-Wn', '-n']:
+                self.userComponents.append(args[index + 1])
+                return
+
+    def parse_addf(self, args, fileName, number):
+        if len(args) >= 2:
+            self.functions.append([args[1], args[0], fileName, number])
+
+    def parse_newsig(self, args, fileName, number):
+        if len(args) >= 2:
+            signal = self.signal(args[0], fileName, number)
+            signal['type'] = args[1]
+
+    def parse_sets(self, args, fileName, number):
+        if len(args) >= 2:
+            self.signal(args[0], fileName, number)['value'] = args[1]
+
+    def parse_setp(self, args, fileName, number):
+        if len(args) < 2:
+            return
+        name = self.resolve(args[0])
+        if name in self.pins:
+            self.errors.append([fileName, number, 'setp {} but it is linked to signal {}'.format(name, self.pins[name]['signal'])])
+        self.params[name] = [args[1], fileName, number]
+
+    def parse_alias(self, args, fileName, number):
+        if len(args) >= 3:
+            self.aliases[args[2]] = self.resolve(args[1])
+
+    def parse_source(self, args, fileName, number):
+        if not args:
+            return
+        path = os.path.normpath(os.path.join(self.sourceDir, args[0]))
+        if not os.path.exists(path):
+            self.sources[path] = None
+            return
+        with open(path, 'rb') as file:
+            self.sources[path] = hashlib.sha256(file.read()).hexdigest()
+        self.parseFile(path)
+
+    # net <signal> [pin] [arrow] [pin] ... the pin before => and after <= writes the signal
+    def parse_net(self, args, fileName, number):
+        if not args:
+            return
+        signal = self.signal(args[0], fileName, number)
+        mode = None
+        previous = None
+        for token in args[1:]:
+            if token in self.arrows:
+                if previous is not None and self.pins[previous]['arrow'] is None:
+                    self.pins[previous]['arrow'] = {'=>': 'out', '<=': 'in', '<=>': 'io'}[token]
+                mode = {'=>': 'in', '<=': 'out', '<=>': 'io'}[token]
+                continue
+            pin = self.resolve(token)
+            if pin in self.pins and self.pins[pin]['signal'] != args[0]:
+                self.errors.append([fileName, number, 'pin {} is already linked to signal {}'.format(pin, self.pins[pin]['signal'])])
+                previous = None
+                continue
+            if pin not in self.pins:
+                self.pins[pin] = {'signal': args[0], 'arrow': mode, 'file': fileName, 'line': number}
+                signal['pins'].append(pin)
+            previous = pin
+            # only the pin right after <= is the writer, the rest are read
+            if mode == 'out':
+                mode = 'in'
+
+    # unlinkp <pin> takes a pin off its signal so a later net can link it elsewhere
+    def parse_unlinkp(self, args, fileName, number):
+        if not args:
+            return
+        pin = self.resolve(args[0])
+        if pin in self.pins:
+            self.signals[self.pins.pop(pin)['signal']]['pins'].remove(pin)
+
+    def signal(self, name, fileName, number):
+        if name not in self.signals:
+            self.signals[name] = {'pins': [], 'type': None, 'value': None, 'file': fileName, 'line': number}
+        return self.signals[name]
+
+    # 'out', 'in', 'io' or None when neither an arrow nor the table tell
+    def pinDirection(self, pin):
+        if pin in self.pins and self.pins[pin]['arrow']:
+            return self.pins[pin]['arrow']
+        for pattern, direction in self.knownDirections:
+            if pattern.match(pin):
+                return direction
+        return None
+
+    # Functions in a thread, in order
+    def threadFunctions(self, thread):
+        return [function for functionThread, function, _, _ in self.functions if functionThread == thread]
+
+    def functionInstance(self, function):
+        for name, instance in self.instances.items():
+            for prefix in instance['functions']:
+                if function == prefix or function.startswith('{}.'.format(prefix)):
+                    return name
+        return None
+
+    # [level, kind, message, file, line] for everything that would break or is suspicious.
+    # level is 'error' (HAL would refuse it or the machine would not run), 'warning' or 'info'.
+    # iniLevel is the level of INI references that could not be substituted, sourceLevel the level of
+    # sourced files that are missing.
+    def problems(self, iniLevel='warning', sourceLevel='warning'):
+        problems = []
+        # a missing sourced file may hold the addf or net that looks missing here
+        missingSource = None in self.sources.values()
+        for fileName, number, message in self.errors:
+            problems.append(['error', 'hal', message, fileName, number])
+        for fileName, number, reference in self.unresolved:
+            problems.append([iniLevel, 'ini', '{} is not set in the INI'.format(reference), fileName, number])
+        for path, digest in sorted(self.sources.items()):
+            if digest is None:
+                problems.append([sourceLevel, 'source', 'sourced file {} is missing'.format(path), path, 0])
+        added = set()
+        for thread, function, fileName, number in self.functions:
+            instance = self.functionInstance(function)
+            if instance is None:
+                problems.append(['error', 'addf', 'function {} does not belong to any loaded component'.format(function), fileName, number])
+            else:
+                added.add(instance)
+        for name in sorted(self.instances):
+            if name not in added:
+                instance = self.instances[name]
+                problems.append(['warning' if missingSource else 'error', 'addf',
+                                 '{} ({}) is loaded but never added to a thread'.format(name, instance['component']),
+                                 instance['file'], instance['line']])
+        for name in sorted(self.signals):
+            signal = self.signals[name]
+            directions = [self.pinDirection(pin) for pin in signal['pins']]
+            writers = [pin for pin, direction in zip(signal['pins'], directions) if direction == 'out']
+            if len(writers) > 1:
+                problems.append(['error', 'writers', 'signal {} has {} writers: {}'.format(name, len(writers), ', '.join(writers)),
+                                 signal['file'], signal['line']])
+            elif signal['value'] is None and directions and all(direction == 'in' for direction in directions):
+                problems.append(['warning', 'dangling', 'signal {} is read by {} but nothing writes it'.format(name, ', '.join(signal['pins'])),
+                                 signal['file'], signal['line']])
+            elif len(signal['pins']) == 1 and signal['value'] is None:
+                problems.append(['info', 'dangling', 'signal {} only has one pin: {}'.format(name, signal['pins'][0]),
+                                 signal['file'], signal['line']])
+        return problems
+
+    def toDict(self):
+        return dict((name, getattr(self, name)) for name in ['ini', 'sourceDir', 'instances', 'functions', 'pins', 'signals', 'params',
+                                                            'aliases', 'userComponents', 'sources', 'unresolved', 'errors'])
+
+    @classmethod
+    def fromDict(cls, data):
+        graph = cls(data['ini'])
+        for name, value in data.items():
+            setattr(graph, name, value)
+        return graph
+
+# Parse a HAL file, reusing the graph cached for the same HAL text, INI values, source folder and
+# sourced files. sourceDir defaults to the folder of the HAL file.
+def loadGraph(halPath, ini=None, cacheDir=None, cacheSize=64, sourceDir=None):
+    ini = ini or {}
+    sourceDir = os.path.abspath(sourceDir or os.path.dirname(os.path.abspath(halPath)))
+    with open(halPath, 'rb') as file:
+        data = file.read()
+    key = hashlib.sha256(data + json.dumps([ini, sourceDir], sort_keys=True).encode('utf-8')).hexdigest()
+    cacheFile = os.path.join(cacheDir, '{}.json'.format(key)) if cacheDir else None
+    if cacheFile and os.path.exists(cacheFile):
+        try:
+            with open(cacheFile, 'r') as jsonFile:
+                cached = json.load(jsonFile)
+            if all(current == sourceDigest(path) for path, current in cached['sources'].items()):
+                os.utime(cacheFile, None)
+                return HalGraph.fromDict(cached)
+        except (ValueError, KeyError):
+            pass
+    graph = HalGraph(ini, sourceDir)
+    graph.parseText(data.decode('utf-8', 'replace'), halPath)
+    if cacheFile:
+        if not os.path.exists(cacheDir):
+            os.makedirs(cacheDir)
+        tempFile = '{}.{}.tmp'.format(cacheFile, os.getpid())
+        with open(tempFile, 'w') as jsonFile:
+            json.dump(graph.toDict(), jsonFile)
+        os.rename(tempFile, cacheFile)
+        cached = sorted((os.path.getmtime(os.path.join(cacheDir, name)), name) for name in os.listdir(cacheDir) if name.endswith('.json'))
+        for _, name in cached[:-cacheSize]:
+            try:
+                os.remove(os.path.join(cacheDir, name))
+            except OSError:
+                pass
+    return graph
+
+def sourceDigest(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+# Values the shipped templates need that only the PathPilot base INI has
+shippedDefaults = {'EMCMOT': {'EMCMOT': 'motmod', 'SERVO_PERIOD': '1000000'}, 'TRAJ': {'AXES': '4'},
+                   'HOSTMOT2': {'DRIVER': 'hm2_pci', 'BOARD': '5i25'}}
+
+# The INI a shipped template is checked with: its *_specific.ini (or lathe INI) over shippedDefaults
+def shippedIni(configDir, store, version, name):
+    if name == 'pathpirate_cpm_hsh_lathe.hal':
+        iniPath = store.getFile(version, 'pathpirate_cpm_hsh_lathe.ini')
+    elif name == 'pathpirate_cpm_hsh_rapidturn.hal':
+        iniPath = os.path.join(configDir, 'pathpirate_cpm_hsh_1100-3_rapidturn_specific.ini')
+    else:
+        iniPath = os.path.join(configDir, 'pathpirate_cpm_hsh_1100-3_specific.ini')
+    ini = dict((section, dict(values)) for section, values in shippedDefaults.items())
+    for section, values in readIni(iniPath).items():
+        ini.setdefault(section, {}).update(dict((key, value) for key, value in values.items() if value))
+    return ini
+
+# (name, graph) of every shipped HAL template of the given versions (default all). Sourced files
+# are looked for where the template would be installed, tormach_mill or tormach_lathe in installDir.
+def shippedGraphs(configDir, versions=None, cacheDir=None, installDir=os.path.expanduser('~/tmc/configs')):
+    from templatestore import TemplateStore
+    store = TemplateStore(os.path.join(configDir, 'templates'), os.path.join(configDir, '.cache'))
+    for version in versions or store.versions():
+        for name in store.names(version):
+            if name.endswith('.hal'):
+                ini = shippedIni(configDir, store, version, name)
+                sourceDir = os.path.join(installDir, 'tormach_lathe' if name == 'pathpirate_cpm_hsh_lathe.hal' else 'tormach_mill')
+                yield '{}/{}'.format(version, name), loadGraph(store.getFile(version, name), ini, cacheDir, sourceDir=sourceDir)
+
+def printProblems(graph, name, verbose, iniLevel='warning', sourceLevel='warning'):
+    problems = graph.problems(iniLevel, sourceLevel)
+    counts = dict((level, len([problem for problem in problems if problem[0] == level])) for level in ['error', 'warning', 'info'])
+    print('{}: {} instances, {} functions, {} signals, {} pins - {} errors, {} warnings, {} notes'.format(
+        name, len(graph.instances), len(graph.functions), len(graph.signals), len(graph.pins),
+        counts['error'], counts['warning'], counts['info']))
+    for level, kind, message, fileName, number in problems:
+        if level != 'info' or verbose:
+            print('    {:7} {}:{} {}'.format(level, os.path.basename(fileName), number, message))
+    return counts['error']
+
+if __name__ == '__main__':
+    import argparse
+    configDir = os.path.join(os.path.realpath(os.path.dirname(__file__)), 'files/configs')
+    parser = argparse.ArgumentParser(description='Check HAL files for missing addf, signals with two writers and dangling nets.')
+    parser.add_argument('hal', nargs='*', help='HAL file(s) to check, default is every shipped template of every version')
+    parser.add_argument('--ini', help='INI file for [SECTION]KEY substitution (a *_specific.ini is merged over its base INI)')
+    parser.add_argument('--version', action='append', help='only check the shipped templates of this version')
+    parser.add_argument('--installed', default=os.path.expanduser('~/tmc/configs'), help='PathPilot configs folder the sourced '
+                        'files of the shipped templates are looked for in (default: ~/tmc/configs)')
+    parser.add_argument('-v', '--verbose', action='store_true', help='also list single pin signals')
+    args = parser.parse_args()
+    cacheDir = os.path.join(configDir, '.cache/halgraph')
+    failed = 0
+    if args.hal:
+        ini = readIni(args.ini) if args.ini else {}
+        for halPath in args.hal:
+            failed += printProblems(loadGraph(halPath, ini, cacheDir), halPath, args.verbose)
+    else:
+        # without a PathPilot install the sourced files can not be there either
+        sourceLevel = 'warning' if os.path.isdir(args.installed) else 'info'
+        for name, graph in shippedGraphs(configDir, args.version, cacheDir, args.installed):
+            # the base INI is not shipped, so unset references are expected here
+            failed += printProblems(graph, name, args.verbose, 'info', sourceLevel)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,245 @@
+'''
+halpatch applies the PathPirate ClearPath changes to a stock PathPilot HAL or
+INI file instead of replacing it with a complete copy.
+
+Copyright (C) 2023, 2024, 2025, 2026 Gregory D Carl
+
+This program is free software; you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with this program; if not, write to the Free Software Foundation, Inc.,
+51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+'''
+
+import re
+from inimodel import IniFile
+
+# The PathPirate HAL templates are the stock Tormach files with a known set of sections changed.
+# Both files are split into sections at the '#####' banner lines in one pass and indexed by title.
+# The patched file is the stock file with:
+#   - the ClearPath sections listed below swapped for the template's version (or inserted after
+#     the section that precedes them in the template if stock does not have them)
+#   - loadrt lines in the header replaced/added per component from the template
+#   - addf lines merged, template order first, stock-only functions kept after their stock predecessor
+#   - the PathPirate marker added to the header comment
+# Everything else in the stock file, including anything new in a later PathPilot release, is kept.
+class HalPatcher:
+
+    banner = re.compile(r'^#{10,}\s*$')
+    marker = '# This config was modified by PathPirate to add ClearPath servos'
+
+    # ClearPath sections per template, by normalized section title
+    clearPathSections = {
+        'pathpirate_cpm_hsh_mill.hal': ['must noise debounce inputs - otherwise coolant on/off can cause spurious estops',
+                                        'z axis brake release', 'x axis enable for 7i85s', 'x axis', 'y axis', 'z axis',
+                                        'a axis', 'home switches'],
+        'pathpirate_cpm_hsh_rapidturn.hal': ['noise debounce for home switches and estop', 'x axis brake release',
+                                             'x axis enable for 7i85s', 'x axis', 'y axis', 'z axis', 'a axis',
+                                             'home switches'],
+        'pathpirate_cpm_hsh_lathe.hal': ['noise debounce for estop', 'home + limit switch', 'x axis brake release',
+                                         'x axis enable for 7i85s', 'x axis', 'z axis'],
+    }
+    servoThread = 'servo thread'
+
+    # INI sections whose keys are taken from the template
+    clearPathIniSections = ['HOSTMOT2', 'TRAJ', 'AXIS_0', 'AXIS_1', 'AXIS_2']
+
+    def __init__(self, templateName):
+        self.templateName = templateName
+        self.report = []
+
+    def normalizeTitle(self, line):
+        return line.strip().strip('#').strip().rstrip(':').lower()
+
+    # A banner starts a section only when a comment line follows it (closing banners do not)
+    def sectionTitle(self, lines, index):
+        if not self.banner.match(lines[index]):
+            return None
+        for line in lines[index + 1:]:
+            if self.banner.match(line):
+                continue
+            if line.startswith('#') and self.normalizeTitle(line):
+                return self.normalizeTitle(line)
+            return None
+        return None
+
+    # Returns a list of [title, lines] with the part before the first section titled 'header'
+    def splitSections(self, text):
+        lines = text.splitlines(True)
+        sections = [['header', []]]
+        index = 0
+        while index < len(lines):
+            title = self.sectionTitle(lines, index)
+            if title is not None and index > 0:
+                sections.append([title, []])
+                # keep consecutive banner lines together with the section they open
+                while index < len(lines) and self.banner.match(lines[index]):
+                    sections[-1][1].append(lines[index])
+                    index += 1
+                continue
+            sections[-1][1].append(lines[index])
+            index += 1
+        return sections
+
+    def indexSections(self, sections):
+        index = {}
+        for position, (title, _) in enumerate(sections):
+            index.setdefault(title, position)
+        return index
+
+    # Patch the stock HAL text, raises ValueError if a section the patch depends on is missing
+    def patch(self, stockText, templateText, version):
+        self.report = []
+        stock = self.splitSections(stockText)
+        template = self.splitSections(templateText)
+        stockIndex = self.indexSections(stock)
+        templateIndex = self.indexSections(template)
+        wanted = self.clearPathSections[self.templateName] + [self.servoThread]
+        for title in wanted:
+            if title not in templateIndex:
+                raise ValueError('Template section "{}" not found in {}'.format(title, self.templateName))
+        if self.servoThread not in stockIndex:
+            raise ValueError('Stock HAL file has no "{}" section'.format(self.servoThread))
+        # template-only sections go after the section that precedes them in the template
+        inserts = {}
+        for title in wanted:
+            if title in stockIndex:
+                continue
+            anchor = 'header'
+            for earlier, _ in reversed(template[:templateIndex[title]]):
+                if earlier in stockIndex:
+                    anchor = earlier
+                    break
+            inserts.setdefault(anchor, []).append(title)
+        out = []
+        for position, (title, lines) in enumerate(stock):
+            if title == 'header' and position == 0:
+                lines = self.mergeHeader(lines, template[0][1], version)
+            elif title in wanted and stockIndex[title] == position:
+                lines = template[templateIndex[title]][1]
+                self.report.append('replaced section: {}'.format(title))
+            out.extend(lines)
+            if stockIndex.get(title) == position:
+                for insert in inserts.get(title, []):
+                    out.extend(template[templateIndex[insert]][1])
+                    self.report.append('inserted section: {}'.format(insert))
+        return ''.join(self.mergeAddf(stockText.splitlines(True), out))
+
+    def loadrtKey(self, line):
+        tokens = line.split()
+        if len(tokens) > 1 and tokens[0] == 'loadrt':
+            return tokens[1]
+        return None
+
+    # Swap/add loadrt lines per component and add the PathPirate marker to the header comment
+    def mergeHeader(self, stockLines, templateLines, version):
+        templateLoadrt = {}
+        templateOrder = []
+        for line in templateLines:
+            key = self.loadrtKey(line)
+            if key is not None and key not in templateLoadrt:
+                templateLoadrt[key] = line
+                templateOrder.append(key)
+        out = []
+        seen = set()
+        lastLoadrt = None
+        for line in stockLines:
+            key = self.loadrtKey(line)
+            if key is not None:
+                if key in templateLoadrt and key not in seen:
+                    if line != templateLoadrt[key]:
+                        self.report.append('updated loadrt {}'.format(key))
+                    line = templateLoadrt[key]
+                seen.add(key)
+                lastLoadrt = len(out)
+            out.append(line)
+        if lastLoadrt is None:
+            raise ValueError('Stock HAL file has no loadrt lines in its header')
+        added = [templateLoadrt[key] for key in templateOrder if key not in seen]
+        for key in templateOrder:
+            if key not in seen:
+                self.report.append('added loadrt {}'.format(key))
+        out[lastLoadrt + 1:lastLoadrt + 1] = added
+        if not any('PathPirate' in line for line in out):
+            position = 0
+            while position < len(out) and out[position].startswith('#'):
+                position += 1
+            out[position:position] = ['{}\n'.format(self.marker), '# PathPilot {}\n'.format(version)]
+        return out
+
+    def addfKey(self, line):
+        tokens = line.split()
+        if len(tokens) > 1 and tokens[0] == 'addf':
+            return tokens[1]
+        return None
+
+    # Stock functions that the patched text no longer has (because their section was replaced)
+    # are put back after the function that precedes them in the stock file
+    def mergeAddf(self, stockLines, lines):
+        present = set(self.addfKey(line) for line in lines if self.addfKey(line))
+        previous = None
+        after = {}
+        for line in stockLines:
+            key = self.addfKey(line)
+            if key is None:
+                continue
+            if key not in present:
+                # chains of stock-only functions stay in stock order
+                after.setdefault(previous if previous in present else None, []).append(line)
+                self.report.append('kept stock addf {}'.format(key))
+            else:
+                previous = key
+        if not after:
+            return lines
+        out = []
+        for line in lines:
+            key = self.addfKey(line)
+            if key is not None and None in after:
+                out.extend(after.pop(None))
+            out.append(line)
+            if key is not None:
+                out.extend(after.pop(key, []))
+        return out
+
+    # Overlay the ClearPath INI sections from the template onto the stock INI text. The n-th line of a
+    # key in the template replaces the n-th line of that key in stock, keys stock does not have go
+    # after the last key of their section and sections stock does not have at the end.
+    def patchIni(self, stockText, templateText, version):
+        self.report = []
+        stock = IniFile(stockText)
+        template = IniFile(templateText)
+        for section in self.clearPathIniSections:
+            entries = template.entries(section)
+            if not entries:
+                continue
+            if not stock.has(section):
+                stock.addLines(section, [line for _, line in entries])
+                self.report.append('added section [{}]'.format(section))
+                continue
+            added = []
+            occurrences = {}
+            for key, line in entries:
+                occurrence = occurrences.get(key, 0)
+                occurrences[key] = occurrence + 1
+                if occurrence < len(stock.keyLines(section, key)):
+                    if stock.replaceLine(section, key, line, occurrence) != line:
+                        self.report.append('set [{}]{}'.format(section, key))
+                else:
+                    added.append(line)
+                    self.report.append('added [{}]{}'.format(section, key))
+            stock.addLines(section, added)
+        out = stock.text().splitlines(True)
+        if not any('PathPirate' in line for line in out):
+            position = 0
+            while position < len(out) and out[position].startswith('#'):
+                position += 1
+            out[position:position] = ['#\n', '{}\n'.format(self.marker), '# PathPilot {}\n'.format(version)]
+        return ''.join(out)
@@ -0,0 +1,306 @@
+'''
+halsession provides a long-lived connection to HAL for the PathPirate tools.
+
+Copyright (C) 2023, 2024, 2025, 2026 Gregory D Carl
+
+This program is free software; you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with this program; if not, write to the Free Software Foundation, Inc.,
+51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+'''
+
+from subprocess import Popen, PIPE, STDOUT
+import os
+import sys
+import time
+import select
+
+# Keeps one HAL connection open for the life of the program instead of starting halcmd for every query.
+# The in-process LinuxCNC hal module is used when it can be imported, any command it can not handle
+# (or every command if it is missing) goes through a single halcmd process reading from a pipe.
+class HalSession:
+
+    def __init__(self, halcmd, timeout=2.0):
+        self.halcmd = halcmd
+        self.timeout = timeout
+        # running per-call latency, a session lives as long as ServoBrake so no list of calls is kept
+        self.latency_count = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.pipe = None
+        self.pipe_failed = False
+        self.buffer = ''
+        self.sync_count = 0
+        self.hal = None
+        self.component = None
+        self.connect_hal_module()
+
+    # Try to use the LinuxCNC hal module directly, PathPilot keeps it in ~/tmc/lib/python
+    def connect_hal_module(self):
+        lib_path = os.path.join(os.path.dirname(os.path.dirname(self.halcmd)), 'lib/python')
+        if os.path.isdir(lib_path) and lib_path not in sys.path:
+            sys.path.append(lib_path)
+        try:
+            import hal
+            # the module functions only work once this process owns a component
+            self.component = hal.component('pathpirate-{}'.format(os.getpid()))
+            self.component.ready()
+            self.hal = hal
+        except Exception:
+            self.hal = None
+            self.component = None
+
+    # Name of the link currently in use, shown with the latency summary
+    def backend(self):
+        if self.hal is not None:
+            return 'in-process hal module'
+        if self.pipe_failed:
+            return 'halcmd per call'
+        return 'halcmd pipe'
+
+    # Run a halcmd style command (getp, gets, setp, sets, linkps, unlinkp, show...) and return (out, err)
+    def command(self, *args):
+        start = time.time()
+        result = self.command_hal_module(*args)
+        if result is None:
+            result = self.command_pipe(*args)
+        if result is None:
+            result = self.command_spawn(*args)
+        self.record_latency(start)
+        return result
+
+    # For polling from an event loop: the in-process hal module, or the halcmd pipe without it, but
+    # never a halcmd process per call. Returns None if neither can answer.
+    def poll_command(self, *args):
+        start = time.time()
+        result = self.command_hal_module(*args)
+        if result is None:
+            result = self.command_pipe(*args)
+        if result is not None:
+            self.record_latency(start)
+        return result
+
+    def record_latency(self, start):
+        elapsed = time.time() - start
+        self.latency_count += 1
+        self.latency_total += elapsed
+        self.latency_max = max(self.latency_max, elapsed)
+
+    # Returns None when the hal module is unavailable or does not support the command
+    def command_hal_module(self, *args):
+        if self.hal is None or not args:
+            return None
+        cmd = args[0]
+        try:
+            if cmd in ['getp', 'gets'] and len(args) == 2 and hasattr(self.hal, 'get_value'):
+                return self.format_value(self.hal.get_value(args[1])), ''
+            if cmd == 'setp' and len(args) == 3 and hasattr(self.hal, 'set_p'):
+                self.hal.set_p(args[1], args[2])
+                return '', ''
+            if cmd == 'linkps' and len(args) == 3 and hasattr(self.hal, 'connect'):
+                self.hal.connect(args[1], args[2])
+                return '', ''
+            if cmd == 'unlinkp' and len(args) == 2 and hasattr(self.hal, 'disconnect'):
+                self.hal.disconnect(args[1])
+                return '', ''
+        except Exception as e:
+            return '', 'HAL: ERROR: {}\n'.format(e)
+        return None
+
+    # Match the text halcmd prints for a value so callers can compare against TRUE/FALSE
+    def format_value(self, value):
+        if isinstance(value, bool):
+            return 'TRUE\n' if value else 'FALSE\n'
+        if isinstance(value, float):
+            return '{:.7g}\n'.format(value)
+        return '{}\n'.format(value)
+
+    # Start halcmd reading commands from stdin. The end of each output is found by the error line of
+    # the sync query, which only works if stdout and stderr reach the pipe in the order they were
+    # written: stdbuf makes both line buffered, without it the pipe is not used at all.
+    def open_pipe(self):
+        stdbuf = self.find_executable('stdbuf')
+        if stdbuf is None:
+            self.pipe = None
+            self.pipe_failed = True
+            return
+        args = [stdbuf, '-oL', '-eL', self.halcmd, '-k', '-s', '-f']
+        try:
+            self.pipe = Popen(args, stdin=PIPE, stdout=PIPE, stderr=STDOUT)
+        except OSError:
+            self.pipe = None
+            self.pipe_failed = True
+            return
+        self.buffer = ''
+        # make sure the pipe answers before trusting it with real commands
+        if self.command_pipe_raw('') is None:
+            self.close_pipe()
+            self.pipe_failed = True
+
+    def find_executable(self, name):
+        for folder in os.getenv('PATH', '').split(os.pathsep):
+            path = os.path.join(folder, name)
+            if os.path.isfile(path) and os.access(path, os.X_OK):
+                return path
+        return None
+
+    # Returns None if the pipe could not be used so the caller can fall back to spawning halcmd
+    def command_pipe(self, *args):
+        if self.pipe_failed:
+            return None
+        if self.pipe is None:
+            self.open_pipe()
+            if self.pipe is None:
+                return None
+        result = self.command_pipe_raw(' '.join(args))
+        if result is None:
+            self.close_pipe()
+            self.pipe_failed = True
+        return result
+
+    # Each command is followed by a query for a signal that can not exist, halcmd reports the
+    # missing signal by name which marks the end of the output belonging to the command
+    def command_pipe_raw(self, line):
+        self.sync_count += 1
+        token = '__pathpirate_sync_{}__'.format(self.sync_count)
+        text = '{}\ngets {}\n'.format(line, token) if line else 'gets {}\n'.format(token)
+        try:
+            self.pipe.stdin.write(text.encode('utf-8'))
+            self.pipe.stdin.flush()
+        except (IOError, OSError, ValueError):
+            return None
+        out = ''
+        err = ''
+        deadline = time.time() + self.timeout
+        while True:
+            if '\n' not in self.buffer:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                ready, _, _ = select.select([self.pipe.stdout], [], [], remaining)
+                if not ready:
+                    return None
+                data = os.read(self.pipe.stdout.fileno(), 65536)
+                if not data:
+                    return None
+                if not isinstance(data, str):
+                    data = data.decode('utf-8', 'replace')
+                self.buffer += data
+                continue
+            out_line, self.buffer = self.buffer.split('\n', 1)
+            if token in out_line:
+                return out, err
+            if out_line.startswith('<stdin>:') or 'HAL: ERROR' in out_line:
+                err += '{}\n'.format(out_line)
+            else:
+                out += '{}\n'.format(out_line)
+
+    # Last resort, the original one halcmd process per command behaviour
+    def command_spawn(self, *args):
+        state = Popen((self.halcmd,) + args, stdout=PIPE, stderr=PIPE)
+        out, err = state.communicate()
+        if not isinstance(out, str):
+            out = out.decode('utf-8', 'replace')
+            err = err.decode('utf-8', 'replace')
+        return out, err
+
+    def close_pipe(self):
+        if self.pipe is None:
+            return
+        try:
+            self.pipe.stdin.close()
+            self.pipe.wait()
+        except (IOError, OSError):
+            pass
+        self.pipe = None
+
+    def close(self):
+        self.close_pipe()
+        if self.component is not None:
+            try:
+                self.component.exit()
+            except Exception:
+                pass
+            self.component = None
+
+    # Dump the whole pin table with a single command and index it
+    def snapshot(self):
+        out, err = self.command('show', 'pin')
+        return HalSnapshot(out, err)
+
+    # One line summary of the recorded per-call latency
+    def latency_summary(self):
+        if not self.latency_count:
+            return '{}: no calls'.format(self.backend())
+        return '{}: {} calls, average {:.1f} ms, maximum {:.1f} ms'.format(
+            self.backend(), self.latency_count, self.latency_total / self.latency_count * 1000, self.latency_max * 1000)
+
+
+# Index of one 'show pin' dump so board type, pin presence, links and signal values can be
+# answered without asking HAL again. Pins are grouped by component (the part of the pin name
+# before the first dot) and signals are built from the pins linked to them.
+class HalSnapshot:
+
+    hal_types = ['bit', 'float', 's32', 'u32', 's64', 'u64', 'port']
+
+    def __init__(self, out, err=''):
+        self.err = err
+        self.pins = {}
+        self.components = {}
+        self.signals = {}
+        self.parse(out)
+
+    # Lines look like '<owner> <type> <dir> <value> <pin> [<arrow> <signal>]' in both the
+    # script (-s) and normal output formats, header lines never have a HAL type in column two
+    def parse(self, out):
+        for line in out.splitlines():
+            tokens = line.split()
+            if len(tokens) not in [5, 7] or tokens[1] not in self.hal_types:
+                continue
+            pin_type, pin_dir, value, name = tokens[1:5]
+            signal = tokens[6] if len(tokens) == 7 else None
+            self.pins[name] = {'type': pin_type, 'dir': pin_dir, 'value': value, 'signal': signal}
+            self.components.setdefault(name.split('.')[0], []).append(name)
+            if signal is not None:
+                entry = self.signals.setdefault(signal, {'value': value, 'pins': []})
+                entry['pins'].append(name)
+                # the writer's value is the signal value
+                if tokens[5] in ['<==', '<=>'] or pin_dir == 'OUT':
+                    entry['value'] = value
+
+    # True if HAL answered with at least one pin, an empty table means HAL is not running
+    def is_running(self):
+        return self.err.strip() == '' and len(self.pins) > 0
+
+    def has_pin(self, name):
+        return name in self.pins
+
+    def pin_value(self, name):
+        return self.pins[name]['value'] if name in self.pins else ''
+
+    # Signal the pin is linked to, or None if it is unlinked or missing
+    def linked_signal(self, name):
+        return self.pins[name]['signal'] if name in self.pins else None
+
+    def has_signal(self, name):
+        return name in self.signals
+
+    def signal_value(self, name):
+        return self.signals[name]['value'] if name in self.signals else ''
+
+    # Return the first board whose hostmot2 component is present and has the given pin
+    def board(self, candidates, pin='0.gpio.001.out'):
+        for board in candidates:
+            component = 'hm2_{}'.format(board)
+            if component in self.components and '{}.{}'.format(component, pin) in self.pins:
+                return board
+        return ''
@@ -0,0 +1,269 @@
+'''
+inimodel reads LinuxCNC INI files into a model that indexes their sections
+and keys and writes them back unchanged apart from the edited lines.
+
+Copyright (C) 2023, 2024, 2025, 2026 Gregory D Carl
+
+This program is free software; you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with this program; if not, write to the Free Software Foundation, Inc.,
+51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+'''
+
+import sys
+import os
+import io
+from shutil import copymode
+
+# bytes that are not utf-8 are written back as they were on Python 3, Python 2 has no such handler
+decodeErrors = 'surrogateescape' if sys.version_info[0] >= 3 else 'replace'
+
+# (key, value) of a 'KEY = value' line, None for blank lines, comments and section headers
+def keyValue(line):
+    stripped = line.strip()
+    if not stripped or stripped[0] in '#;' or '=' not in stripped:
+        return None
+    key, value = stripped.split('=', 1)
+    return key.strip(), value.strip()
+
+def lineEnding(line):
+    return line[len(line.rstrip('\r\n')):]
+
+# Replace the content of path with data (bytes) through a temporary file in the same folder, so a
+# crash or a full disk leaves either the old or the new file and never half of one. The mode of the
+# old file is kept.
+def replaceFile(path, data):
+    tempPath = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+        with open(tempPath, 'wb') as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        if os.path.exists(path):
+            copymode(path, tempPath)
+        os.rename(tempPath, path)
+    except (IOError, OSError):
+        if os.path.exists(tempPath):
+            os.remove(tempPath)
+        raise
+
+# One [SECTION] of an INI file: its raw lines from the header on (the lines before the first section
+# have no header and no name) and {key: [line index, ...]} in file order
+class IniSection:
+
+    def __init__(self, name):
+        self.name = name
+        self.lines = []
+        self.keys = {}
+
+    def append(self, line):
+        self.lines.append(line)
+        self.indexLine(len(self.lines) - 1)
+
+    def indexLine(self, index):
+        entry = keyValue(self.lines[index]) if self.name is not None else None
+        if entry is not None:
+            self.keys.setdefault(entry[0], []).append(index)
+
+    def reindex(self):
+        self.keys = {}
+        for index in range(len(self.lines)):
+            self.indexLine(index)
+
+    def values(self, key):
+        return [keyValue(self.lines[index])[1] for index in self.keys.get(key, [])]
+
+    # the line new keys go after: the last key of the section, or its header if it has none
+    def lastKeyLine(self):
+        return max([index for indexes in self.keys.values() for index in indexes] or [0])
+
+    def setLine(self, index, line):
+        self.lines[index] = line
+        self.reindex()
+
+    # Insert a line after index, in the line ending of the line before it
+    def insertLine(self, index, line):
+        previous = self.lines[index]
+        ending = lineEnding(previous) or '\n'
+        if not lineEnding(previous):
+            self.lines[index] = previous + ending
+        self.lines.insert(index + 1, line.rstrip('\r\n') + ending)
+        self.reindex()
+
+# Round trip model of an INI file. Sections are kept in file order and indexed by name, a name
+# PathPilot repeats maps to every section with it. Lookups follow LinuxCNC: the last value of a
+# key wins, getAll() gives every value of a key that is listed more than once ([HAL]HALFILE).
+class IniFile:
+
+    def __init__(self, text='', path=None):
+        self.path = path
+        self.sections = [IniSection(None)]
+        self.index = {}
+        for line in text.splitlines(True):
+            stripped = line.strip()
+            if stripped.startswith('[') and stripped.endswith(']'):
+                section = IniSection(stripped[1:-1])
+                self.sections.append(section)
+                self.index.setdefault(section.name, []).append(section)
+            self.sections[-1].append(line)
+
+    @classmethod
+    def read(cls, path):
+        with io.open(path, 'r', encoding='utf-8', errors=decodeErrors, newline='') as file:
+            return cls(file.read(), path)
+
+    def copy(self):
+        return IniFile(self.text(), self.path)
+
+    def text(self):
+        return ''.join(line for section in self.sections for line in section.lines)
+
+    # the text as it is written to disk
+    def data(self):
+        return self.text().encode('utf-8', decodeErrors)
+
+    def write(self, path=None):
+        replaceFile(path or self.path, self.data())
+
+    def has(self, section, key=None):
+        if key is None:
+            return section in self.index
+        return any(key in iniSection.keys for iniSection in self.index.get(section, []))
+
+    def getAll(self, section, key):
+        return [value for iniSection in self.index.get(section, []) for value in iniSection.values(key)]
+
+    def get(self, section, key, default=None):
+        values = self.getAll(section, key)
+        return values[-1] if values else default
+
+    # {section: {key: value}} of this file only
+    def values(self):
+        values = {}
+        for iniSection in self.sections[1:]:
+            entries = values.setdefault(iniSection.name, {})
+            for index in sorted(index for indexes in iniSection.keys.values() for index in indexes):
+                key, value = keyValue(iniSection.lines[index])
+                entries[key] = value
+        return values
+
+    # The file [INI_CONFIG]BASE_INI_FILE names, None if there is none
+    def base(self):
+        base = self.get('INI_CONFIG', 'BASE_INI_FILE')
+        if not base or self.path is None:
+            return None
+        return os.path.join(os.path.dirname(self.path), base)
+
+    # Raw lines (without line ending) of every key of a section, as [(key, line)]
+    def entries(self, section):
+        entries = []
+        for iniSection in self.index.get(section, []):
+            for index in sorted(index for indexes in iniSection.keys.values() for index in indexes):
+                entries.append((keyValue(iniSection.lines[index])[0], iniSection.lines[index].rstrip('\r\n')))
+        return entries
+
+    # [(section, line index)] of every line of a key, in file order
+    def keyLines(self, section, key):
+        return [(iniSection, index) for iniSection in self.index.get(section, []) for index in iniSection.keys.get(key, [])]
+
+    # Replace the whole line of the n-th occurrence of a key, returns the line it replaced
+    def replaceLine(self, section, key, line, occurrence=0):
+        iniSection, index = self.keyLines(section, key)[occurrence]
+        old = iniSection.lines[index]
+        iniSection.setLine(index, line.rstrip('\r\n') + (lineEnding(old) or '\n'))
+        return old.rstrip('\r\n')
+
+    # Set the value of a key, keeping the spacing of the line that had it last. A key the section does
+    # not have goes after its last key, a section the file does not have is added at the end.
+    def set(self, section, key, value):
+        lines = self.keyLines(section, key)
+        if lines:
+            iniSection, index = lines[-1]
+            old = iniSection.lines[index]
+            name, rest = old.rstrip('\r\n').split('=', 1)
+            spacing = rest[:len(rest) - len(rest.lstrip())]
+            iniSection.setLine(index, '{}={}{}{}'.format(name, spacing, value, lineEnding(old)))
+        else:
+            self.addLines(section, ['{} = {}'.format(key, value)])
+
+    # Add raw lines after the last key of a section, or as a new section at the end of the file
+    def addLines(self, section, lines):
+        if section not in self.index:
+            last = self.sections[-1]
+            # a blank line before the section, or only a line ending if the file ends without one
+            if last.lines and not lineEnding(last.lines[-1]):
+                last.lines[-1] += '\n'
+            else:
+                last.lines.append('\n')
+            iniSection = IniSection(section)
+            self.sections.append(iniSection)
+            self.index[section] = [iniSection]
+            iniSection.append('[{}]\n'.format(section))
+            for line in lines:
+                iniSection.append('{}\n'.format(line))
+            return
+        iniSection = self.index[section][-1]
+        index = iniSection.lastKeyLine()
+        for line in lines:
+            iniSection.insertLine(index, line)
+            index += 1
+
+    # Remove every line of a key, or only those with value, returns how many were removed
+    def removeLines(self, section, key, value=None):
+        removed = 0
+        for iniSection, index in reversed(self.keyLines(section, key)):
+            if value is None or keyValue(iniSection.lines[index])[1] == value:
+                del iniSection.lines[index]
+                iniSection.reindex()
+                removed += 1
+        return removed
+
+    # Add 'key = value' right after the line where afterKey has afterValue (e.g. one HALFILE after
+    # another), returns False if the section has no such line
+    def insertAfter(self, section, key, value, afterKey, afterValue):
+        for iniSection, index in self.keyLines(section, afterKey):
+            if keyValue(iniSection.lines[index])[1] == afterValue:
+                iniSection.insertLine(index, '{} = {}'.format(key, value))
+                return True
+        return False
+
+# Every INI file is parsed once per run and shared by everything that reads it, a file is only
+# parsed again after it changed on disk (a committed transaction renames a new file over it)
+class IniCache:
+
+    def __init__(self):
+        self.files = {}
+
+    def get(self, path):
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        signature = (stat.st_ino, stat.st_size, stat.st_mtime)
+        cached = self.files.get(path)
+        if cached is None or cached[0] != signature:
+            cached = (signature, IniFile.read(path))
+            self.files[path] = cached
+        return cached[1]
+
+    # {section: {key: value}} the way PathPilot sees a file: a *_specific.ini with
+    # [INI_CONFIG]BASE_INI_FILE is laid over its base file
+    def values(self, path, seen=None):
+        seen = seen or set()
+        seen.add(os.path.abspath(path))
+        iniFile = self.get(path)
+        values = iniFile.values()
+        basePath = iniFile.base()
+        if basePath and os.path.exists(basePath) and os.path.abspath(basePath) not in seen:
+            merged = self.values(basePath, seen)
+            for name, entries in values.items():
+                merged.setdefault(name, {}).update(entries)
+            return merged
+        return values
@@ -0,0 +1,160 @@
+'''
+journal applies all file changes of a PathPirate operation as one transaction
+so a power loss never leaves ~/tmc half modified.
+
+Copyright (C) 2023, 2024, 2025, 2026 Gregory D Carl
+
+This program is free software; you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with this program; if not, write to the Free Software Foundation, Inc.,
+51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+'''
+
+from shutil import copy, copymode
+import os
+import json
+import ctypes
+
+# Flush every staged file with one sync() instead of an fsync per file. Python 2 has no os.sync,
+# libc's is used there, and each file is fsynced only if neither is available.
+def syncFiles(paths):
+    if hasattr(os, 'sync'):
+        os.sync()
+        return
+    try:
+        ctypes.CDLL(None).sync()
+        return
+    except (OSError, AttributeError):
+        pass
+    for path in paths:
+        fsyncPath(path)
+
+def fsyncPath(path):
+    descriptor = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+# Layout of <root>/.pathpirate/journal.json while an operation runs:
+#   {'label', 'state', 'files': {<path relative to root>: {'staged': <relative path>, 'before': <backup entry>}}}
+# state is 'staging' while the new files are written next to their targets (nothing has changed
+# yet) and 'committing' once they are synced and being renamed into place. 'before' is the
+# BackupStore entry of the file at the start of the operation, None if the operation creates it.
+# The journal is removed once every file is in place. If it is still there at startup the
+# operation did not finish: staged files are removed and, if renaming had started, every file
+# is put back from the backup store.
+class Transaction:
+
+    def __init__(self, root, backups, label):
+        self.root = root
+        self.backups = backups
+        self.label = label
+        self.storeDir = os.path.join(root, '.pathpirate')
+        self.journalFile = os.path.join(self.storeDir, 'journal.json')
+        self.files = {}
+
+    def relative(self, path):
+        return os.path.relpath(path, self.root)
+
+    def absolute(self, path):
+        return os.path.join(self.root, path)
+
+    def save(self, state, sync=False):
+        if not os.path.exists(self.storeDir):
+            os.makedirs(self.storeDir)
+        tempFile = '{}.tmp'.format(self.journalFile)
+        with open(tempFile, 'w') as jsonFile:
+            json.dump({'label': self.label, 'state': state, 'files': self.files}, jsonFile, indent=4, sort_keys=True)
+            if sync:
+                jsonFile.flush()
+                os.fsync(jsonFile.fileno())
+        os.rename(tempFile, self.journalFile)
+        if sync:
+            fsyncPath(self.storeDir)
+
+    # The name to write the new content of path to, it replaces path on commit. The file is backed
+    # up (or recorded as created) in the current restore point first.
+    def stage(self, path):
+        relPath = self.relative(path)
+        if relPath not in self.files:
+            before = self.backups.backup(path) if os.path.exists(path) else self.backups.created(path)
+            self.files[relPath] = {'staged': '{}.pathpirate.new'.format(relPath), 'before': before}
+            self.save('staging')
+        return self.absolute(self.files[relPath]['staged'])
+
+    # Stage a copy of source (with its mode) as the new content of path
+    def copy(self, source, path):
+        copy(source, self.stage(path))
+
+    # Stage text as the new content of path, keeping the mode path has now
+    def write(self, path, text):
+        staged = self.stage(path)
+        with open(staged, 'wb') as file:
+            file.write(text if isinstance(text, bytes) else text.encode('utf-8'))
+        if os.path.exists(path):
+            copymode(path, staged)
+
+    # Sync every staged file at once, journal the commit, rename them all into place and remove the
+    # journal. Files that were staged but never written are left alone. Returns the changed paths.
+    def commit(self):
+        staged = dict((relPath, entry) for relPath, entry in self.files.items() if os.path.exists(self.absolute(entry['staged'])))
+        if not staged:
+            self.finish()
+            return []
+        self.files = staged
+        syncFiles([self.absolute(entry['staged']) for entry in staged.values()])
+        self.save('committing', sync=True)
+        folders = set()
+        for relPath in sorted(staged):
+            os.rename(self.absolute(staged[relPath]['staged']), self.absolute(relPath))
+            folders.add(os.path.dirname(self.absolute(relPath)))
+        for folder in sorted(folders):
+            fsyncPath(folder)
+        self.finish()
+        return [self.absolute(relPath) for relPath in sorted(staged)]
+
+    # Drop whatever was staged
+    def abort(self):
+        for entry in self.files.values():
+            staged = self.absolute(entry['staged'])
+            if os.path.exists(staged):
+                os.remove(staged)
+        self.finish()
+
+    def finish(self):
+        self.files = {}
+        if os.path.exists(self.journalFile):
+            os.remove(self.journalFile)
+            fsyncPath(self.storeDir)
+
+# Undo an operation that did not finish. Returns (label, changed paths), or None if there was none.
+def rollback(root, backups):
+    transaction = Transaction(root, backups, None)
+    if not os.path.exists(transaction.journalFile):
+        return None
+    try:
+        with open(transaction.journalFile, 'r') as jsonFile:
+            journal = json.load(jsonFile)
+    except ValueError:
+        # only a 'staging' journal is saved without fsync, so nothing was renamed yet
+        os.remove(transaction.journalFile)
+        return None
+    transaction.label = journal['label']
+    transaction.files = journal['files']
+    changed = []
+    if journal['state'] == 'committing':
+        for relPath, entry in sorted(journal['files'].items()):
+            if backups.restoreFile(transaction.absolute(relPath), entry['before']):
+                changed.append(transaction.absolute(relPath))
+    transaction.abort()
+    return transaction.label, changed
@@ -0,0 +1,112 @@
+'''
+manifest records which PathPirate modifications are applied to which files
+so their state can be shown without reading the files again.
+
+Copyright (C) 2023, 2024, 2025, 2026 Gregory D Carl
+
+This program is free software; you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with this program; if not, write to the Free Software Foundation, Inc.,
+51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+'''
+
+import os
+import json
+import hashlib
+from backupstore import fileDigest
+
+# Layout of <root>/.pathpirate/manifest.json:
+#   {'operations': {<operation>: {<path relative to root>: {'size', 'mtime', 'digest', 'applied'}}}}
+# An entry is only trusted while the file still has the recorded size and mtime, after that the
+# file has to be scanned again. Scans record their result too so the next start is free.
+class Manifest:
+
+    def __init__(self, root):
+        self.root = root
+        self.storeDir = os.path.join(root, '.pathpirate')
+        self.manifestFile = os.path.join(self.storeDir, 'manifest.json')
+        self.operations = None
+
+    def load(self):
+        if self.operations is None:
+            self.operations = {}
+            if os.path.exists(self.manifestFile):
+                try:
+                    with open(self.manifestFile, 'r') as jsonFile:
+                        self.operations = json.load(jsonFile)['operations']
+                except (ValueError, KeyError):
+                    # a damaged manifest only costs a rescan
+                    self.operations = {}
+        return self.operations
+
+    def save(self):
+        if not os.path.exists(self.storeDir):
+            os.makedirs(self.storeDir)
+        tempFile = '{}.tmp'.format(self.manifestFile)
+        with open(tempFile, 'w') as jsonFile:
+            json.dump({'operations': self.operations}, jsonFile, indent=4, sort_keys=True)
+        os.rename(tempFile, self.manifestFile)
+
+    def relative(self, path):
+        return os.path.relpath(path, self.root)
+
+    # The recorded entry if the file has not changed since it was recorded, otherwise None
+    def entry(self, operation, path):
+        entry = self.load().get(operation, {}).get(self.relative(path))
+        if entry is None:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if stat.st_size != entry['size'] or stat.st_mtime != entry['mtime']:
+            return None
+        return entry
+
+    # True only when the file is known to still hold the modification, no file is read
+    def isApplied(self, operation, path):
+        entry = self.entry(operation, path)
+        return entry is not None and entry['applied']
+
+    # Record the state of a file after it was changed (or found to be already changed), without data
+    # the digest is taken in blocks so large files are never held in memory
+    def record(self, operation, path, applied=True, data=None):
+        digest = fileDigest(path) if data is None else hashlib.sha256(data).hexdigest()
+        stat = os.stat(path)
+        self.load().setdefault(operation, {})[self.relative(path)] = {
+            'size': stat.st_size, 'mtime': stat.st_mtime,
+            'digest': digest, 'applied': applied}
+        self.save()
+
+    # State of one file for an operation, test(data) is only called if the stat data no longer
+    # matches the manifest (or there is no entry yet). Missing files are never applied.
+    def fileState(self, operation, path, test):
+        entry = self.entry(operation, path)
+        if entry is not None:
+            return entry['applied']
+        if not os.path.exists(path):
+            return False
+        with open(path, 'rb') as file:
+            data = file.read()
+        applied = bool(test(data))
+        self.record(operation, path, applied, data)
+        return applied
+
+    # An operation is applied when every one of its (path, test) checks is. Every check runs so
+    # every file gets an entry for the next start.
+    def state(self, operation, checks):
+        return all([self.fileState(operation, path, test) for path, test in checks])
+
+    def clear(self):
+        self.operations = {}
+        if os.path.exists(self.manifestFile):
+            os.remove(self.manifestFile)
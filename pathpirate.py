@@ -29,20 +29,65 @@ else:
     import tkSimpleDialog
     import tkMessageBox
 from shutil import copy
+from functools import wraps
 import os
+import re
 import json
+import math
+from templatestore import TemplateStore
+from halpatch import HalPatcher
+from backupstore import BackupStore, DigestCache, fileDigest
+from manifest import Manifest
+from halgraph import loadGraph, readIni
+from inimodel import IniFile, IniCache
+from steptiming import StepTiming, iniBoard
+from axislimits import AxisLimits, loadDrives, uiCeiling
+from textpatch import TextPatcher, fileContains
+from journal import Transaction, rollback
+
+# Wraps a button operation so it always ends: if it returns or raises before commitOperation its
+# transaction is aborted, and it does not start while another operation has a transaction open
+def operation(method):
+    @wraps(method)
+    def run(self, *args, **kwargs):
+        if self.transaction is not None:
+            self.console.insert(tk.END, '\n{} has not finished, try again once it has\n'.format(self.transaction.label), 'red')
+            self.console.see(tk.END)
+            return None
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            if self.transaction is not None:
+                self.abortOperation()
+    return run
 
 class PathPirate:
 
+    versionList = ['v2.9.2', 'v2.9.3', 'v2.9.4', 'v2.9.5', 'v2.9.6',
+                   'v2.10.0', 'v2.10.1',
+                   'v2.12.0', 'v2.12.1', 'v2.12.2', 'v2.12.3', 'v2.12.4', 'v2.12.5',
+                   'v2.13.0',
+                   'v2.14.0', 'v2.14.1', 'v2.14.2', 'v2.14.3', 'v2.14.4']
+
+    # [SPINDLE] settings of the encoder at-speed detector, added to the mill INI if it has none
+    atSpeedSettings = [('ENCODER_AT_SPEED_SCALE', '1.05', 'PathPirate encoder at-speed: measured speed within this factor of the commanded speed'),
+                       ('ENCODER_AT_SPEED_RPM', '30', 'PathPirate encoder at-speed: or within this many RPM of it'),
+                       ('ENCODER_AT_SPEED_SETTLE', '0.25', 'PathPirate encoder at-speed: for this many seconds')]
+    # time constant (seconds) of the filter on the encoder speed
+    atSpeedFilterTime = 0.05
+    # [HOSTMOT2] settings of the DPLL sampled spindle encoder
+    dpllSettings = [('ENCODER_DPLL_TIMER_US', '-100', 'PathPirate encoder: sample the encoders this many microseconds from read() (negative is before)'),
+                    ('ENCODER_DPLL_TIMER_NUMBER', '2', 'PathPirate encoder: DPLL timer that samples the encoders, -1 samples on read()')]
+    # ClearPath model ADD SERVOS sets the step timings for, and the factor over its minimum timings
+    clearPathModel = 'SDSK'
+    stepTimingMargin = 1.5
+    # the spindle encoder is on the board the INI names, a 5i25 or a 7i92/7i92T over Ethernet
+    encoderBoard = 'hm2_[HOSTMOT2](BOARD).0'
+
     def __init__(self):
         # set up the main window
         self.main = tk.Tk()
         self.main.title("PathPirate Configurator v1.18 for Tormach's PathPilot v2.9.2 - v2.14.4")
-        self.versionList = ['v2.9.2', 'v2.9.3', 'v2.9.4', 'v2.9.5', 'v2.9.6',
-                            'v2.10.0', 'v2.10.1',
-                            'v2.12.0', 'v2.12.1', 'v2.12.2', 'v2.12.3', 'v2.12.4', 'v2.12.5',
-                            'v2.13.0',
-                            'v2.14.0', 'v2.14.1', 'v2.14.2', 'v2.14.3', 'v2.14.4']
         winWidth = 1000
         winHeight = 700
         screenWidth = self.main.winfo_screenwidth()
@@ -80,6 +125,8 @@ class PathPirate:
         self.revertAllButton['state'] = 'disabled'
         self.exitButton = tk.Button(self.buttonFrame, text='EXIT', command=self.exitPathPirate, height=2, padx=5)
         self.exitButton.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        self.operationButtons = {'halshow': (self.addHalshowButton, 'ADD\nHALSHOW'), 'rapid': (self.maxVelButton, 'MAX VEL\nTO RAPID'), \
+                                 'encoder': (self.addEncoderButton, 'ADD\nENCODER'), 'servos': (self.addServosButton, 'ADD\nSERVOS')}
 
         # set up output text boxes
         self.machineInfo = tk.Text(self.versionFrame, padx=5, height=1, bg='black', fg='yellow', highlightthickness=0, bd=0)
@@ -114,11 +161,21 @@ class PathPirate:
         # allow right click to cut, and copy
         self.console.bind('<Button-3>', self.rightClick)
 
+        self.setup(os.getenv('HOME'))
+
+        # get current version and machine info
+        self.getVersion()
+
+        # call the main window loop
+        self.main.mainloop()
+
+    # Everything that does not need the window, shared with the headless version in pathpiratecli.py
+    def setup(self, home):
         # set restart/power cycle flags false
         self.restartRequired = False
 
         # set up necessary paths
-        self.home = os.getenv('HOME')
+        self.home = home
         self.tmc = os.path.join(self.home, 'tmc')
         self.sourcePath = os.path.join(self.tmc, 'tcl/bin')
         self.scriptFile = os.path.join(self.tmc, 'bin/halshow')
@@ -152,12 +209,14 @@ class PathPirate:
         self.pathPirateMill7i92tFirmware = os.path.join(self.mesaPath, '7i92t_7i85s.bin')
         self.pathPirateLatheFirmware = os.path.join(self.mesaPath, '5i25_t2_7i85s_dpll_lathe.bit')
         self.tormachFirmware = os.path.join(self.mesaPath, 'tormach_mill3.bit')
+        self.digestCache = DigestCache(os.path.join(self.tmc, '.pathpirate/digests.json'))
 
         self.pathPirateDir = os.path.realpath(os.path.dirname(__file__))
         self.newMillBit = os.path.join(self.pathPirateDir, 'files/firmware/mill/5i25_t2_7i85s_dpll.bit')
         self.newMill7i92Bit = os.path.join(self.pathPirateDir, 'files/firmware/mill/7i92_7i85s.bit')
         self.newMill7i92tBin =os.path.join(self.pathPirateDir, 'files/firmware/mill/7i92t_7i85s.bin')
         self.newLatheBin = os.path.join(self.pathPirateDir, 'files/firmware/lathe/5i25_t2_7i85s_dpll_lathe.bit')
+        self.firmwareDigests = os.path.join(self.pathPirateDir, 'files/firmware/digests.json')
         self.rapidImage = os.path.join(self.pathPirateDir, 'files/rapid_slider/RAPID_100.jpg')
         self.halshowPath = os.path.join(self.pathPirateDir, 'files/halshow/halshow.tcl')
         self.cbuttonPath = os.path.join(self.pathPirateDir, 'files/halshow/cbutton.tcl')
@@ -173,12 +232,19 @@ class PathPirate:
         self.cp1100_4 = os.path.join(self.pathPirateDir, 'files/configs/pathpirate_cpm_hsh_1100-3_7i92_rapidturn_specific.ini')
         self.cp1100Encoder_1 = os.path.join(self.pathPirateDir, 'files/configs/pathpirate_encoder_1100-3_specific.ini')
         self.cp1100Encoder_2 = os.path.join(self.pathPirateDir, 'files/configs/pathpirate_encoder_1100-3_7i92_specific.ini')
-
-        # get current version and machine info
-        self.getVersion()
-
-        # call the main window loop
-        self.main.mainloop()
+        # original copies of every file PathPirate changes, restored by REVERT ALL
+        self.backups = BackupStore(self.tmc)
+        # the transaction of the operation that is running, see beginOperation
+        self.transaction = None
+        # which modifications are applied, so their state is known without reading the files
+        self.manifest = Manifest(self.tmc)
+        # text replacements per operation, version range and machine, see textpatch.py
+        self.textPatcher = TextPatcher(os.path.join(self.pathPirateDir, 'files/patches'))
+        # every INI file is parsed once and shared by the operations, see inimodel.py
+        self.iniFiles = IniCache()
+        # per version HAL/INI templates are rebuilt from a base set plus patches when needed
+        self.templateStore = TemplateStore(os.path.join(self.pathPirateDir, 'files/configs/templates'), \
+                                           os.path.join(self.pathPirateDir, 'files/configs/.cache'))
 
     # Allows a user to right click to cut or copy in the console text box
     def rightClick(self, event=None):
@@ -188,8 +254,10 @@ class PathPirate:
         menu.tk_popup(event.x_root, event.y_root)
 
     # Adds halshow back to PathPilot so it can be called with 'ADMIN HALSHOW' via MDI
+    @operation
     def addHalshow(self, event=None):
         self.console.insert(tk.END, '\n--------------\nADDING HALSHOW\n--------------\n', 'yellow')
+        self.beginOperation('ADD HALSHOW')
         # check if ~/tmc/tcl/bin exists (it shouldn't) and if it doesnt, create it
         if not os.path.lexists(self.sourcePath):
             os.mkdir(self.sourcePath)
@@ -204,13 +272,12 @@ class PathPirate:
             self.console.see(tk.END)
             return
         for file in [self.halshowPath, self.cbuttonPath]:
-            copy(file, self.sourcePath)
-        tempFile = '{}.bak'.format(self.scriptFile)
-        if not os.path.exists(tempFile):
-            copy(self.scriptFile, tempFile)
-        with open(self.scriptFile,'w') as script:
-            script.write('#!/usr/bin/tclsh8.6\n')
-            script.write('source ~/tmc/tcl/bin/halshow.tcl')
+            self.transaction.copy(file, os.path.join(self.sourcePath, os.path.basename(file)))
+        self.transaction.write(self.scriptFile, '#!/usr/bin/tclsh8.6\nsource ~/tmc/tcl/bin/halshow.tcl')
+        self.commitOperation()
+        self.manifest.record('halshow', self.scriptFile)
+        self.manifest.record('halshow', os.path.join(self.sourcePath, 'halshow.tcl'))
+        self.showModifications()
         self.console.insert(tk.END, '\nhalshow.tcl and cbutton.tcl were successfully placed in: ')
         self.console.insert(tk.END, '{}\n'.format(self.sourcePath), 'pink')
         self.console.insert(tk.END, 'The following script was successfully modified: ')
@@ -220,16 +287,16 @@ class PathPirate:
         self.console.see(tk.END)
 
     # Converts the MAX VEL slider to RAPID since having a MAX VEL slider makes no sense
+    @operation
     def convertSlider(self, event=None):
         self.console.insert(tk.END, '\n---------------------------------------\nCONVERTING SLIDER FROM MAX VEL TO RAPID\n---------------------------------------\n', 'yellow')
+        self.beginOperation('MAX VEL TO RAPID')
         missing = False
         change = False
+        plan = [(path, patch) for operation, path, patch in self.textEditPlan(self.machine) if operation == 'rapid']
+        file_list = [path for path, _ in plan]
         if (self.majorVer, self.minorVer) == (2, 9):
-            file_list = [self.uiCommon, self.consoleHal1, self.consoleHal2, self.tooltips, self.velImage, self.rapidImage]
-        else:
-            file_list = [self.uiCommon, self.consoleHal1, self.consoleHal2, self.tooltips, self.plasmaControls, self.latheControls, self.millControls]
-        if (self.majorVer, self.minorVer, self.patchVer) <= (2, 14, 0):
-            file_list.append(self.uiLathe)
+            file_list.extend([self.velImage, self.rapidImage])
         for file in file_list:
             if not os.path.exists(file):
                 self.console.insert(tk.END, 'The following required file is missing: ', 'red')
@@ -239,49 +306,16 @@ class PathPirate:
             self.console.insert(tk.END, '\nAborting...\n', 'red')
             self.console.see(tk.END)
             return
-        modFiles = [self.uiCommon, self.consoleHal1, self.consoleHal2, self.tooltips]
-        if (self.majorVer, self.minorVer, self.patchVer) <= (2, 14, 0):
-            modFiles.append(self.uiLathe)
-        for modFile in modFiles:
-            tempFile = '{}.bak'.format(modFile)
-            if not os.path.exists(tempFile):
-                copy(modFile, tempFile)
-            with open(modFile, 'r+') as file:
-                text = file.read()
-                if 'PathPirate' in text:
-                    self.console.insert(tk.END, 'The necessary modifications are already present in the following file: ')
-                    self.console.insert(tk.END, '{}\n'.format(modFile), 'pink')
-                    continue
-                if modFile == self.uiCommon:
-                    text = text.replace('lcnc_apply_function=lambda value: self.command.maxvel(value * self.maxvel_lin / 100, value * self.maxvel_ang / 100)),', \
-                    'lcnc_apply_function=lambda value: self.command.rapidrate(value / 100)), #Changed by PathPirate')
-                elif modFile == self.uiLathe:
-                    text = text.replace('self.maxvel_lin = math.sqrt(inch_per_second * 2)', \
-                                        'self.maxvel_lin = math.sqrt(2 * inch_per_second**2)')
-                    text = text.replace('self.apply_newest_override_slider_values(force = True)', \
-                    'self.apply_newest_override_slider_values(force = True)\n' \
-                    '            self.command.maxvel(self.maxvel_lin, self.maxvel_ang) #Changed by PathPirate')
-                elif modFile == self.tooltips:
-                    text = text.replace('''
-        "maxvel_override_100": {
-            "shorttext_id" : "msg_maxvel_override_text",
-            "longtext_id" : "msg_maxvel_override_tooltip",
-            "long_width": 275
-        },
-        "maxvel_override_scale": {
-            "shorttext_id" : "msg_maxvel_override_text",
-            "longtext_id" : "msg_maxvel_override_tooltip",
-            "long_width": 275
-        },''', '')
-                else:
-                    text = text.replace('setp tormach-console.0.rapid-override-scale 960', \
-                    '#setp tormach-console.0.rapid-override-scale 960 #Changed by PathPirate')
-                file.seek(0)
-                file.truncate()
-                file.write(text)
-                self.console.insert(tk.END, 'The following file has been successfully modified: ')
+        record = []
+        for modFile, patch in plan:
+            # some files (the glade files) are large, skip reading them if they are known to be done
+            if self.manifest.isApplied('rapid', modFile):
+                self.console.insert(tk.END, 'The necessary modifications are already present in the following file: ')
                 self.console.insert(tk.END, '{}\n'.format(modFile), 'pink')
-                change = True
+                continue
+            changed = self.patchFile(modFile, patch)
+            change = change or changed
+            record.append((modFile, patch, changed))
         if (self.majorVer, self.minorVer) == (2, 9):
             with open (self.velImage, 'rb') as originalImage:
                 original = originalImage.read()
@@ -290,38 +324,58 @@ class PathPirate:
             if original == modified:
                 self.console.insert(tk.END, 'Image file was previously replaced\n\n')
             else:
-                tempFile = '{}.bak'.format(self.velImage)
-                if not os.path.exists(tempFile):
-                    copy(self.velImage, tempFile)
-                copy(self.rapidImage, self.velImage)
+                self.transaction.copy(self.rapidImage, self.velImage)
                 self.console.insert(tk.END, 'Image file copied to: ')
                 self.console.insert(tk.END, '{}\n'.format(self.velImage), 'pink')
                 change = True
-        else:
-            for modFile in [self.plasmaControls, self.latheControls, self.millControls]:
-                tempFile = '{}.bak'.format(modFile)
-                if not os.path.exists(tempFile):
-                    copy(modFile, tempFile)
-                with open(modFile, 'r+') as file:
-                    text = file.read()
-                    if '<property name="text">Rapid</property>' in text:
-                        self.console.insert(tk.END, 'The necessary modifications are already present in the following file: ')
-                        self.console.insert(tk.END, '{}\n'.format(modFile), 'pink')
-                        continue
-                    text = text.replace('<property name="text">Max   Vel</property>', \
-                    '<property name="text">Rapid</property>')
-                    file.seek(0)
-                    file.truncate()
-                    file.write(text)
-                    self.console.insert(tk.END, 'The following file has been successfully modified: ')
-                    self.console.insert(tk.END, '{}\n'.format(modFile), 'pink')
-                    change = True
+        self.commitOperation()
+        # a file the patch did not match stays unapplied so the next run patches it again
+        for modFile, patch, changed in record:
+            self.manifest.record('rapid', modFile, applied=changed or fileContains(modFile, patch['marker']))
+        if (self.majorVer, self.minorVer) == (2, 9):
+            self.manifest.record('rapid', self.velImage, data=modified)
         if change:
             self.restartRequired = True
             self.console.insert(tk.END, '\nA RESTART IS REQUIRED FOR CHANGES TO TAKE EFFECT!\n', 'white')
             self.console.insert(tk.END, 'You will be prompted to restart upon exiting PathPirate\n', 'white')
+        self.showModifications()
         self.console.see(tk.END)
 
+    # (operation, file, patch) for every text patch in files/patches that applies to this version of a machine,
+    # parameters {name: text} fill in the patches that have some
+    def textEditPlan(self, machine, parameters=None):
+        plan = []
+        for operation, patch in self.textPatcher.patches((self.majorVer, self.minorVer, self.patchVer), machine, self.versionTuple):
+            patch = self.textPatcher.fill(patch, parameters)
+            for name in patch['files']:
+                plan.append((operation, getattr(self, name), patch))
+        return plan
+
+    # Apply the replacements in one pass and return the new text and the number of matches of each one
+    def replaceText(self, text, edits):
+        return self.textPatcher.apply(text, edits)
+
+    # Warn about replacements that found nothing to change in a file
+    def warnUnmatched(self, path, counts):
+        if 0 in counts:
+            self.console.insert(tk.END, 'WARNING: {} of {} replacements found nothing to change in: '.format(counts.count(0), len(counts)), 'yellow')
+            self.console.insert(tk.END, '{}\n'.format(path), 'pink')
+
+    # Apply a patch to a file unless its marker shows it is already there, returns True if the file changed.
+    # The file is streamed through the replacements into a file staged in the current transaction.
+    def patchFile(self, path, patch):
+        if fileContains(path, patch['marker']):
+            self.console.insert(tk.END, 'The necessary modifications are already present in the following file: ')
+            self.console.insert(tk.END, '{}\n'.format(path), 'pink')
+            return False
+        counts = self.textPatcher.rewrite(path, patch['edits'], self.transaction.stage(path))
+        self.warnUnmatched(path, counts)
+        if not any(counts):
+            return False
+        self.console.insert(tk.END, 'The following file has been successfully modified: ')
+        self.console.insert(tk.END, '{}\n'.format(path), 'pink')
+        return True
+
     # Added to center the tkSimpleDialog.askinteger box. Help from: https://stackoverflow.com/a/69904742 (and the tkSimpleDialog source code)
     def askinteger(self, title, prompt, **kwargs):
         def change_geometry():
@@ -349,10 +403,12 @@ class PathPirate:
 
     # Adds an encoder to a mill that is using a Mesa 7i85s card.  770 has not been tested.
     # This change is not necessary for the rapidturn configs
+    @operation
     def addEncoder(self, event=None):
         change = False
         missing = False
         self.console.insert(tk.END, '\n--------------\nADDING ENCODER\n--------------\n', 'yellow')
+        self.beginOperation('ADD ENCODER')
         # initialvalue is set to -1440 as a perk of being the author (that's my encoder's scale) :-)
         scale = self.askinteger(title='ENCODER SCALE', prompt='Enter the encoder scale:', initialvalue='-1440', parent=self.main)
         if scale is None:
@@ -369,69 +425,146 @@ class PathPirate:
             self.console.insert(tk.END, '\nAborting...\n', 'red')
             self.console.see(tk.END)
             return
-        backupFiles = [self.currentMillIni, self.cm770_1, self.cm770_2, self.cm1100_1, self.cm1100_2]
-        for file in backupFiles:
-            tempFile = '{}.bak'.format(file)
-            if not os.path.exists(tempFile):
-                copy(file, tempFile)
-        with open(self.currentMillIni, 'r+') as file:
-            text = file.read()
-            if 'HALFILE = series3_encoder.hal' in text:
-                self.console.insert(tk.END, 'The necessary modifications are already present in the following file: ')
-                self.console.insert(tk.END, '{}\n'.format(self.currentMillIni), 'pink')
-            else:
-                for line in text.splitlines():
-                    if 'HALFILE = tormach_mill_mesa.hal' in line:
-                        text = text.replace(line, 'HALFILE = tormach_mill_mesa.hal\nHALFILE = series3_encoder.hal')
-                        file.seek(0)
-                        file.truncate()
-                        file.write(text)
-                        change = True
-                        self.console.insert(tk.END, 'The following file has been successfully modified: ')
-                        self.console.insert(tk.END, '{}\n'.format(self.currentMillIni), 'pink')
-        with open(self.encoderHal,'w') as file:
-            text = ('#####################################################################\n')
-            text += ('# The following encoder lines were added by PathPirate\n\n')
-            text += ('unlinkp motion.spindle-speed-in\n')
-            text += ('net spindle-position hm2_5i25.0.encoder.03.position => motion.spindle-revs\n')
-            text += ('net spindle-velocity hm2_5i25.0.encoder.03.velocity => motion.spindle-speed-in\n')
-            text += ('net spindle-index-enable hm2_5i25.0.encoder.03.index-enable <=> motion.spindle-index-enable\n')
-            text += ('setp hm2_5i25.0.encoder.03.scale {}'.format(scale))
-            file.seek(0)
-            file.truncate()
-            file.write(text)
+        graph, ini = self.millGraph()
+        atSpeed = self.encoderAtSpeed(graph, ini)
+        dpll = self.encoderDpll(graph)
+        # only the [HAL] list is touched, the encoder HAL file is loaded right after the mesa one, and
+        # the settings of the encoder HAL are added to their section unless the user already has them
+        millIni = self.iniFiles.get(self.currentMillIni).copy()
+        present = 'series3_encoder.hal' in millIni.getAll('HAL', 'HALFILE')
+        added = not present and millIni.insertAfter('HAL', 'HALFILE', 'series3_encoder.hal', 'HALFILE', 'tormach_mill_mesa.hal')
+        if not present and not added:
+            self.warnUnmatched(self.currentMillIni, [0])
+        settings = []
+        for section, sectionSettings in [('SPINDLE', self.atSpeedSettings if atSpeed else []), ('HOSTMOT2', self.dpllSettings if dpll else [])]:
+            lines = []
+            for key, value, comment in sectionSettings:
+                if not millIni.has(section, key):
+                    lines.extend(['# {}'.format(comment), '{} = {}'.format(key, value)])
+            millIni.addLines(section, lines)
+            settings.extend(lines)
+        if added or settings:
+            self.transaction.write(self.currentMillIni, millIni.data())
             change = True
             self.console.insert(tk.END, 'The following file has been successfully modified: ')
-            self.console.insert(tk.END, '{}\n'.format(self.encoderHal), 'pink')
-        with open(self.cm1100_1, 'r+') as file:
-            text = file.read()
-            if not 'PathPirate' in text:
-                copy(self.cp770Encoder_1, self.cm770_1)
-                copy(self.cp770Encoder_2, self.cm770_2)
-                copy(self.cp1100Encoder_1, self.cm1100_1)
-                copy(self.cp1100Encoder_2, self.cm1100_2)
-                change = True
-                self.console.insert(tk.END, 'The following files has been successfully modified:\n')
-                self.console.insert(tk.END, '{}\n'.format(self.cm770_1), 'pink')
-                self.console.insert(tk.END, '{}\n'.format(self.cm770_2), 'pink')
-                self.console.insert(tk.END, '{}\n'.format(self.cm1100_1), 'pink')
-                self.console.insert(tk.END, '{}\n'.format(self.cm1100_2), 'pink')
-            else:
-                self.console.insert(tk.END, 'The necessary modifications are already present in the following files:\n')
-                self.console.insert(tk.END, '{}\n'.format(self.cm770_1), 'pink')
-                self.console.insert(tk.END, '{}\n'.format(self.cm770_2), 'pink')
-                self.console.insert(tk.END, '{}\n'.format(self.cm1100_1), 'pink')
-                self.console.insert(tk.END, '{}\n'.format(self.cm1100_2), 'pink')
-        for file in [self.newMillBit, self.newMill7i92Bit, self.newMill7i92tBin]:
-            copy(file, self.mesaPath)
-        self.console.insert(tk.END, '\nThe necessary firmwares have been copied to:\n')
-        self.console.insert(tk.END, '{}\n'.format(self.mesaPath), 'pink')
+            self.console.insert(tk.END, '{}\n'.format(self.currentMillIni), 'pink')
+        elif present:
+            self.console.insert(tk.END, 'The necessary modifications are already present in the following file: ')
+            self.console.insert(tk.END, '{}\n'.format(self.currentMillIni), 'pink')
+        text = ('#####################################################################\n')
+        text += ('# The following encoder lines were added by PathPirate\n\n')
+        text += ('unlinkp motion.spindle-speed-in\n')
+        text += ('net spindle-position {}.encoder.03.position => motion.spindle-revs\n'.format(self.encoderBoard))
+        text += ('net spindle-velocity {}.encoder.03.velocity => motion.spindle-speed-in\n'.format(self.encoderBoard))
+        text += ('net spindle-index-enable {}.encoder.03.index-enable <=> motion.spindle-index-enable\n'.format(self.encoderBoard))
+        text += ('setp {}.encoder.03.scale {}'.format(self.encoderBoard, scale))
+        if dpll is None:
+            self.console.insert(tk.END, 'WARNING: {} does not set up the DPLL, the encoder is sampled on read()\n'.format(self.currentMillHal), 'yellow')
+        else:
+            text += dpll
+        if atSpeed is None:
+            self.console.insert(tk.END, 'WARNING: {} does not link motion.spindle-speed-out and motion.spindle-at-speed, '
+                                'tormachspindle keeps timing the spindle start\n'.format(self.currentMillHal), 'yellow')
+        else:
+            text += atSpeed
+        self.transaction.write(self.encoderHal, text)
+        change = True
+        self.console.insert(tk.END, 'The following file has been successfully modified: ')
+        self.console.insert(tk.END, '{}\n'.format(self.encoderHal), 'pink')
+        if not fileContains(self.cm1100_1, 'PathPirate'):
+            self.transaction.copy(self.cp770Encoder_1, self.cm770_1)
+            self.transaction.copy(self.cp770Encoder_2, self.cm770_2)
+            self.transaction.copy(self.cp1100Encoder_1, self.cm1100_1)
+            self.transaction.copy(self.cp1100Encoder_2, self.cm1100_2)
+            change = True
+            self.console.insert(tk.END, 'The following files has been successfully modified:\n')
+            self.console.insert(tk.END, '{}\n'.format(self.cm770_1), 'pink')
+            self.console.insert(tk.END, '{}\n'.format(self.cm770_2), 'pink')
+            self.console.insert(tk.END, '{}\n'.format(self.cm1100_1), 'pink')
+            self.console.insert(tk.END, '{}\n'.format(self.cm1100_2), 'pink')
+        else:
+            self.console.insert(tk.END, 'The necessary modifications are already present in the following files:\n')
+            self.console.insert(tk.END, '{}\n'.format(self.cm770_1), 'pink')
+            self.console.insert(tk.END, '{}\n'.format(self.cm770_2), 'pink')
+            self.console.insert(tk.END, '{}\n'.format(self.cm1100_1), 'pink')
+            self.console.insert(tk.END, '{}\n'.format(self.cm1100_2), 'pink')
+        self.deployFirmware([self.newMillBit, self.newMill7i92Bit, self.newMill7i92tBin])
+        self.commitOperation()
+        self.manifest.record('encoder', self.currentMillIni, applied=present or added)
         if change:
             self.restartRequired = True
             self.console.insert(tk.END, '\nA RESTART IS REQUIRED FOR CHANGES TO TAKE EFFECT!\n', 'white')
             self.console.insert(tk.END, 'You will be prompted to restart upon exiting PathPirate\n', 'white')
+        self.showModifications()
         self.console.see(tk.END)
 
+    # The installed mill HAL file parsed with the mill INI, (None, None) if it can not be
+    def millGraph(self):
+        if not os.path.exists(self.currentMillHal) or not os.path.exists(self.currentMillIni):
+            return None, None
+        try:
+            ini = readIni(self.currentMillIni, self.iniFiles)
+            return loadGraph(self.currentMillHal, ini, os.path.join(self.tmc, '.pathpirate/halgraph')), ini
+        except Exception:
+            return None, None
+
+    # HAL lines that sample the encoders on DPLL timer 2, [HOSTMOT2]ENCODER_DPLL_TIMER_US from the
+    # nominal read() time, instead of when read() runs. Over Ethernet (7i92/7i92T) the packet timing
+    # moves read() around and the spindle position jitters with it, which threading and rigid tapping
+    # see at higher RPM. Timer 1 stays with the stepgens. encoder.timer-number covers every encoder of
+    # the board, ENCODER_DPLL_TIMER_NUMBER = -1 puts them back on read(). Returns None if the mill HAL
+    # file does not set up the DPLL (the firmware may not have one).
+    def encoderDpll(self, graph):
+        if graph is None or not any(re.search(r'\.dpll\.\d+\.timer-us$', name) for name in graph.params):
+            return None
+        text = ('\n\n#####################################################################\n')
+        text += ('# spindle encoder sampled on the DPLL, see [HOSTMOT2]ENCODER_DPLL_* in the INI\n\n')
+        text += ('setp {}.dpll.02.timer-us [HOSTMOT2]ENCODER_DPLL_TIMER_US\n'.format(self.encoderBoard))
+        text += ('setp {}.encoder.timer-number [HOSTMOT2]ENCODER_DPLL_TIMER_NUMBER'.format(self.encoderBoard))
+        return text
+
+    # HAL lines that drive motion.spindle-at-speed from the encoder instead of tormachspindle's spin-up
+    # timer: the filtered encoder speed has to stay within [SPINDLE]ENCODER_AT_SPEED_SCALE times (or
+    # ENCODER_AT_SPEED_RPM of) the commanded speed for ENCODER_AT_SPEED_SETTLE seconds. The commanded
+    # speed is read from the signal the installed mill HAL file uses for motion.spindle-speed-out.
+    # Returns None if that HAL file does not show it.
+    def encoderAtSpeed(self, graph, ini):
+        if graph is None:
+            return None
+        command = graph.pins.get('motion.spindle-speed-out', {}).get('signal')
+        if command is None or 'motion.spindle-at-speed' not in graph.pins:
+            return None
+        try:
+            period = float(ini.get('EMCMOT', {}).get('SERVO_PERIOD', 1000000)) / 1e9
+        except ValueError:
+            period = 0.001
+        # first order filter over atSpeedFilterTime, the encoder velocity is noisy at low speed
+        gain = 1 - math.exp(-period / self.atSpeedFilterTime)
+        text = ('\n\n#####################################################################\n')
+        text += ('# spindle at-speed from the encoder, see [SPINDLE]ENCODER_AT_SPEED_* in the INI\n\n')
+        text += ('loadrt scale names=spindle-enc-rpm\n')
+        text += ('loadrt lowpass names=spindle-enc-filter\n')
+        text += ('loadrt near names=spindle-enc-near\n')
+        text += ('loadrt timedelay names=spindle-enc-settle\n')
+        text += ('addf spindle-enc-rpm servo-thread\n')
+        text += ('addf spindle-enc-filter servo-thread\n')
+        text += ('addf spindle-enc-near servo-thread\n')
+        text += ('addf spindle-enc-settle servo-thread\n')
+        text += ('setp spindle-enc-rpm.gain 60\n')
+        text += ('setp spindle-enc-filter.gain {:.6f}\n'.format(gain))
+        text += ('setp spindle-enc-near.scale [SPINDLE]ENCODER_AT_SPEED_SCALE\n')
+        text += ('setp spindle-enc-near.difference [SPINDLE]ENCODER_AT_SPEED_RPM\n')
+        text += ('setp spindle-enc-settle.on-delay [SPINDLE]ENCODER_AT_SPEED_SETTLE\n')
+        text += ('setp spindle-enc-settle.off-delay 0\n')
+        text += ('net spindle-velocity => spindle-enc-rpm.in\n')
+        text += ('net spindle-enc-rpm spindle-enc-rpm.out => spindle-enc-filter.in\n')
+        text += ('net spindle-enc-rpm-filtered spindle-enc-filter.out => spindle-enc-near.in2\n')
+        text += ('net {} => spindle-enc-near.in1\n'.format(command))
+        text += ('net spindle-enc-in-band spindle-enc-near.out => spindle-enc-settle.in\n')
+        text += ('unlinkp motion.spindle-at-speed\n')
+        text += ('net spindle-enc-at-speed spindle-enc-settle.out => motion.spindle-at-speed')
+        return text
+
     def addServos(self, event=None):
         if self.machine in ['770', '1100-3']:
             self.addServosMill()
@@ -439,8 +572,10 @@ class PathPirate:
             self.addServosLathe()
 
     # Adds ClearPath Servos to a mill (that is using a Mesa 7i85s card)
+    @operation
     def addServosMill(self, event=None):
         self.console.insert(tk.END, '\n-----------------------\nADDING CLEARPATH SERVOS\n-----------------------\n', 'yellow')
+        self.beginOperation('ADD SERVOS')
         missing = False
         checkFiles = [self.currentMillHal, self.currentRapidTurnHal, self.clearPathMillHal, self.clearPathRapidTurnHal, self.newMill7i92Bit, self.newMill7i92tBin, self.newMillBit, self.uiLathe, self.cp1100_1, self.cp1100_2, self.cp1100_3, self.cp1100_4, self.cm1100_1, self.cm1100_2, self.cm1100_3, self.cm1100_4, self.cp770_1, self.cp770_2, self.cp770_3, self.cp770_4, self.cm770_1, self.cm770_2, self.cm770_3, self.cm770_4]
         for file in checkFiles:
@@ -452,43 +587,38 @@ class PathPirate:
             self.console.insert(tk.END, '\nAborting...\n', 'red')
             self.console.see(tk.END)
             return
-        backupFiles = [self.currentMillHal, self.currentRapidTurnHal, self.cm770_1, self.cm770_2, self.cm770_3, self.cm770_4, self.cm1100_1, self.cm1100_2, self.cm1100_3, self.cm1100_4]
-        for file in backupFiles:
-            tempFile = '{}.bak'.format(file)
-            if not os.path.exists(tempFile):
-                copy(file, tempFile)
-        copy(self.cp770_1, self.cm770_1)
-        copy(self.cp770_2, self.cm770_2)
-        copy(self.cp770_3, self.cm770_3)
-        copy(self.cp770_4, self.cm770_4)
-        copy(self.cp1100_1, self.cm1100_1)
-        copy(self.cp1100_2, self.cm1100_2)
-        copy(self.cp1100_3, self.cm1100_3)
-        copy(self.cp1100_4, self.cm1100_4)
-        copy(self.clearPathMillHal, self.currentMillHal)
-        copy(self.clearPathRapidTurnHal, self.currentRapidTurnHal)
+        drives = self.machineDrives()
+        if drives is False:
+            return
+        patched = []
+        if self.unknownVersion:
+            for halFile, template in [(self.currentMillHal, self.clearPathMillHal), (self.currentRapidTurnHal, self.clearPathRapidTurnHal)]:
+                text = self.patchStockFile(halFile, template)
+                if text is None:
+                    self.console.insert(tk.END, '\nAborting...\n', 'red')
+                    self.console.see(tk.END)
+                    return
+                patched.append((halFile, text))
+        for template, target in [(self.cp770_1, self.cm770_1), (self.cp770_2, self.cm770_2), (self.cp770_3, self.cm770_3), (self.cp770_4, self.cm770_4),
+                                 (self.cp1100_1, self.cm1100_1), (self.cp1100_2, self.cm1100_2), (self.cp1100_3, self.cm1100_3), (self.cp1100_4, self.cm1100_4)]:
+            # the drives are those of the mill axes, the RapidTurn configs keep their limits
+            millConfig = target in [self.cm770_1, self.cm770_2, self.cm1100_1, self.cm1100_2]
+            servoLimits = self.writeServoIni(target, self.iniFiles.get(template).copy(), drives if millConfig else None)
+            if target == (self.cm770_1 if self.machine == '770' else self.cm1100_1):
+                machineLimits = servoLimits
+        if self.unknownVersion:
+            for halFile, text in patched:
+                self.transaction.write(halFile, text)
+        else:
+            self.transaction.copy(self.clearPathMillHal, self.currentMillHal)
+            self.transaction.copy(self.clearPathRapidTurnHal, self.currentRapidTurnHal)
         if not os.path.exists(self.encoderHal):
-            with open(self.encoderHal,'w') as _:
-                pass
-        #in PP v2.9.x, the Y axis servo was not polled for fault conditions. This fixes that.
+            self.transaction.write(self.encoderHal, '')
+        #in PP v2.9.x, the Y axis servo was not polled for fault conditions, files/patches/servos.json fixes that.
         #Tormach has since fixed this for v2.10
-        if (self.majorVer, self.minorVer) == (2, 9):
-            tempFile = '{}.bak'.format(self.uiLathe)
-            if not os.path.exists(tempFile):
-                copy(self.uiLathe, tempFile)
-            with open(self.uiLathe, 'r+') as file:
-                text = file.read()
-                if 'PathPirate' in text:
-                    self.console.insert(tk.END, 'The necessary modifications are already present in the following file: ')
-                    self.console.insert(tk.END, '{}\n'.format(self.uiLathe), 'pink')
-                else:
-                    text = text.replace('self.axis_motor_poll(0)', \
-                    'self.axis_motor_poll(0)\n        if self.machineconfig.in_rapidturn_mode():#Changed by PathPirate\n            self.axis_motor_poll(1)#Changed by PathPirate')
-                    file.seek(0)
-                    file.truncate()
-                    file.write(text)
-                    self.console.insert(tk.END, 'The following file has been successfully modified: ')
-                    self.console.insert(tk.END, '{}\n'.format(self.uiLathe), 'pink')
+        for operation, path, patch in self.textEditPlan(self.machine):
+            if operation == 'servos':
+                self.patchFile(path, patch)
         self.console.insert(tk.END, 'The following files have been successfully modified:\n')
         self.console.insert(tk.END, '{}\n'.format(self.currentMillHal), 'pink')
         self.console.insert(tk.END, '{}\n'.format(self.currentRapidTurnHal), 'pink')
@@ -500,18 +630,28 @@ class PathPirate:
         self.console.insert(tk.END, '{}\n'.format(self.cm1100_2), 'pink')
         self.console.insert(tk.END, '{}\n'.format(self.cm1100_3), 'pink')
         self.console.insert(tk.END, '{}\n'.format(self.cm1100_4), 'pink')
-        for file in [self.newMillBit, self.newMill7i92Bit, self.newMill7i92tBin]:
-            copy(file, self.mesaPath)
-        self.console.insert(tk.END, '\nThe necessary firmwares have been copied to:\n')
-        self.console.insert(tk.END, '{}\n'.format(self.mesaPath), 'pink')
+        self.showServoLimits(*machineLimits)
+        self.deployFirmware([self.newMillBit, self.newMill7i92Bit, self.newMill7i92tBin])
+        self.commitOperation()
+        for file in [self.currentMillHal, self.currentRapidTurnHal]:
+            self.manifest.record('servos', file)
+        if self.machine == '770':
+            self.checkHal(self.currentMillHal, self.cm770_1)
+            self.checkHal(self.currentRapidTurnHal, self.cm770_3)
+        else:
+            self.checkHal(self.currentMillHal, self.cm1100_1)
+            self.checkHal(self.currentRapidTurnHal, self.cm1100_3)
         self.restartRequired = True
         self.console.insert(tk.END, '\nA RESTART IS REQUIRED FOR CHANGES TO TAKE EFFECT!\n', 'white')
         self.console.insert(tk.END, 'You will be prompted to restart upon exiting PathPirate\n', 'white')
+        self.showModifications()
         self.console.see(tk.END)
 
     # Adds ClearPath Servos to a lathe (that is using a Mesa 7i85s card)
+    @operation
     def addServosLathe(self, event=None):
         self.console.insert(tk.END, '\n-----------------------\nADDING CLEARPATH SERVOS\n-----------------------\n', 'yellow')
+        self.beginOperation('ADD SERVOS')
         missing = False
         for file in [self.currentLatheHal, self.currentLatheIni, self.clearPathLatheHal, self.clearPathLatheIni, self.newLatheBin]:
             if not os.path.exists(file):
@@ -522,40 +662,197 @@ class PathPirate:
             self.console.insert(tk.END, '\nAborting...\n', 'red')
             self.console.see(tk.END)
             return
-        for file in [self.currentLatheHal, self.currentLatheIni]:
-            tempFile = '{}.bak'.format(file)
-            if not os.path.exists(tempFile):
-                copy(file, tempFile)
-        copy(self.clearPathLatheIni, self.currentLatheIni)
-        copy(self.clearPathLatheHal, self.currentLatheHal)
-        tempFile = '{}.bak'.format(self.uiLathe)
-        if not os.path.exists(tempFile):
-            copy(self.uiLathe, tempFile)
-        with open(self.uiLathe, 'r+') as file:
-            text = file.read()
-            if 'PathPirate' in text:
-                self.console.insert(tk.END, 'The necessary modifications are already present in the following file: ')
-                self.console.insert(tk.END, '{}\n'.format(self.uiLathe), 'pink')
-            else:
-                text = text.replace('max_maxvel = 100.0', 'max_maxvel = 300.0#Changed by PathPirate')
-                text = text.replace('max_maxvel = max_maxvel * 1.2', '#max_maxvel = max_maxvel * 1.2#Changed by PathPirate')
-                file.seek(0)
-                file.truncate()
-                file.write(text)
-                self.console.insert(tk.END, 'The following file has been successfully modified: ')
-                self.console.insert(tk.END, '{}\n'.format(self.uiLathe), 'pink')
+        drives = self.machineDrives()
+        if drives is False:
+            return
+        if self.unknownVersion:
+            patched = []
+            for stockFile, template in [(self.currentLatheIni, self.clearPathLatheIni), (self.currentLatheHal, self.clearPathLatheHal)]:
+                text = self.patchStockFile(stockFile, template)
+                if text is None:
+                    self.console.insert(tk.END, '\nAborting...\n', 'red')
+                    self.console.see(tk.END)
+                    return
+                patched.append((stockFile, text))
+            for stockFile, text in patched:
+                if stockFile == self.currentLatheIni:
+                    latheIni = IniFile(text, stockFile)
+                    machineLimits = self.writeServoIni(stockFile, latheIni, drives)
+                else:
+                    self.transaction.write(stockFile, text)
+        else:
+            latheIni = self.iniFiles.get(self.clearPathLatheIni).copy()
+            machineLimits = self.writeServoIni(self.currentLatheIni, latheIni, drives)
+            self.transaction.copy(self.clearPathLatheHal, self.currentLatheHal)
+        # the feed ceiling of the lathe UI follows the axis limits the INI ended up with
+        ceiling = '{:.1f}'.format(uiCeiling(latheIni.values()) or 300.0)
+        for operation, path, patch in self.textEditPlan(self.machine, {'latheMaxVel': ceiling}):
+            if operation == 'servos':
+                self.patchFile(path, patch)
+        self.updateLatheCeiling(ceiling)
         self.console.insert(tk.END, 'The following files have been successfully modified:\n')
         self.console.insert(tk.END, '{}\n'.format(self.currentLatheIni), 'pink')
-        self.console.insert(tk.END, '{}\n\n'.format(self.currentLatheHal), 'pink')
-        for file in [self.newLatheBin]:
-            copy(file, self.mesaPath)
-        self.console.insert(tk.END, '\nThe necessary firmwares have been copied to:\n')
-        self.console.insert(tk.END, '{}\n'.format(self.mesaPath), 'pink')
+        self.console.insert(tk.END, '{}\n'.format(self.currentLatheHal), 'pink')
+        self.showServoLimits(*machineLimits)
+        self.deployFirmware([self.newLatheBin])
+        self.commitOperation()
+        for file in [self.currentLatheHal, self.currentLatheIni]:
+            self.manifest.record('servos', file)
+        self.checkHal(self.currentLatheHal, self.currentLatheIni)
         self.restartRequired = True
         self.console.insert(tk.END, '\nA RESTART IS REQUIRED FOR CHANGES TO TAKE EFFECT!\n', 'white')
         self.console.insert(tk.END, 'You will be prompted to restart upon exiting PathPirate\n', 'white')
+        self.showModifications()
         self.console.see(tk.END)
 
+    # The drives of this machine's servo axes from ~/tmc/.pathpirate/drives_<machine>.json (see
+    # axislimits.py), None if there is no such file and False if it cannot be used
+    def machineDrives(self):
+        drivesFile = os.path.join(self.tmc, '.pathpirate/drives_{}.json'.format(self.machine.replace(' ', '_')))
+        if not os.path.exists(drivesFile):
+            return None
+        try:
+            return loadDrives(drivesFile)
+        except (IOError, OSError, ValueError) as error:
+            self.console.insert(tk.END, 'The axis drives could not be read: {}\n'.format(error), 'red')
+            self.console.insert(tk.END, '\nAborting...\n', 'red')
+            self.console.see(tk.END)
+            return False
+
+    # Stage a ClearPath INI (an IniFile) as target with the tightest step timings the motors take on
+    # the board of that config, see steptiming.py, and with the axis limits of the drives if there
+    # are any, see axislimits.py. Returns the StepTiming and its axes, and the AxisLimits, its axes
+    # and [TRAJ] limits (None without drives).
+    def writeServoIni(self, target, iniFile, drives=None):
+        stepTiming = StepTiming(self.clearPathModel, iniBoard(target), self.stepTimingMargin)
+        axes = stepTiming.axes(iniFile.values())
+        stepTiming.apply(iniFile, axes)
+        limits = None
+        if drives:
+            axisLimits = AxisLimits(drives, dict((axis['axis'], axis['maxVel']) for axis in axes))
+            values = self.iniValues(iniFile)
+            limitAxes = axisLimits.axes(values)
+            traj = axisLimits.traj(values, limitAxes)
+            axisLimits.apply(iniFile, limitAxes, traj)
+            limits = (axisLimits, limitAxes, traj)
+        self.transaction.write(target, iniFile.data())
+        return stepTiming, axes, limits
+
+    # {section: {key: value}} of an IniFile laid over its base file, like PathPilot reads it
+    def iniValues(self, iniFile):
+        base = iniFile.base()
+        if not base or not os.path.exists(base):
+            return iniFile.values()
+        values = self.iniFiles.values(base)
+        for name, entries in iniFile.values().items():
+            values.setdefault(name, {}).update(entries)
+        return values
+
+    # Explain the step timings and axis limits of this machine's config and keep them as INI overlays
+    # next to the backups, so the limits can be looked up later
+    def showServoLimits(self, stepTiming, axes, limits=None):
+        machine = self.machine.replace(' ', '_')
+        if axes:
+            overlay = os.path.join(self.tmc, '.pathpirate/step_timing_{}.ini'.format(machine))
+            self.transaction.write(overlay, stepTiming.overlay(axes, self.machine))
+            self.console.insert(tk.END, '\nStep timings ({}):\n'.format(overlay))
+            for line in stepTiming.explain(axes):
+                self.console.insert(tk.END, '{}\n'.format(line))
+        if limits and limits[1]:
+            axisLimits, limitAxes, traj = limits
+            overlay = os.path.join(self.tmc, '.pathpirate/axis_limits_{}.ini'.format(machine))
+            self.transaction.write(overlay, axisLimits.overlay(limitAxes, traj, self.machine))
+            self.console.insert(tk.END, '\nAxis limits ({}):\n'.format(overlay))
+            for line in axisLimits.explain(limitAxes, traj):
+                self.console.insert(tk.END, '{}\n'.format(line))
+
+    # The lathe UI patch is skipped once its marker is there, an earlier ADD SERVOS may have left a
+    # feed ceiling for other axis limits
+    def updateLatheCeiling(self, ceiling):
+        if not os.path.exists(self.uiLathe):
+            return
+        with open(self.uiLathe, 'r') as file:
+            match = re.search(r'max_maxvel = ([0-9.]+)#Changed by PathPirate', file.read())
+        if match and match.group(1) != ceiling:
+            edit = [match.group(0), 'max_maxvel = {}#Changed by PathPirate'.format(ceiling)]
+            self.textPatcher.rewrite(self.uiLathe, [edit], self.transaction.stage(self.uiLathe))
+            self.console.insert(tk.END, 'The lathe UI feed ceiling is now {} in: '.format(ceiling))
+            self.console.insert(tk.END, '{}\n'.format(self.uiLathe), 'pink')
+
+    # Parse an installed HAL file with its INI and warn about anything that would stop PathPilot from
+    # starting, e.g. a component that is never added to a thread or a signal with two writers
+    def checkHal(self, halFile, iniFile):
+        if not os.path.exists(halFile) or not os.path.exists(iniFile):
+            return
+        try:
+            graph = loadGraph(halFile, readIni(iniFile, self.iniFiles), os.path.join(self.tmc, '.pathpirate/halgraph'))
+        except Exception as error:
+            self.console.insert(tk.END, 'WARNING: could not check {}: {}\n'.format(halFile, error), 'yellow')
+            return
+        # warnings are still too noisy on an untouched stock config, only errors are shown
+        problems = [problem for problem in graph.problems() if problem[0] == 'error']
+        if not problems:
+            return
+        self.console.insert(tk.END, '\nWARNING: {} problem(s) found in: '.format(len(problems)), 'yellow')
+        self.console.insert(tk.END, '{}\n'.format(halFile), 'pink')
+        for level, kind, message, fileName, number in problems:
+            self.console.insert(tk.END, '    {}:{} {}\n'.format(os.path.basename(fileName), number, message), 'yellow')
+
+    # Every button operation is a restore point in the backup store and a transaction: its file changes
+    # are staged next to their targets and only put in place, all together, by commitOperation
+    def beginOperation(self, label):
+        if self.transaction is not None:
+            raise ValueError('{} can not start, {} has not finished'.format(label, self.transaction.label))
+        self.backups.beginGeneration(label)
+        self.transaction = Transaction(self.tmc, self.backups, label)
+
+    def commitOperation(self):
+        for path in self.transaction.commit():
+            # new firmware is compared by digest next time, cache it now
+            if os.path.dirname(path) == self.mesaPath:
+                self.digestCache.digest(path)
+        self.transaction = None
+        self.digestCache.save()
+
+    # End an operation that did not commit: staged files and the journal are removed, anything a
+    # failed commit already renamed into place is put back, and its restore point is dropped
+    def abortOperation(self):
+        self.transaction = None
+        rollback(self.tmc, self.backups)
+        self.backups.discardGeneration()
+
+    # Copy the PathPirate firmware to ~/tmc/mesa, skipping files that are already identical. Every
+    # digest is compared with the one shipped in files/firmware/digests.json, also after writing. The
+    # copies are staged in the transaction of the operation.
+    def deployFirmware(self, files):
+        with open(self.firmwareDigests, 'r') as jsonFile:
+            shipped = json.load(jsonFile)
+        written = skipped = copied = current = 0
+        for file in files:
+            expected = shipped[os.path.relpath(file, os.path.dirname(self.firmwareDigests))]
+            if self.digestCache.digest(file) != expected:
+                self.console.insert(tk.END, 'The following firmware does not match its shipped digest and was not copied: ', 'red')
+                self.console.insert(tk.END, '{}\n'.format(file), 'pink')
+                continue
+            target = os.path.join(self.mesaPath, os.path.basename(file))
+            size = os.path.getsize(file)
+            if os.path.exists(target) and self.digestCache.digest(target) == expected:
+                skipped += size
+                current += 1
+                continue
+            tempFile = self.transaction.stage(target)
+            copy(file, tempFile)
+            if fileDigest(tempFile) != expected:
+                os.remove(tempFile)
+                self.console.insert(tk.END, 'Verification failed after copying: ', 'red')
+                self.console.insert(tk.END, '{}\n'.format(target), 'pink')
+                continue
+            written += size
+            copied += 1
+        self.console.insert(tk.END, '\nThe necessary firmwares are in:\n')
+        self.console.insert(tk.END, '{}\n'.format(self.mesaPath), 'pink')
+        self.console.insert(tk.END, '{} copied and verified ({} bytes written), {} already up to date ({} bytes skipped)\n'.format(copied, written, current, skipped))
+
     # Revert any changes PathPirate may have made by restoring backup files/deleting new files
     def revertAll(self, event=None):
         self.console.insert(tk.END, '\n---------------------\nREVERTING ALL CHANGES\n---------------------\n', 'yellow')
@@ -564,13 +861,20 @@ class PathPirate:
         halshowPath = os.path.join(self.sourcePath, 'halshow.tcl')
         cbuttonPath = os.path.join(self.sourcePath, 'cbutton.tcl')
         try:
+            self.manifest.clear()
+            restored, removed = self.backups.restore()
+            for file in restored + removed:
+                if file in [halshowPath, cbuttonPath, self.scriptFile]:
+                    halshow = True
+                elif file not in [self.encoderHal, self.pathPirateMillFirmware, self.pathPirateMill7i92Firmware, self.pathPirateMill7i92tFirmware, self.pathPirateLatheFirmware]:
+                    change = True
+            # backups made by PathPirate versions from before the backup store
             changedFilesList = [self.uiCommon, self.uiLathe, self.consoleHal1, self.consoleHal2, self.velImage, self.currentMillIni, self.currentMillHal, self.cm1100_1, self.cm1100_2, self.cm1100_3, self.cm1100_4, self.cm770_1, self.cm770_2, self.cm770_3, self.cm770_4, self.currentRapidTurnHal, self.currentLatheHal, self.currentLatheIni, self.tooltips, self.plasmaControls, self.latheControls, self.millControls]
             for file in changedFilesList:
                 tempFile = '{}.bak'.format(file)
                 if os.path.exists(tempFile):
                     change = True
-                    copy(tempFile, file)
-                    os.remove(tempFile)
+                    os.rename(tempFile, file)
             for file in [self.encoderHal, self.pathPirateMillFirmware, self.pathPirateMill7i92Firmware, self.pathPirateMill7i92tFirmware, self.pathPirateLatheFirmware]:
                 if os.path.exists(file):
                     os.remove(file)
@@ -581,8 +885,7 @@ class PathPirate:
             tempFile = '{}.bak'.format(self.scriptFile)
             if os.path.exists(tempFile):
                 halshow = True
-                copy(tempFile, self.scriptFile)
-                os.remove(tempFile)
+                os.rename(tempFile, self.scriptFile)
             if os.path.exists(self.sourcePath):
                 halshow = True
                 os.rmdir(self.sourcePath)
@@ -595,6 +898,7 @@ class PathPirate:
                 self.console.insert(tk.END, 'You will be prompted to restart upon exiting PathPirate\n', 'white')
             else:
                 self.console.insert(tk.END, 'There were no configuration changes in {} to revert\n'.format(self.currentVer))
+            self.showModifications()
             self.console.see(tk.END)
         except Exception as e:
             self.console.insert(tk.END, 'The following system error has occured:\n\n{}\n'.format(e), 'red')
@@ -606,6 +910,11 @@ class PathPirate:
         if not os.path.exists(self.tmc):
             self.currentVersionInfo.insert(tk.END, 'ERROR: ~/tmc does not exist, is PathPilot installed?\n', 'red')
             return
+        # an operation interrupted by a crash or power loss is undone before anything else
+        interrupted = rollback(self.tmc, self.backups)
+        if interrupted is not None:
+            label, changed = interrupted
+            self.console.insert(tk.END, '\nWARNING: {} did not finish, {} file(s) were put back the way they were before it\n'.format(label, len(changed)), 'yellow')
         versionFile = os.path.join(self.tmc, 'version.json')
         if not os.path.exists(versionFile):
             self.currentVersionInfo.insert(tk.END, 'ERROR: {} is missing! Unable to proceed!\n'.format(versionFile), 'red')
@@ -613,15 +922,26 @@ class PathPirate:
         with open(versionFile, 'r') as jsonFile:
             versionData = json.load(jsonFile)
         self.currentVer = versionData['version']
+        # versions newer than the last supported one get the stock files patched instead of
+        # replaced, using the templates of the newest supported version
+        self.unknownVersion = False
         if not self.currentVer in self.versionList:
-            self.currentVersionInfo.insert(tk.END, 'ERROR: PathPirate is not compatible with version {}! Unable to proceed!\n'.format(self.currentVer), 'red')
-            self.console.insert(tk.END, '\nThe following versions are currently supported: {}\n'.format(', '.join(self.versionList)), 'yellow')
-            return
-        self.majorVer = int(self.currentVer.split('.')[0].lstrip('v'))
-        self.minorVer = int(self.currentVer.split('.')[1])
-        self.patchVer = int(self.currentVer.split('.')[2].split('-')[0])
+            try:
+                newer = self.versionTuple(self.currentVer) > self.versionTuple(self.versionList[-1])
+            except ValueError:
+                newer = False
+            if not newer:
+                self.currentVersionInfo.insert(tk.END, 'ERROR: PathPirate is not compatible with version {}! Unable to proceed!\n'.format(self.currentVer), 'red')
+                self.console.insert(tk.END, '\nThe following versions are currently supported: {}\n'.format(', '.join(self.versionList)), 'yellow')
+                return
+            self.unknownVersion = True
+        self.majorVer, self.minorVer, self.patchVer = self.versionTuple(self.currentVer)
         self.currentVersionInfo.insert(tk.END, 'Current Version of PathPilot is: {}\n'.format(self.currentVer))
         self.versionFolder = 'v2.9.x' if self.currentVer in ['v2.9.2', 'v2.9.3', 'v2.9.4', 'v2.9.5', 'v2.9.6'] else self.currentVer
+        if self.unknownVersion:
+            self.versionFolder = self.versionList[-1]
+            self.console.insert(tk.END, '\nWARNING: {} is newer than the last tested version ({}).\n'.format(self.currentVer, self.versionList[-1]), 'yellow')
+            self.console.insert(tk.END, 'ADD SERVOS will patch the stock PathPilot files instead of replacing them.\n', 'yellow')
         machineFile = os.path.join(self.home, 'pathpilot.json')
         if not os.path.exists(machineFile):
             self.machineInfo.insert(tk.END, 'ERROR: {} is missing! Unable to proceed!\n'.format(machineFile), 'red')
@@ -636,13 +956,12 @@ class PathPirate:
         # machine options: 1100-3, 770, 15L Slant-PRO
         # currently the 1100-3 and 7700 are supported, 15L Slant-PRO is in development
         if self.machine in ['770', '1100-3']:
-            self.clearPathMillHal = os.path.join(self.pathPirateDir, 'files/configs/{}/pathpirate_cpm_hsh_mill.hal'.format(self.versionFolder))
-            self.clearPathRapidTurnHal = os.path.join(self.pathPirateDir, \
-            'files/configs/{}/pathpirate_cpm_hsh_rapidturn.hal'.format(self.versionFolder, self.machine))
+            self.clearPathMillHal = self.templateStore.getFile(self.versionFolder, 'pathpirate_cpm_hsh_mill.hal')
+            self.clearPathRapidTurnHal = self.templateStore.getFile(self.versionFolder, 'pathpirate_cpm_hsh_rapidturn.hal')
             self.machineInfo.insert(tk.END, 'Machine Model is: {}\n'.format(self.machine))
         elif self.machine == '15L Slant-PRO':
-            self.clearPathLatheHal = os.path.join(self.pathPirateDir, 'files/configs/{}/pathpirate_cpm_hsh_lathe.hal'.format(self.versionFolder))
-            self.clearPathLatheIni = os.path.join(self.pathPirateDir, 'files/configs/{}/pathpirate_cpm_hsh_lathe.ini'.format(self.versionFolder))
+            self.clearPathLatheHal = self.templateStore.getFile(self.versionFolder, 'pathpirate_cpm_hsh_lathe.hal')
+            self.clearPathLatheIni = self.templateStore.getFile(self.versionFolder, 'pathpirate_cpm_hsh_lathe.ini')
             self.addEncoderButton.pack_forget()
             self.machineInfo.insert(tk.END, 'Machine Model is: {}. ADD ENCODER button has been hidden.\n'.format(self.machine))
         else:
@@ -654,6 +973,75 @@ class PathPirate:
         self.addEncoderButton['state'] = 'normal'
         self.addServosButton['state'] = 'normal'
         self.revertAllButton['state'] = 'normal'
+        applied = self.showModifications()
+        if applied:
+            self.console.insert(tk.END, 'Modifications already applied: {}\n'.format(', '.join(applied)))
+
+    # (file, test) pairs that tell if an operation has been applied, the tests only run on files
+    # the manifest has no current entry for
+    def modificationChecks(self):
+        marker = lambda data: b'PathPirate' in data
+        checks = {'halshow': [(self.scriptFile, lambda data: b'halshow.tcl' in data), \
+                              (os.path.join(self.sourcePath, 'halshow.tcl'), lambda data: True)]}
+        if (self.majorVer, self.minorVer) == (2, 9):
+            with open(self.rapidImage, 'rb') as file:
+                rapidData = file.read()
+            checks['rapid'] = [(self.uiCommon, marker), (self.velImage, lambda data: data == rapidData)]
+        else:
+            rapid = lambda data: b'<property name="text">Rapid</property>' in data
+            checks['rapid'] = [(self.uiCommon, marker), (self.plasmaControls, rapid), (self.latheControls, rapid), (self.millControls, rapid)]
+        if self.machine in ['770', '1100-3']:
+            checks['encoder'] = [(self.currentMillIni, lambda data: b'HALFILE = series3_encoder.hal' in data)]
+            checks['servos'] = [(self.currentMillHal, marker), (self.currentRapidTurnHal, marker)]
+        elif self.machine == '15L Slant-PRO':
+            checks['servos'] = [(self.currentLatheHal, marker), (self.currentLatheIni, marker)]
+        return checks
+
+    # Mark the buttons of applied operations and return their names
+    def showModifications(self):
+        applied = []
+        for operation, checks in sorted(self.modificationChecks().items()):
+            button, text = self.operationButtons[operation]
+            if self.manifest.state(operation, checks):
+                button['text'] = '{}\n(APPLIED)'.format(text.replace('\n', ' '))
+                applied.append(text.replace('\n', ' '))
+            else:
+                button['text'] = text
+        return applied
+
+    # 'v2.14.4' -> (2, 14, 4), raises ValueError if the version can not be parsed
+    def versionTuple(self, version):
+        parts = version.split('-')[0].lstrip('v').split('.')
+        if len(parts) != 3:
+            raise ValueError('Unexpected version: {}'.format(version))
+        return tuple(int(part) for part in parts)
+
+    # Builds the ClearPath version of a stock HAL/INI file by patching it rather than copying the
+    # template over it. The stock text comes from the original backup so re-running starts from stock.
+    # Returns the patched text, or None after reporting why it could not be patched.
+    def patchStockFile(self, stockFile, template):
+        source = self.backups.original(stockFile)
+        if source is None:
+            # backup made by a PathPirate version from before the backup store
+            backup = '{}.bak'.format(stockFile)
+            source = backup if os.path.exists(backup) else stockFile
+        with open(source, 'r') as file:
+            stockText = file.read()
+        with open(template, 'r') as file:
+            templateText = file.read()
+        patcher = HalPatcher(os.path.basename(template))
+        try:
+            if template.endswith('.ini'):
+                text = patcher.patchIni(stockText, templateText, self.currentVer)
+            else:
+                text = patcher.patch(stockText, templateText, self.currentVer)
+        except ValueError as e:
+            self.console.insert(tk.END, 'Unable to patch {}: {}\n'.format(stockFile, e), 'red')
+            return None
+        self.console.insert(tk.END, 'Patched ')
+        self.console.insert(tk.END, '{}'.format(stockFile), 'pink')
+        self.console.insert(tk.END, ' ({} edits)\n'.format(len(patcher.report)))
+        return text
 
     # Exits PathPirate and checks if the user would like to reboot automatically
     def exitPathPirate(self, event=None):
@@ -0,0 +1,182 @@
+'''
+pathpiratecli runs the PathPirate operations without the Tk window, on one
+~/tmc tree or on many of them in parallel.
+
+Copyright (C) 2023, 2024, 2025, 2026 Gregory D Carl
+
+This program is free software; you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with this program; if not, write to the Free Software Foundation, Inc.,
+51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+'''
+
+from multiprocessing import Pool
+import sys
+import os
+import json
+import time
+import argparse
+import traceback
+from pathpirate import PathPirate
+
+# Stands in for a tk.Text box, keeps everything inserted along with its tag
+class TextLog:
+
+    def __init__(self, echo=False):
+        self.entries = []
+        self.echo = echo
+
+    def insert(self, index, text, *tags):
+        self.entries.append((text, tags[0] if tags else None))
+        if self.echo:
+            sys.stdout.write(text)
+
+    def see(self, index):
+        if self.echo:
+            sys.stdout.flush()
+
+    def text(self, start=0):
+        return ''.join(text for text, _ in self.entries[start:])
+
+    def errors(self, start=0):
+        return [text.strip() for text, tag in self.entries[start:] if tag == 'red' and text.strip()]
+
+# Stands in for a tk.Button, only the settings PathPirate touches are kept
+class HeadlessButton(dict):
+
+    def __init__(self, text):
+        dict.__init__(self, text=text, state='disabled')
+        self.visible = True
+
+    def pack_forget(self):
+        self.visible = False
+
+class HeadlessPathPirate(PathPirate):
+
+    # operation name on the command line -> method, same order as the buttons
+    operations = [('halshow', 'addHalshow'), ('rapid', 'convertSlider'), ('encoder', 'addEncoder'),
+                  ('servos', 'addServos'), ('revert', 'revertAll')]
+
+    def __init__(self, home, encoderScale=None, echo=False):
+        self.encoderScale = encoderScale
+        self.console = TextLog(echo)
+        self.machineInfo = TextLog(echo)
+        self.currentVersionInfo = TextLog(echo)
+        self.addHalshowButton = HeadlessButton('ADD\nHALSHOW')
+        self.maxVelButton = HeadlessButton('MAX VEL\nTO RAPID')
+        self.addEncoderButton = HeadlessButton('ADD\nENCODER')
+        self.addServosButton = HeadlessButton('ADD\nSERVOS')
+        self.revertAllButton = HeadlessButton('REVERT\nALL')
+        self.operationButtons = {'halshow': (self.addHalshowButton, 'ADD\nHALSHOW'), 'rapid': (self.maxVelButton, 'MAX VEL\nTO RAPID'),
+                                 'encoder': (self.addEncoderButton, 'ADD\nENCODER'), 'servos': (self.addServosButton, 'ADD\nSERVOS')}
+        self.main = None
+        self.setup(home)
+        self.getVersion()
+
+    # getVersion only enables the buttons once the version and machine are known
+    def ready(self):
+        return self.revertAllButton['state'] == 'normal'
+
+    # The encoder scale comes from the command line instead of a dialog
+    def askinteger(self, title, prompt, **kwargs):
+        return self.encoderScale
+
+    # Run the named operations in order and return the report for this machine
+    def run(self, names):
+        report = {'root': self.home, 'version': getattr(self, 'currentVer', None), 'machine': getattr(self, 'machine', None),
+                  'operations': [], 'ok': True}
+        if not self.ready():
+            report['ok'] = False
+            report['errors'] = self.currentVersionInfo.errors() + self.machineInfo.errors()
+            return report
+        methods = dict(self.operations)
+        for name in names:
+            button = self.operationButtons.get(name, (None, None))[0]
+            start = len(self.console.entries)
+            began = time.time()
+            if button is not None and not button.visible:
+                self.console.insert(None, 'Skipping {}, it is not available on a {}\n'.format(name, self.machine), 'red')
+            else:
+                try:
+                    getattr(self, methods[name])()
+                except Exception:
+                    self.console.insert(None, traceback.format_exc(), 'red')
+            errors = self.console.errors(start)
+            report['operations'].append({'name': name, 'ok': not errors, 'errors': errors,
+                                         'seconds': round(time.time() - began, 3), 'log': self.console.text(start)})
+            if errors:
+                report['ok'] = False
+                break
+        report['applied'] = sorted(name for name, (button, text) in self.operationButtons.items() if button['text'] != text)
+        report['restartRequired'] = self.restartRequired
+        return report
+
+# Pool worker, must be a module level function so it can be pickled
+def provision(args):
+    root, names, encoderScale = args
+    try:
+        return HeadlessPathPirate(root, encoderScale).run(names)
+    except Exception:
+        return {'root': root, 'ok': False, 'operations': [], 'errors': [traceback.format_exc()]}
+
+# One report file per machine, named after its root folder
+def writeReports(reports, reportDir):
+    if not os.path.exists(reportDir):
+        os.makedirs(reportDir)
+    used = set()
+    for report in reports:
+        name = os.path.basename(os.path.normpath(report['root'])) or 'root'
+        fileName = name
+        count = 1
+        while fileName in used:
+            count += 1
+            fileName = '{}-{}'.format(name, count)
+        used.add(fileName)
+        with open(os.path.join(reportDir, '{}.json'.format(fileName)), 'w') as jsonFile:
+            json.dump(report, jsonFile, indent=4, sort_keys=True)
+            jsonFile.write('\n')
+
+def main():
+    names = [name for name, _ in HeadlessPathPirate.operations]
+    parser = argparse.ArgumentParser(description='Run PathPirate without its window. Each root is a home folder '
+                                     'holding tmc/ and pathpilot.json, e.g. a captured copy of a machine.')
+    parser.add_argument('roots', nargs='+', help='home folder(s) to configure')
+    parser.add_argument('-o', '--operation', action='append', choices=names, required=True,
+                        help='operation to run, repeat to run several in order')
+    parser.add_argument('--scale', type=int, help='encoder scale, required by the encoder operation')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='parallel processes for several roots (default: one per CPU)')
+    parser.add_argument('--report-dir', help='write a JSON report per machine to this folder')
+    args = parser.parse_args()
+    if 'encoder' in args.operation and args.scale is None:
+        parser.error('the encoder operation needs --scale')
+    roots = [os.path.abspath(root) for root in args.roots]
+    if len(roots) == 1:
+        reports = [HeadlessPathPirate(roots[0], args.scale, echo=True).run(args.operation)]
+    else:
+        pool = Pool(args.jobs)
+        try:
+            reports = pool.map(provision, [(root, args.operation, args.scale) for root in roots])
+        finally:
+            pool.close()
+            pool.join()
+    for report in reports:
+        done = ', '.join(operation['name'] for operation in report['operations'] if operation['ok'])
+        print('{:40} {:8} {:14} {}{}'.format(report['root'], report.get('version') or '?', report.get('machine') or '?',
+                                           'OK' if report['ok'] else 'FAILED', ' ({})'.format(done) if done else ''))
+        for error in report.get('errors', []) + [error for operation in report['operations'] for error in operation['errors']]:
+            print('    {}'.format(error.splitlines()[-1] if error else error))
+    if args.report_dir:
+        writeReports(reports, args.report_dir)
+    return 0 if all(report['ok'] for report in reports) else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,228 @@
+'''
+pidtune fits the feed-forward gains of the pid loop around a ClearPath
+stepgen from a capture of its following error during a test move.
+
+Copyright (C) 2023, 2024, 2025, 2026 Gregory D Carl
+
+This program is free software; you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with this program; if not, write to the Free Software Foundation, Inc.,
+51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+'''
+
+import sys
+import os
+import math
+from inimodel import IniFile, IniCache
+from halcapture import HalCapture, loadCapture
+
+axisLetters = 'XYZABCUVW'
+
+# pid pins recorded for an axis, in this order
+capturePins = ['command', 'command-deriv', 'feedback', 'error', 'output']
+
+gainKeys = ['FF1', 'FF2']
+
+# G-code that moves one axis back and forth at each feed (units/min) and at rapid, relative to where
+# it starts. Each move is long enough to reach the feed, so the capture has both steady velocity
+# and acceleration in it.
+def testProgram(letter, distance, feeds, repeats=2):
+    lines = ['(PathPirate feed-forward test move for the {} axis)'.format(letter),
+             '(moves {:g} each way from where the axis is, start it with room on both sides)'.format(distance),
+             'G91 G94']
+    moves = [('G1', 'F{:g}'.format(feed)) for feed in feeds] + [('G0', '')]
+    for code, feed in moves:
+        for repeat in range(repeats):
+            lines.append('{} {}{:g} {}'.format(code, letter, distance, feed).rstrip())
+            lines.append('{} {}{:g} {}'.format(code, letter, -distance, feed).rstrip())
+        lines.append('G4 P0.5')
+    lines.extend(['G90', 'M30'])
+    return '\n'.join(lines) + '\n'
+
+# Least squares x of rows * x = targets, None if the columns do not tell the unknowns apart
+def leastSquares(rows, targets):
+    size = len(rows[0])
+    matrix = [[sum(row[i] * row[j] for row in rows) for j in range(size)] + [sum(row[i] * target for row, target in zip(rows, targets))]
+              for i in range(size)]
+    for column in range(size):
+        pivot = max(range(column, size), key=lambda row: abs(matrix[row][column]))
+        if abs(matrix[pivot][column]) < 1e-12 * max(1.0, max(abs(matrix[row][row]) for row in range(size))):
+            return None
+        matrix[column], matrix[pivot] = matrix[pivot], matrix[column]
+        for row in range(size):
+            if row != column:
+                factor = matrix[row][column] / matrix[column][column]
+                matrix[row] = [value - factor * pivotValue for value, pivotValue in zip(matrix[row], matrix[column])]
+    return [matrix[row][size] / matrix[row][row] for row in range(size)]
+
+def rms(values):
+    return math.sqrt(sum(value * value for value in values) / len(values)) if values else 0.0
+
+# The stepgen moves the feedback by the pid output (a velocity) a few periods after the pid wrote
+# it. That delay is found in the capture, then the output that would have moved the feedback
+# exactly onto the position the pid compares it to is fitted as FF1 * velocity + FF2 * acceleration
+# of the command, the way the pid component works them out. The P loop is only left with what that
+# fit can not follow. The capture is replayed through the same delay with the current and the new
+# gains to show what changes; I and D are 0 in the ClearPath configs and are left out of the replay.
+class FeedForwardFit:
+
+    maxDelay = 5
+
+    # samples as HalCapture records capturePins, period in seconds, gains {'P', 'FF1', 'FF2'}
+    def __init__(self, samples, period, gains):
+        self.period = period
+        self.gains = gains
+        self.count = len(samples)
+        columns = list(zip(*[values for _, values in samples])) or [()] * len(capturePins)
+        _, self.velocity, self.feedback, self.error, self.output = [list(column) for column in columns]
+        # with error-previous-target the pid compares the feedback to last period's command
+        self.reference = [error + feedback for error, feedback in zip(self.error, self.feedback)]
+        self.acceleration = [0.0] + [(current - previous) / period for previous, current in zip(self.velocity, self.velocity[1:])]
+        self.lag = None
+        self.gainsFit = None
+
+    # Periods between the pid output and the feedback moving by it
+    def delay(self):
+        feedbackVelocity = [(after - before) / self.period for before, after in zip(self.feedback, self.feedback[1:])]
+        def mismatch(delay):
+            pairs = list(zip(self.output, feedbackVelocity[delay:]))
+            return sum((output - velocity) ** 2 for output, velocity in pairs) / max(len(pairs), 1)
+        return min(range(self.maxDelay + 1), key=mismatch)
+
+    def fit(self):
+        if not any(self.velocity):
+            raise ValueError('the capture has no motion, run the test move while capturing')
+        self.lag = self.delay()
+        rows = []
+        targets = []
+        for index in range(1, self.count - self.lag - 1):
+            rows.append([self.velocity[index], self.acceleration[index]])
+            targets.append((self.reference[index + self.lag + 1] - self.reference[index + self.lag]) / self.period)
+        terms = leastSquares(rows, targets) if rows else None
+        if terms is None:
+            raise ValueError('the capture has no acceleration to fit FF2 to, run the test move while capturing')
+        self.gainsFit = {'FF1': terms[0], 'FF2': terms[1]}
+        return self.gainsFit
+
+    # Following error of the capture replayed with other gains, the output reaches the feedback
+    # after the delay that was found
+    def replay(self, gains):
+        feedback = self.feedback[0] if self.count else 0.0
+        outputs = []
+        errors = []
+        for index in range(self.count):
+            error = self.reference[index] - feedback
+            errors.append(error)
+            outputs.append(gains.get('P', 0.0) * error + gains.get('FF1', 0.0) * self.velocity[index] +
+                           gains.get('FF2', 0.0) * self.acceleration[index])
+            source = index - self.lag
+            feedback += (outputs[source] if source >= 0 else self.output[0]) * self.period
+        return errors
+
+    # Following error while the command moves
+    def moving(self, errors):
+        return [error for error, velocity in zip(errors, self.velocity) if velocity]
+
+    def newGains(self):
+        gains = dict(self.gains)
+        gains.update(self.gainsFit)
+        return gains
+
+    # Lines that explain the fit
+    def explain(self, section):
+        measured = self.moving(self.error)
+        before = self.moving(self.replay(self.gains))
+        after = self.moving(self.replay(self.newGains()))
+        lines = ['{}: {} samples ({:.1f} s at {:g} ms), the feedback follows the pid output {} period(s) later'.format(
+                    section, self.count, self.count * self.period, self.period * 1000, self.lag),
+                 '    FF1 {:g} -> {:.6g}, FF2 {:g} -> {:.6g}'.format(self.gains.get('FF1', 0.0), self.gainsFit['FF1'],
+                                                                    self.gains.get('FF2', 0.0), self.gainsFit['FF2'])]
+        for name, errors in [('measured', measured), ('replayed with the current gains', before), ('replayed with the new gains', after)]:
+            lines.append('    following error {}: {:.6f} rms, {:.6f} max'.format(name, rms(errors), max([abs(error) for error in errors] or [0.0])))
+        return lines
+
+    # INI text with the new gains, laid over the INI by --apply
+    def overlay(self, section, name):
+        lines = ['# Feed-forward gains for {} written by PathPirate'.format(name)]
+        lines.extend('# {}'.format(line) for line in self.explain(section))
+        lines.extend(['', '[{}]'.format(section)])
+        lines.extend('{} = {:.6g}'.format(key, self.gainsFit[key]) for key in gainKeys)
+        return '\n'.join(lines) + '\n'
+
+def floatOrZero(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+if __name__ == '__main__':
+    import argparse
+    from halsession import HalSession
+    parser = argparse.ArgumentParser(description='Record the following error of one axis during a test move and fit the '
+                                     'FF1 and FF2 gains that minimize it.')
+    parser.add_argument('ini', help='INI of the machine (a *_specific.ini is merged over its base INI)')
+    parser.add_argument('--axis', type=int, default=0, help='joint number, recorded from pid.N and set in [AXIS_N] (default: 0)')
+    parser.add_argument('--seconds', type=float, default=30, help='how long to record (default: 30)')
+    parser.add_argument('--program', help='write the test move G-code to this file and exit')
+    parser.add_argument('--distance', type=float, default=2.0, help='length of each test move (default: 2.0)')
+    parser.add_argument('--feed', type=float, action='append', help='feed of the test moves, can be repeated (default: 30, 100, 200)')
+    parser.add_argument('--save', help='write the capture to this CSV file')
+    parser.add_argument('--input', help='fit a capture saved with --save instead of recording one')
+    parser.add_argument('--halcmd', default=os.path.expanduser('~/tmc/bin/halcmd'), help='halcmd (halsampler is expected next to it)')
+    parser.add_argument('-o', '--overlay', help='write the gains as an INI overlay to this file')
+    parser.add_argument('--apply', action='store_true', help='write the gains into the INI itself')
+    args = parser.parse_args()
+    section = 'AXIS_{}'.format(args.axis)
+    if args.program:
+        with open(args.program, 'w') as file:
+            file.write(testProgram(axisLetters[args.axis], args.distance, args.feed or [30, 100, 200]))
+        print('Run {} in PathPilot while pidtune.py records'.format(args.program))
+        sys.exit(0)
+    values = IniCache().values(args.ini)
+    period = floatOrZero(values.get('EMCMOT', {}).get('SERVO_PERIOD')) / 1e9 or 0.001
+    gains = dict((key, floatOrZero(values.get(section, {}).get(key))) for key in ['P'] + gainKeys)
+    pins = ['pid.{}.{}'.format(args.axis, name) for name in capturePins]
+    if args.input:
+        capturedPins, samples = loadCapture(args.input)
+        if capturedPins != pins:
+            sys.exit('{} holds {}, not {}'.format(args.input, ', '.join(capturedPins), ', '.join(pins)))
+    else:
+        session = HalSession(args.halcmd)
+        capture = HalCapture(session, pins, maxSamples=int(args.seconds / period) + 1)
+        try:
+            capture.start()
+            print('Recording {} for {:g} s, run the test move now'.format(', '.join(pins), args.seconds))
+            capture.record(args.seconds)
+        except ValueError as error:
+            sys.exit(str(error))
+        finally:
+            capture.stop()
+            session.close()
+        if capture.dropped:
+            print('WARNING: {} samples were dropped, the fit uses what was recorded'.format(capture.dropped))
+        samples = list(capture.samples)
+        if args.save:
+            capture.save(args.save)
+    feedForward = FeedForwardFit(samples, period, gains)
+    try:
+        feedForward.fit()
+    except ValueError as error:
+        sys.exit(str(error))
+    print('\n'.join(feedForward.explain(section)))
+    if args.overlay:
+        with open(args.overlay, 'w') as file:
+            file.write(feedForward.overlay(section, os.path.basename(args.ini)))
+    if args.apply:
+        iniFile = IniFile.read(args.ini)
+        for key in gainKeys:
+            iniFile.set(section, key, '{:.6g}'.format(feedForward.gainsFit[key]))
+        iniFile.write(args.ini)
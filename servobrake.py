@@ -26,10 +26,11 @@ if sys.version_info[0] > 2:
 else:
     import Tkinter as tk
     import tkMessageBox
-from subprocess import Popen, PIPE
 import os
 import json
 import time
+from halsession import HalSession
+from halcapture import HalCapture
 
 class ServoBrake:
 
@@ -72,6 +73,9 @@ class ServoBrake:
         self.engage_brake_button['state'] = 'disabled'
         self.exit_button = tk.Button(self.button_frame, text='EXIT', command=self.exit_servo_brake, height=2, padx=5)
         self.exit_button.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        self.record_timeline = tk.IntVar(value=0)
+        self.record_timeline_button = tk.Checkbutton(self.button_frame, text='RECORD\nTIMELINE', variable=self.record_timeline, height=2, padx=5)
+        self.record_timeline_button.pack(side=tk.LEFT, fill=tk.X, expand=True)
 
         # set up output text boxes
         self.machine_info = tk.Text(self.version_frame, padx=5, height=1, bg='black', fg='yellow', highlightthickness=0, bd=0)
@@ -125,6 +129,21 @@ class ServoBrake:
         self.lathe_hal = os.path.join(self.tmc, 'configs/tormach_lathe/tormach_lathe_mesa.hal')
 
         self.board = ''
+        self.watch_job = None
+        self.watch_label = 'Ensuring servo brake output is off.'
+        # without the hal module or the halcmd pipe every brake output sample starts a halcmd
+        self.watch_slow_ms = 50
+        # width of the status lines before their OK/FAILED
+        self.status_width = 65
+        self.timeline = None
+        self.timeline_job = None
+        self.timeline_event = None
+        self.timeline_count = 0
+        self.timeline_folder = os.path.join(self.tmc, '.pathpirate/servobrake', time.strftime('%Y%m%d-%H%M%S'))
+        # how long a timeline keeps recording after the last command of a release or engage
+        self.timeline_settle = 1.0
+        self.board_list = ['5i25', '7i92', '7i92T', 'EMC1']
+        self.hal = None
 
         # get current version and machine info
         self.get_version()
@@ -144,7 +163,7 @@ class ServoBrake:
     def release_brake(self):
         self.console.insert(tk.END, '\nRELEASE BRAKE CLICKED', 'orange')
         self.console.insert(tk.END, '\nChecking E-STOP status...........................................', 'yellow')
-        out, err = self.send_commands(self.halcmd, 'gets', self.estop_signal)
+        out, err = self.send_commands('gets', self.estop_signal)
         if out.strip() != 'FALSE':
             self.console.insert(tk.END, 'FAILED\n', 'red')
             tkMessageBox.showinfo('ERROR', 'PathPilot has been RESET.\n\nPathPilot must be in E-STOP state (RESET blinking).')
@@ -154,7 +173,7 @@ class ServoBrake:
         self.console.insert(tk.END, 'OK\n', 'green')
 
         self.console.insert(tk.END, 'Checking machine status..........................................', 'yellow')
-        out, err = self.send_commands(self.halcmd, 'getp', 'tormach.machine-ok')
+        out, err = self.send_commands('getp', 'tormach.machine-ok')
         if out.strip() != 'TRUE':
             self.console.insert(tk.END, 'FAILED\n', 'red')
             tkMessageBox.showinfo('ERROR', 'Machine must be powered ON.\n\nFollow these steps:\n1. Reset physical E-STOP.\n2. Press green button.\n3. Do not click RESET in PathPirate.\n4. Press OK to try again.')
@@ -163,21 +182,44 @@ class ServoBrake:
             return
         self.console.insert(tk.END, 'OK\n', 'green')
 
-        timeout = 5
-        interval = 0.5
-        elapsed = 0
-        self.console.update_idletasks()
-        self.console.insert(tk.END, 'Ensuring servo brake output is off.', 'yellow')
-        while elapsed < timeout:
-            out, err = self.send_commands(self.halcmd, 'getp', 'hm2_{}.0.gpio.{}.out'.format(self.board, self.gpio))
-            if out.strip() == 'FALSE':
-                self.console.insert(tk.END, '.............................OK\n', 'green')
-                break
-            time.sleep(interval)
-            elapsed += interval
-            self.console.insert(tk.END, '...', 'yellow')
-            self.console.update_idletasks()
-        else:
+        self.console.insert(tk.END, self.watch_label, 'yellow')
+        self.console.see(tk.END)
+        self.start_brake_watch()
+
+    # Watch the servo brake output from the Tk event loop so the window stays responsive.
+    # Each tick samples the pin once through the in-process hal module or the halcmd pipe and hands
+    # control back to Tk. Without either a halcmd would be started per sample, so then the pin is
+    # only sampled every watch_slow_ms.
+    def start_brake_watch(self):
+        self.watch_timeout = 5
+        self.watch_start = time.time()
+        self.watch_dots = 0
+        self.watch_samples = 0
+        self.release_brake_button.config(text='CANCEL\nRELEASE', command=self.cancel_brake_watch)
+        self.exit_button['state'] = 'disabled'
+        self.watch_job = self.main.after(0, self.watch_brake_output)
+
+    def watch_brake_output(self):
+        self.watch_job = None
+        pin = 'hm2_{}.0.gpio.{}.out'.format(self.board, self.gpio)
+        interval = 1
+        result = self.hal.poll_command('getp', pin)
+        if result is None:
+            interval = self.watch_slow_ms
+            result = self.send_commands('getp', pin)
+        out, err = result
+        self.watch_samples += 1
+        elapsed = time.time() - self.watch_start
+        # the progress dots so far and the padding make the line as wide as the other status lines
+        printed = len(self.watch_label) + 3 * self.watch_dots
+        if out.strip() == 'FALSE':
+            self.stop_brake_watch()
+            self.console.insert(tk.END, '{:.>{}}\n'.format('OK', max(self.status_width - printed, 0) + 2), 'green')
+            self.console.insert(tk.END, 'Servo brake output was off after {:.1f} ms ({} samples)\n'.format(elapsed * 1000, self.watch_samples), 'white')
+            self.finish_release_brake()
+            return
+        if elapsed >= self.watch_timeout:
+            self.stop_brake_watch()
             self.console.insert(tk.END, 'FAILED\n', 'red')
             self.console.update_idletasks()
             tkMessageBox.showinfo('ERROR', 'Servo brake output pin did turn off within 5 seconds. Unable to proceed.\nPress E-STOP and wait a full 10 seconds before powering the machine on.\nThen restart this program to try again.\n')
@@ -185,39 +227,68 @@ class ServoBrake:
             self.console.insert(tk.END, 'Press E-STOP and wait a full 10 seconds before powering the machine on.\n', 'red')
             self.console.insert(tk.END, 'Then restart this program to try again.\n', 'red')
             self.console.see(tk.END)
-            self.console.update_idletasks()
             return
+        # keep the progress dots at the old rate of one set every half second
+        if int(elapsed / 0.5) > self.watch_dots and printed + 3 <= self.status_width:
+            self.watch_dots += 1
+            self.console.insert(tk.END, '...', 'yellow')
+            self.console.see(tk.END)
+        self.watch_job = self.main.after(interval, self.watch_brake_output)
 
+    # Cancel a running brake output watch, the brake is left untouched
+    def cancel_brake_watch(self):
+        self.stop_brake_watch()
+        self.console.insert(tk.END, 'CANCELLED\n', 'red')
+        self.console.insert(tk.END, 'Servo brake release was cancelled by the user.\n', 'cyan')
+        self.console.see(tk.END)
+
+    def stop_brake_watch(self):
+        if self.watch_job is not None:
+            self.main.after_cancel(self.watch_job)
+            self.watch_job = None
+        self.release_brake_button.config(text='RELEASE\nBRAKE', command=self.release_brake)
+        self.exit_button['state'] = 'normal'
 
+    # Remainder of the release once the servo brake output is known to be off, the outputs are
+    # worked once the timeline has recorded a little of the time before them
+    def finish_release_brake(self):
+        self.release_brake_button['state'] = 'disabled'
+        self.exit_button['state'] = 'disabled'
+        self.start_timeline('release', self.release_outputs)
 
+    def release_outputs(self):
         if self.board != 'EMC1':
             self.console.insert(tk.END, 'Unlinking machine board servo relay control pin..................', 'yellow')
-            out, err = self.send_commands(self.halcmd, 'unlinkp', 'hm2_{}.0.pwmgen.00.enable'.format(self.board))
+            out, err = self.unlink_output('hm2_{}.0.pwmgen.00.enable'.format(self.board))
             if err.strip() != '':
                 self.release_brake_button['state'] = 'disabled'
+                self.exit_button['state'] = 'normal'
                 self.console.insert(tk.END, '\n{}\n'.format(err), 'red')
                 self.console.insert(tk.END, 'FAILED\n', 'red')
                 self.console.insert(tk.END, 'Machine board servo relay control pin not found, unable to proceed.\n', 'cyan')
                 self.console.see(tk.END)
+                self.finish_timeline()
                 return
             self.console.insert(tk.END, 'OK\n', 'green')
             self.console.insert(tk.END, "Energzing machine board's servo brake relay to close contacts....", 'yellow')
-            out, err = self.send_commands(self.halcmd, 'setp', 'hm2_{}.0.pwmgen.00.enable'.format(self.board), 'true')
+            out, err = self.set_output('hm2_{}.0.pwmgen.00.enable'.format(self.board), 'true')
             self.console.insert(tk.END, 'OK\n', 'green')
 
         self.console.insert(tk.END, 'Unlinking PathPirate servo brake coil relay pin..................', 'yellow')
-        out, err = self.send_commands(self.halcmd, 'unlinkp', 'hm2_{}.0.gpio.{}.out'.format(self.board, self.gpio))
+        out, err = self.unlink_output('hm2_{}.0.gpio.{}.out'.format(self.board, self.gpio))
         if err.strip() != '':
             self.release_brake_button['state'] = 'disabled'
+            self.exit_button['state'] = 'normal'
             self.console.insert(tk.END, 'FAILED\n', 'red')
             self.console.insert(tk.END, '\n{}\n'.format(err), 'red')
             self.console.insert(tk.END, 'PathPirate servo brake coil relay pin not found, unable to proceed.\n', 'cyan')
             self.console.see(tk.END)
+            self.finish_timeline()
             return
         self.console.insert(tk.END, 'OK\n', 'green')
 
         self.console.insert(tk.END, '\nENERGIZING THE SERVO BRAKE COIL TO RELEASE THE BRAKE.............', 'orange')
-        out, err = self.send_commands(self.halcmd, 'setp', 'hm2_{}.0.gpio.{}.out'.format(self.board, self.gpio), 'true')
+        out, err = self.set_output('hm2_{}.0.gpio.{}.out'.format(self.board, self.gpio), 'true')
 
         self.console.insert(tk.END, 'OK\n', 'green')
         self.console.insert(tk.END, '\nBRAKE SUCCESSFULLY RELEASED\n', 'bold_green')
@@ -226,14 +297,15 @@ class ServoBrake:
         self.release_brake_button['state'] = 'disabled'
         self.exit_button['state'] = 'disabled'
         self.engage_brake_button['state'] = 'normal'
-        self.console.see(tk.END)
+        self.show_hal_latency()
+        self.finish_timeline()
 
     # Engage the servo brake (de-energize the coil)
     # Brake is gpio.023 on EMCV1.5 machines
     def engage_brake(self):
         self.console.insert(tk.END, '\nENGAGE BRAKE CLICKED', 'orange')
         self.console.insert(tk.END, '\nChecking E-STOP status...........................................', 'yellow')
-        out, err = self.send_commands(self.halcmd, 'gets', self.estop_signal)
+        out, err = self.send_commands('gets', self.estop_signal)
         if out.strip() != 'FALSE':
             self.console.insert(tk.END, 'FAILED\n', 'red')
             tkMessageBox.showinfo('ERROR', 'PathPilot has been RESET.\n\nPathPilot must be in E-STOP state (RESET blinking).')
@@ -243,7 +315,7 @@ class ServoBrake:
         self.console.insert(tk.END, 'OK\n', 'green')
 
         self.console.insert(tk.END, 'Checking machine status..........................................', 'yellow')
-        out, err = self.send_commands(self.halcmd, 'getp', 'tormach.machine-ok')
+        out, err = self.send_commands('getp', 'tormach.machine-ok')
         if out.strip() != 'TRUE':
             tkMessageBox.showinfo('ERROR', 'Machine must be powered ON.\n\nFollow these steps:\n1. Reset physical E-STOP.\n2. Press green button.\n3. Do not click RESET in PathPirate.\n4. Press OK to try again.')
             self.console.insert(tk.END, 'Machine must be powered ON, unable to proceed.\n', 'cyan')
@@ -251,51 +323,59 @@ class ServoBrake:
             return
         self.console.insert(tk.END, 'OK\n', 'green')
 
-        self.exit_button['state'] = 'normal'
         self.engage_brake_button['state'] = 'disabled'
+        self.start_timeline('engage', self.engage_outputs)
+
+    def engage_outputs(self):
+        self.exit_button['state'] = 'normal'
         self.console.insert(tk.END, '\nDE-ENERGIZING THE COIL TO ENGAGE THE BRAKE.........................', 'orange')
-        out, err = self.send_commands(self.halcmd, 'setp', 'hm2_{}.0.gpio.{}.out'.format(self.board, self.gpio), 'false')
+        out, err = self.set_output('hm2_{}.0.gpio.{}.out'.format(self.board, self.gpio), 'false')
         if err.strip() != '':
             self.console.insert(tk.END, 'FAILED\n', 'red')
             self.console.insert(tk.END, '\n{}\n'.format(err), 'red')
             self.console.insert(tk.END, 'PathPirate servo brake coil relay pin not found, unable to proceed.\n', 'cyan')
             self.console.see(tk.END)
+            self.finish_timeline()
             return
         self.console.insert(tk.END, 'OK\n', 'green')
         self.console.insert(tk.END, '\n\nBRAKE SUCCESSFULLY APPLIED\n\n', 'bold_green')
 
         self.console.insert(tk.END, 'Linking PathPirate servo brake coil relay pin....................', 'yellow')
-        out, err = self.send_commands(self.halcmd, 'linkps', 'hm2_{}.0.gpio.{}.out'.format(self.board, self.gpio), '{}-axis-brake-release'.format(self.brake_axis))
+        out, err = self.link_output('hm2_{}.0.gpio.{}.out'.format(self.board, self.gpio), '{}-axis-brake-release'.format(self.brake_axis))
         if err.strip() != '':
             self.console.insert(tk.END, 'FAILED\n', 'red')
             self.console.insert(tk.END, '\n{}\n'.format(err), 'red')
             self.console.insert(tk.END, 'Link unsuccessful, unable to proceed.\n', 'cyan')
             self.console.see(tk.END)
+            self.finish_timeline()
             return
         self.console.insert(tk.END, 'OK\n', 'green')
 
         if self.board != 'EMC1':
             self.console.insert(tk.END, "De-energzing machine board's servo brake relay to close contacts...", 'yellow')
-            out, err = self.send_commands(self.halcmd, 'setp', 'hm2_{}.0.pwmgen.00.enable'.format(self.board), 'false')
+            out, err = self.set_output('hm2_{}.0.pwmgen.00.enable'.format(self.board), 'false')
             if err.strip() != '':
                 self.console.insert(tk.END, 'FAILED\n', 'red')
                 self.console.insert(tk.END, '\n{}\n'.format(err), 'red')
                 self.console.insert(tk.END, 'Pin not found, unable to proceed.\n', 'cyan')
                 self.console.see(tk.END)
+                self.finish_timeline()
                 return
             self.console.insert(tk.END, 'OK\n', 'green')
             self.console.insert(tk.END, 'Linking machine board servo relay control pin....................', 'yellow')
-            out, err = self.send_commands(self.halcmd, 'linkps', 'hm2_{}.0.pwmgen.00.enable'.format(self.board), self.estop_signal)
+            out, err = self.link_output('hm2_{}.0.pwmgen.00.enable'.format(self.board), self.estop_signal)
             if err.strip() != '':
                 self.console.insert(tk.END, 'FAILED\n', 'red')
                 self.console.insert(tk.END, '\n{}\n'.format(err), 'red')
                 self.console.insert(tk.END, 'Link unsuccessful, unable to proceed.\n', 'cyan')
                 self.console.see(tk.END)
+                self.finish_timeline()
                 return
             self.console.insert(tk.END, 'OK\n', 'green')
 
         self.release_brake_button['state'] = 'normal'
-        self.console.see(tk.END)
+        self.show_hal_latency()
+        self.finish_timeline()
 
     # Get the latest version number and machine model
     def get_version(self):
@@ -309,6 +389,7 @@ class ServoBrake:
         if not os.path.exists(self.halcmd):
             self.current_version_info.insert(tk.END, 'ERROR: ~/tmc/bin/halcmd does not exist, is PathPilot installed?\n', 'red')
             return
+        self.hal = HalSession(self.halcmd)
         if not os.path.exists(self.version_file):
             self.current_version_info.insert(tk.END, 'ERROR: {} is missing! Unable to proceed!\n'.format(self.version_file), 'red')
             return
@@ -327,10 +408,6 @@ class ServoBrake:
             return
         self.major_ver = int(self.current_ver.split('.')[0].lstrip('v'))
         self.minor_ver = int(self.current_ver.split('.')[1])
-        if (self.major_ver, self.minor_ver) > (2, 10):
-            self.estop_signal = 'not-estop-signal'
-        else:
-            self.estop_signal = 'estop'
         self.current_version_info.insert(tk.END, 'Current Version of PathPilot is: {}\n'.format(self.current_ver))
         with open(self.machine_file, 'r') as json_file:
             machine_data = json.load(json_file)
@@ -371,37 +448,47 @@ class ServoBrake:
             return
         #keeps the upcoming dialogs on top
         self.main.lower()
-        out, err = self.send_commands(self.halcmd, 'gets', self.estop_signal)
-        if err.strip() != '':
+        # one dump of the HAL pin table answers all of the startup questions
+        snapshot = self.hal.snapshot()
+        if not snapshot.is_running():
             tkMessageBox.showinfo('ERROR', 'PathPilot is not running.\n\nRestart this program after starting PathPilot.')
             return
-        if out.strip() == 'TRUE':
+        # the E-STOP signal is the one that enables motion control, whatever this version names it
+        self.estop_signal = snapshot.linked_signal('iocontrol.0.emc-enable-in')
+        if self.estop_signal is None:
+            self.console.insert(tk.END, '\nERROR: No E-STOP signal is linked to iocontrol.0.emc-enable-in! Unable to proceed!\n', 'red')
+            tkMessageBox.showinfo('ERROR', 'The E-STOP signal could not be found.\n\nNo signal is linked to iocontrol.0.emc-enable-in. Unable to proceed.')
+            return
+        if snapshot.signal_value(self.estop_signal) == 'TRUE':
             try_again = tkMessageBox.askokcancel('ERROR', 'PathPilot must be in E-STOP state (RESET blinking).\n\nE-STOP the machine and press OK to try again.')
             if not try_again:
                 return
-            out, err = self.send_commands(self.halcmd, 'gets', self.estop_signal)
+            out, err = self.send_commands('gets', self.estop_signal)
             if out.strip() != 'FALSE':
                 try_again = tkMessageBox.showinfo('ERROR', 'PathPilot must be in E-STOP state (RESET blinking).\n\nE-STOP the machine and restart this program to try again.')
                 return
-        out, err = self.send_commands(self.halcmd, 'getp', 'tormach.machine-ok')
-        if out.strip() != 'TRUE':
+        if snapshot.pin_value('tormach.machine-ok') != 'TRUE':
             try_again = tkMessageBox.askokcancel('ERROR', 'Machine must be powered ON.\n\nFollow these steps:\n1. Reset physical E-STOP.\n2. Press green button.\n3. Do not click RESET in PathPirate.\n4. Press OK to try again.')
             if not try_again:
                 return
-            out, err = self.send_commands(self.halcmd, 'getp', 'tormach.machine-ok')
+            out, err = self.send_commands('getp', 'tormach.machine-ok')
             if out.strip() != 'TRUE':
                 try_again = tkMessageBox.showinfo('ERROR', 'Machine must be powered ON.\n\nFollow these steps:\n1. Reset physical E-STOP.\n2. Press green button.\n3. Do not click RESET in PathPirate.\n4. Restart this program to try again.')
                 return
         # check for board type
-        for board in ['5i25', '7i92', '7i92T', 'EMC1']:
-            out, err = self.send_commands(self.halcmd, 'getp', 'hm2_{}.0.gpio.001.out'.format(board))
-            if out.strip() != '':
-                self.board = board
-                self.board_info.insert(tk.END, 'Machine Board is: {}'.format(self.board))
-                break
+        self.board = snapshot.board(self.board_list)
         if self.board == '':
             self.board_info.insert(tk.END, 'ERROR: Unable to determine machine board type! Unable to proceed!', 'red')
             return
+        self.board_info.insert(tk.END, 'Machine Board is: {}'.format(self.board))
+        if not snapshot.has_pin('hm2_{}.0.gpio.{}.out'.format(self.board, self.gpio)):
+            self.board_info.insert(tk.END, '\nERROR: Servo brake pin hm2_{}.0.gpio.{}.out not found! Unable to proceed!'.format(self.board, self.gpio), 'red')
+            return
+        if self.board != 'EMC1':
+            pwmgen_signal = snapshot.linked_signal('hm2_{}.0.pwmgen.00.enable'.format(self.board))
+            if pwmgen_signal != self.estop_signal:
+                self.console.insert(tk.END, '\nWARNING: hm2_{}.0.pwmgen.00.enable is linked to {} instead of {}, the servo relay may have been left energized.\n'.format(self.board, pwmgen_signal, self.estop_signal), 'red')
+        self.console.insert(tk.END, '\nHAL discovery found {} pins in {} components\n'.format(len(snapshot.pins), len(snapshot.components)), 'white')
         warning_message = '''
 MANUALLY CONTROLLING THE SERVO BRAKE CAN BE EXTREMELY DANGEROUS!
 
@@ -426,16 +513,164 @@ BY CLICKING "OK" YOU AGREE.'''
         self.console.insert(tk.END, warning_message, 'bold')
         self.console.insert(tk.END, '\n\nUSER AGREED\n', 'bold_green')
 
+    # All HAL access goes through one persistent session rather than a new halcmd process per query
     def send_commands(self, *args):
-        state = Popen(args, stdout=PIPE, stderr=PIPE)
-        out, err = state.communicate()
-        return out, err
+        return self.hal.command(*args)
+
+    # Pins of a brake timeline as [(label, pin)]: the brake coil output as commanded and as the board
+    # reads it back, the servo relay, E-STOP, machine ok and the amp fault input of the brake axis
+    def timeline_pins(self, snapshot):
+        pins = [('brake coil', 'hm2_{}.0.gpio.{}.out'.format(self.board, self.gpio)),
+                ('brake coil readback', 'hm2_{}.0.gpio.{}.in'.format(self.board, self.gpio))]
+        if self.board != 'EMC1':
+            pins.append(('servo relay', 'hm2_{}.0.pwmgen.00.enable'.format(self.board)))
+        # any pin on the E-STOP signal other than the servo relay records it
+        estop = [pin for pin in snapshot.signals.get(self.estop_signal, {}).get('pins', []) if pin != pins[-1][1]]
+        if estop:
+            pins.append(('E-STOP', estop[0]))
+        pins.append(('machine ok', 'tormach.machine-ok'))
+        # the amp fault input on the signal of the motor fault of the brake axis, so the axis or joint
+        # number is whatever HAL has and not assumed from the axis letter
+        fault_signal = snapshot.linked_signal('{}-home2hstop.motor-fault'.format(self.brake_axis))
+        faults = [pin for pin in snapshot.signals.get(fault_signal, {}).get('pins', []) if pin.endswith('.amp-fault-in')]
+        if faults:
+            pins.append(('{} fault'.format(self.brake_axis.upper()), faults[0]))
+        return [(label, pin) for label, pin in pins if snapshot.has_pin(pin)]
+
+    # Record the timeline pins every servo period while a release or engage runs. The brake coil
+    # and servo relay pins are set from here, so the capture drives them and records what is set.
+    # then() works the outputs once 100 ms from before them are recorded, Tk keeps running meanwhile.
+    # A capture that can not start is reported and the brake is worked without it.
+    def start_timeline(self, event, then):
+        if not self.record_timeline.get():
+            then()
+            return
+        # the last timeline is still recording its settle time
+        if self.timeline is not None:
+            self.main.after_cancel(self.timeline_job)
+            self.save_timeline()
+        snapshot = self.hal.snapshot()
+        self.timeline_labels = self.timeline_pins(snapshot)
+        pins = [pin for label, pin in self.timeline_labels]
+        # on an engage the coil and relay pins are still unlinked and set from the release
+        driven = [pin for pin in pins if snapshot.linked_signal(pin) is None and snapshot.pins[pin]['dir'] == 'IN']
+        timeline = HalCapture(self.hal, pins, driven=driven)
+        try:
+            timeline.start()
+        except ValueError as error:
+            self.console.insert(tk.END, '\nTimeline not recorded: {}\n'.format(error), 'red')
+            then()
+            return
+        self.timeline = timeline
+        self.timeline_event = event
+        self.timeline_job = self.main.after(20, self.poll_timeline)
+        self.main.after(100, then)
+
+    def poll_timeline(self):
+        self.timeline.poll()
+        self.timeline_job = self.main.after(20, self.poll_timeline)
+
+    # Keep recording for timeline_settle seconds after the last command, then save and report
+    def finish_timeline(self):
+        if self.timeline is not None and self.timeline_job is not None:
+            self.main.after_cancel(self.timeline_job)
+            self.timeline_job = self.main.after(int(self.timeline_settle * 1000), self.save_timeline)
+
+    def unlink_output(self, pin):
+        if self.timeline is not None and pin in self.timeline.pins:
+            return self.timeline_command(self.timeline.detach, pin)
+        return self.send_commands('unlinkp', pin)
+
+    def set_output(self, pin, value):
+        if self.timeline is not None and self.timeline.driven.get(pin) is not None:
+            return self.timeline_command(self.timeline.drive, pin, value)
+        return self.send_commands('setp', pin, value)
+
+    def link_output(self, pin, signal):
+        if self.timeline is not None and self.timeline.driven.get(pin) is not None:
+            return self.timeline_command(self.timeline.attach, pin, signal)
+        return self.send_commands('linkps', pin, signal)
+
+    # (out, err) of a capture call, like send_commands
+    def timeline_command(self, command, *args):
+        try:
+            command(*args)
+        except ValueError as error:
+            return '', str(error)
+        return '', ''
+
+    # Stop the timeline, save it with this session in ~/tmc/.pathpirate/servobrake and report it
+    def save_timeline(self):
+        self.timeline_job = None
+        timeline = self.timeline
+        self.timeline = None
+        timeline.stop()
+        self.timeline_count += 1
+        if not os.path.exists(self.timeline_folder):
+            os.makedirs(self.timeline_folder)
+        name = '{}_{}'.format(self.timeline_count, self.timeline_event)
+        timeline.save(os.path.join(self.timeline_folder, '{}.csv'.format(name)))
+        period = timeline.period()
+        report = self.timeline_report(timeline, period)
+        summary_file = os.path.join(self.timeline_folder, 'timeline.json')
+        summary = []
+        if os.path.exists(summary_file):
+            with open(summary_file, 'r') as json_file:
+                summary = json.load(json_file)
+        summary.append({'event': self.timeline_event, 'file': '{}.csv'.format(name), 'period': period, 'samples': timeline.count,
+                        'dropped': timeline.dropped, 'pins': dict(self.timeline_labels), 'report': report})
+        with open(summary_file, 'w') as json_file:
+            json.dump(summary, json_file, indent=4)
+        self.console.insert(tk.END, '\n{} TIMELINE ({} samples at {:g} ms)\n'.format(self.timeline_event.upper(), timeline.count, period * 1000), 'white')
+        for line in report:
+            self.console.insert(tk.END, '{}\n'.format(line), 'white')
+        if timeline.dropped:
+            self.console.insert(tk.END, '{} samples were dropped\n'.format(timeline.dropped), 'red')
+        self.console.insert(tk.END, 'Saved in {}\n'.format(self.timeline_folder), 'white')
+        self.console.see(tk.END)
+
+    # Lines with the time (ms) of every change of every pin from the brake coil command, and the
+    # latency of the coil readback
+    def timeline_report(self, timeline, period):
+        samples = list(timeline.samples)
+        changes = {}
+        for index, (label, pin) in enumerate(self.timeline_labels):
+            values = [values[index] for number, values in samples]
+            changes[label] = [(samples[sample][0], values[sample]) for sample in range(1, len(values)) if values[sample] != values[sample - 1]]
+        if not changes.get('brake coil'):
+            return ['The brake coil command did not change while recording']
+        command = changes['brake coil'][0][0]
+        lines = []
+        for label, pin in self.timeline_labels:
+            edges = ', '.join('{} at {:+.1f} ms'.format('on' if value else 'off', (number - command) * period * 1000) for number, value in changes[label])
+            lines.append('    {:20} {}'.format(label, edges or 'no change'))
+        readback = changes.get('brake coil readback')
+        if readback:
+            lines.append('{} latency from the coil command to the board output: {:.1f} ms'.format(
+                self.timeline_event.capitalize(), (readback[0][0] - command) * period * 1000))
+        if len(changes.get('servo relay', [])) > 1:
+            lines.append('WARNING: the servo relay changed {} times'.format(len(changes['servo relay'])))
+        return lines
+
+    # Show how long the HAL calls made so far have taken
+    def show_hal_latency(self):
+        self.console.insert(tk.END, 'HAL access via {}\n'.format(self.hal.latency_summary()), 'white')
+        self.console.see(tk.END)
 
     # Exit the program
     def exit_servo_brake(self):
         exit = tkMessageBox.askokcancel('EXIT', 'Are you sure?')
         if not exit:
             return
+        if self.watch_job is not None:
+            self.main.after_cancel(self.watch_job)
+        if self.timeline_job is not None:
+            self.main.after_cancel(self.timeline_job)
+        # an exit right after a release or engage still saves what the timeline has so far
+        if self.timeline is not None:
+            self.save_timeline()
+        if self.hal is not None:
+            self.hal.close()
         self.main.destroy()
 
     def exit_pass(self):
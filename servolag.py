@@ -0,0 +1,183 @@
+'''
+servolag reports how many servo periods the addf order of a HAL file adds
+to the position loop of each axis.
+
+Copyright (C) 2023, 2024, 2025, 2026 Gregory D Carl
+
+This program is free software; you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with this program; if not, write to the Free Software Foundation, Inc.,
+51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+'''
+
+import sys
+import os
+import re
+from halgraph import loadGraph, readIni, shippedGraphs
+
+# A value written by one function is seen by another in the same period only if the writer runs
+# first in the thread, otherwise the reader works with last period's value. The lag of a path is
+# the number of hops where that happens.
+class ServoLag:
+
+    # pins handled by motion-controller
+    motionPin = re.compile(r'^(axis|joint|motion)\.')
+    axisLetters = 'XYZABCUVW'
+
+    def __init__(self, graph, thread='servo-thread'):
+        self.graph = graph
+        self.thread = thread
+        self.order = graph.threadFunctions(thread)
+        self.edges = self.functionEdges()
+
+    # The function (in this thread) that reads or writes a pin. hostmot2 pins the card drives are
+    # updated by .read, the ones it takes are sent by .write.
+    def pinFunction(self, pin):
+        if self.motionPin.match(pin):
+            return 'motion-controller' if 'motion-controller' in self.order else None
+        owners = [name for name in self.graph.instances if pin.startswith('{}.'.format(name))]
+        if not owners:
+            return None
+        owner = max(owners, key=len)
+        if self.graph.instances[owner]['component'].startswith('hm2_'):
+            function = '{}.{}'.format(owner, 'read' if self.graph.pinDirection(pin) == 'out' else 'write')
+            return function if function in self.order else None
+        for function in self.order:
+            if function == owner or function.startswith('{}.'.format(owner)):
+                return function
+        return None
+
+    def position(self, function):
+        return self.order.index(function) if function in self.order else None
+
+    # 0 if the reader sees the value in the same period, 1 if a period later, None if either pin
+    # is not handled by a function of this thread
+    def delay(self, writerPin, readerPin):
+        writer = self.position(self.pinFunction(writerPin))
+        reader = self.position(self.pinFunction(readerPin))
+        if writer is None or reader is None:
+            return None
+        return 0 if writer < reader else 1
+
+    # {writer function: set of reader functions} over every signal in the thread
+    def functionEdges(self):
+        edges = {}
+        for signal in self.graph.signals.values():
+            writers = [pin for pin in signal['pins'] if self.graph.pinDirection(pin) == 'out']
+            readers = [pin for pin in signal['pins'] if self.graph.pinDirection(pin) != 'out']
+            for writer in writers:
+                writerFunction = self.pinFunction(writer)
+                for reader in readers:
+                    readerFunction = self.pinFunction(reader)
+                    if writerFunction and readerFunction and writerFunction != readerFunction:
+                        edges.setdefault(writerFunction, set()).add(readerFunction)
+        return edges
+
+    def feeds(self, start, target):
+        seen = set()
+        todo = [start]
+        while todo:
+            function = todo.pop()
+            if function == target:
+                return True
+            if function not in seen:
+                seen.add(function)
+                todo.extend(self.edges.get(function, []))
+        return False
+
+    # A delayed hop is avoidable when the reader could run after the writer, i.e. nothing the
+    # reader writes ends up back at the writer
+    def avoidable(self, writerPin, readerPin):
+        return not self.feeds(self.pinFunction(readerPin), self.pinFunction(writerPin))
+
+    def writers(self, pin):
+        signal = self.graph.signals.get(self.graph.pins.get(pin, {}).get('signal'))
+        return [other for other in signal['pins'] if other != pin and self.graph.pinDirection(other) == 'out'] if signal else []
+
+    def readers(self, pin):
+        signal = self.graph.signals.get(self.graph.pins.get(pin, {}).get('signal'))
+        return [other for other in signal['pins'] if other != pin and self.graph.pinDirection(other) != 'out'] if signal else []
+
+    # One entry per path into or out of every pid instance:
+    #   {'axis', 'pid', 'path', 'pins', 'hops': [[writer, reader, delay, avoidable]], 'periods'}
+    # 'feedback' runs from the pin that writes pid.N.feedback through pid.N.output to what reads it,
+    # 'motion' from the same feedback pin to axis.N.motor-pos-fb and 'command' from the pin that
+    # writes pid.N.command (axis.N.motor-pos-cmd) to the pid.
+    def paths(self):
+        paths = []
+        pids = sorted(name for name, instance in self.graph.instances.items() if instance['component'] == 'pid')
+        for pid in pids:
+            commands = self.writers('{}.command'.format(pid))
+            axis = pid
+            for pin in commands:
+                match = re.match(r'^axis\.(\d+)\.', pin)
+                if match and int(match.group(1)) < len(self.axisLetters):
+                    axis = self.axisLetters[int(match.group(1))]
+            for feedback in self.writers('{}.feedback'.format(pid)):
+                for output in self.readers('{}.output'.format(pid)) or [None]:
+                    hops = [[feedback, '{}.feedback'.format(pid)]]
+                    if output is not None:
+                        hops.append(['{}.output'.format(pid), output])
+                    paths.append(self.path(axis, pid, 'feedback', hops))
+                for reader in self.readers(feedback):
+                    if self.motionPin.match(reader):
+                        paths.append(self.path(axis, pid, 'motion', [[feedback, reader]]))
+            for command in commands:
+                paths.append(self.path(axis, pid, 'command', [[command, '{}.command'.format(pid)]]))
+        return paths
+
+    def path(self, axis, pid, name, hops):
+        pins = [hops[0][0]] + [reader for _, reader in hops]
+        checked = []
+        for writer, reader in hops:
+            delay = self.delay(writer, reader)
+            checked.append([writer, reader, delay, bool(delay) and self.avoidable(writer, reader)])
+        delays = [delay for _, _, delay, _ in checked]
+        return {'axis': axis, 'pid': pid, 'path': name, 'pins': pins, 'hops': checked,
+                'periods': None if None in delays else sum(delays)}
+
+# Print the lag of every path, returns the number of hops with avoidable delay
+def printLag(graph, name, thread='servo-thread'):
+    servoLag = ServoLag(graph, thread)
+    paths = servoLag.paths()
+    avoidable = sum(1 for path in paths for hop in path['hops'] if hop[3])
+    print('{}: {} functions in {}, {} paths, {} avoidable delays'.format(name, len(servoLag.order), thread, len(paths), avoidable))
+    for path in paths:
+        periods = '?' if path['periods'] is None else path['periods']
+        print('    {:2} {:8} {:8} {} period(s): {}'.format(path['axis'], path['pid'], path['path'], periods, ' -> '.join(path['pins'])))
+        for writer, reader, delay, isAvoidable in path['hops']:
+            if delay is None:
+                print('        {} -> {} is not handled by {}'.format(writer, reader, thread))
+            elif isAvoidable:
+                print('        AVOIDABLE: {} runs before {}, move it after to read {} in the same period'.format(
+                    servoLag.pinFunction(reader), servoLag.pinFunction(writer), writer))
+    return avoidable
+
+if __name__ == '__main__':
+    import argparse
+    configDir = os.path.join(os.path.realpath(os.path.dirname(__file__)), 'files/configs')
+    parser = argparse.ArgumentParser(description='Report how many servo periods the addf order adds to the position loop of each axis.')
+    parser.add_argument('hal', nargs='*', help='HAL file(s) to check, default is every shipped template of every version')
+    parser.add_argument('--ini', help='INI file for [SECTION]KEY substitution (a *_specific.ini is merged over its base INI)')
+    parser.add_argument('--version', action='append', help='only check the shipped templates of this version')
+    parser.add_argument('--thread', default='servo-thread', help='thread to check (default: servo-thread)')
+    args = parser.parse_args()
+    cacheDir = os.path.join(configDir, '.cache/halgraph')
+    avoidable = 0
+    if args.hal:
+        ini = readIni(args.ini) if args.ini else {}
+        for halPath in args.hal:
+            avoidable += printLag(loadGraph(halPath, ini, cacheDir), halPath, args.thread)
+    else:
+        for name, graph in shippedGraphs(configDir, args.version, cacheDir):
+            avoidable += printLag(graph, name, args.thread)
+    sys.exit(1 if avoidable else 0)
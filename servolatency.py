@@ -0,0 +1,315 @@
+'''
+servolatency records how long the servo thread runs and how late it starts
+and recommends the shortest SERVO_PERIOD and DPLL timer the PC can hold.
+
+Copyright (C) 2023, 2024, 2025, 2026 Gregory D Carl
+
+This program is free software; you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with this program; if not, write to the Free Software Foundation, Inc.,
+51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+'''
+
+import sys
+import os
+import re
+import json
+import math
+import time
+from inimodel import IniFile, IniCache
+from halcapture import HalCapture
+
+# time.time() is the best clock Python 2 has
+clock = getattr(time, 'perf_counter', time.time)
+
+# Counts of values (ns) in bins of binWidth, only the bins that were hit are kept. Values past the
+# last bin are counted in it, the largest value is kept as it was.
+class Histogram:
+
+    def __init__(self, binWidth=1000, bins=10000):
+        self.binWidth = binWidth
+        self.bins = bins
+        self.counts = {}
+        self.count = 0
+        self.total = 0.0
+        self.minimum = None
+        self.maximum = None
+
+    def add(self, value):
+        index = min(max(int(value // self.binWidth), 0), self.bins - 1)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        self.minimum = value if self.minimum is None else min(self.minimum, value)
+        self.maximum = value if self.maximum is None else max(self.maximum, value)
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    # Upper edge of the bin that holds the given fraction of the values
+    def percentile(self, fraction):
+        if not self.count:
+            return 0.0
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= fraction * self.count:
+                return min((index + 1) * self.binWidth, self.maximum)
+        return self.maximum
+
+    # One line per bin that was hit, a bar scaled to the log of its count so single late periods
+    # still show next to millions of good ones
+    def lines(self, width=40, unit=1000.0, name='us'):
+        if not self.count:
+            return ['    no samples']
+        top = math.log10(max(self.counts.values()) + 1)
+        lines = []
+        for index in sorted(self.counts):
+            bar = '#' * max(1, int(round(math.log10(self.counts[index] + 1) / top * width)))
+            lines.append('    {:8.0f} {} {:10} {}'.format(index * self.binWidth / unit, name, self.counts[index], bar))
+        return lines
+
+    def data(self):
+        return {'binWidth': self.binWidth, 'counts': dict((str(index), count) for index, count in self.counts.items()),
+                'count': self.count, 'mean': self.mean(), 'min': self.minimum, 'max': self.maximum}
+
+# CPU clock (Hz) the thread times are counted in when HAL gives no ns pin to compare against
+def cpuClock():
+    try:
+        with open('/proc/cpuinfo', 'r') as file:
+            for line in file:
+                if line.startswith('cpu MHz'):
+                    return float(line.split(':')[1]) * 1e6
+    except (IOError, OSError, ValueError):
+        pass
+    return None
+
+# Wake up every period (ns) for a number of seconds from userspace and count how late each wake up
+# is. Without a realtime kernel this only shows what the PC does at best, nothing is locked in
+# memory or scheduled ahead of other programs.
+def timerProbe(period, seconds, lateness):
+    interval = period / 1e9
+    start = clock()
+    deadline = start + interval
+    while deadline - start < seconds:
+        remaining = deadline - clock()
+        if remaining > 0:
+            time.sleep(remaining)
+        late = clock() - deadline
+        lateness.add(late * 1e9)
+        deadline += interval
+        # a wake up that missed whole periods starts counting again from now
+        if late > interval:
+            deadline = clock() + interval
+
+# Records the servo thread through HAL: motion.servo.last-period (the time between the last two
+# starts of the thread) every period through the sampler, and the execution time of the thread
+# (servo-thread.time) as often as HAL can be asked. The maxima HAL keeps (tmax of the thread and of
+# each function in it) are reset first and read at the end. Other pins and parameters in watch are
+# read along with the thread time and kept as HAL gives them.
+class ServoLatency:
+
+    # period in ns, clock in Hz or None to work it out
+    def __init__(self, session, period, thread='servo-thread', clock=None, watch=()):
+        self.session = session
+        self.period = period
+        self.thread = thread
+        self.clock = clock
+        self.watched = dict((name, []) for name in watch)
+        self.jitter = Histogram()
+        self.execution = Histogram()
+        self.functions = {}
+        self.tmax = None
+        self.dropped = 0
+
+    def getp(self, name):
+        out, err = self.session.command('getp', name)
+        if err.strip():
+            return None
+        try:
+            return float(out.strip())
+        except ValueError:
+            return None
+
+    # {name: value} of the timing parameters of the thread and its functions
+    def timingParams(self):
+        out, err = self.session.command('show', 'param')
+        params = {}
+        for line in out.splitlines():
+            tokens = line.split()
+            if len(tokens) >= 5 and re.search(r'\.(time|tmax)$', tokens[-1]):
+                try:
+                    params[tokens[-1]] = float(tokens[-2])
+                except ValueError:
+                    pass
+        return params
+
+    def record(self, seconds):
+        snapshot = self.session.snapshot()
+        if not snapshot.is_running():
+            raise ValueError('HAL is not running')
+        pins = [pin for pin in ['motion.servo.last-period', 'motion.servo.last-period-ns'] if snapshot.has_pin(pin)]
+        if not pins:
+            raise ValueError('motion.servo.last-period not found')
+        for name in self.timingParams():
+            if name.endswith('.tmax'):
+                self.session.command('setp', name, '0')
+        capture = HalCapture(self.session, pins, self.thread, maxSamples=int(seconds * 1e9 / self.period) + 1)
+        times = []
+        capture.start()
+        try:
+            end = clock() + seconds
+            while clock() < end:
+                capture.poll(0.002)
+                value = self.getp('{}.time'.format(self.thread))
+                if value is not None:
+                    times.append(value)
+                for name, values in self.watched.items():
+                    value = self.getp(name)
+                    if value is not None:
+                        values.append(value)
+        finally:
+            capture.stop()
+        self.dropped = capture.dropped
+        columns = capture.columns()
+        periods = columns[pins[0]]
+        if self.clock is None and len(pins) == 2:
+            ratios = [clocks / ns for clocks, ns in zip(periods, columns[pins[1]]) if ns > 0]
+            self.clock = sorted(ratios)[len(ratios) // 2] * 1e9 if ratios else None
+        if self.clock is None:
+            self.clock = cpuClock() or 1e9
+        scale = 1e9 / self.clock
+        if len(pins) == 2:
+            periods = columns[pins[1]]
+            scale = 1.0
+        # the first period after the sampler was added can be anything
+        for value in periods[1:]:
+            self.jitter.add(abs(value * scale - self.period))
+        for value in times:
+            self.execution.add(value * 1e9 / self.clock)
+        params = self.timingParams()
+        self.tmax = params.get('{}.tmax'.format(self.thread))
+        if self.tmax is not None:
+            self.tmax *= 1e9 / self.clock
+        self.functions = dict((name[:-len('.tmax')], value * 1e9 / self.clock) for name, value in params.items()
+                              if name.endswith('.tmax') and name != '{}.tmax'.format(self.thread))
+
+# The shortest period (ns) the thread fits in: its longest run plus the largest jitter with a
+# quarter of the period spare, rounded up to 50 us and never under 250 us. The DPLL timer (us,
+# negative is before read()) has to sample before the earliest read the jitter allows, and within
+# the first half of the period.
+def recommend(jitter, execution):
+    needed = (execution + jitter) / 0.75
+    period = max(int(math.ceil(needed / 50000.0)) * 50000, 250000)
+    dpll = -min(max(int(math.ceil((jitter / 1000.0 + 20) / 10.0)) * 10, 50), period // 2000)
+    return period, dpll
+
+# Lines that explain the recording and the recommendation, and the overlay settings
+def report(period, jitter, execution, tmax=None, functions=None, probe=False, dropped=0):
+    lines = ['Servo period {:.0f} us, {} samples{}'.format(period / 1000.0, jitter.count,
+                                                        ' from a userspace timer, not the realtime thread' if probe else '')]
+    if dropped:
+        lines.append('WARNING: {} samples were dropped'.format(dropped))
+    lines.append('{} {:.1f} us mean, {:.1f} us 99.9%, {:.1f} us max'.format('Wake up lateness' if probe else 'Period jitter',
+                 jitter.mean() / 1000.0, jitter.percentile(0.999) / 1000.0, (jitter.maximum or 0) / 1000.0))
+    lines.extend(jitter.lines())
+    longest = max(execution.maximum or 0, tmax or 0)
+    if execution.count:
+        lines.append('Thread execution {:.1f} us mean, {:.1f} us max of {} samples, {:.1f} us tmax'.format(
+            execution.mean() / 1000.0, (execution.maximum or 0) / 1000.0, execution.count, (tmax or 0) / 1000.0))
+        lines.extend(execution.lines())
+    for name, value in sorted((functions or {}).items(), key=lambda item: -item[1])[:10]:
+        lines.append('    {:40} {:8.1f} us tmax'.format(name, value / 1000.0))
+    recommended, dpll = recommend(jitter.maximum or 0, longest)
+    lines.append('Recommended: SERVO_PERIOD = {} ({:.0f} us), DPLL_TIMER_US and ENCODER_DPLL_TIMER_US = {}'.format(recommended, recommended / 1000.0, dpll))
+    if recommended > period:
+        lines.append('WARNING: the current period of {:.0f} us leaves less than a quarter of it spare'.format(period / 1000.0))
+    if probe:
+        lines.append('A userspace timer has no realtime priority, run it again with PathPilot running for real figures')
+    return lines, {'EMCMOT': {'SERVO_PERIOD': str(recommended)}, 'HOSTMOT2': {'DPLL_TIMER_US': str(dpll), 'ENCODER_DPLL_TIMER_US': str(dpll)}}
+
+def overlayText(name, lines, settings):
+    text = ['# Servo thread timing for {} written by PathPirate'.format(name)]
+    text.extend('# {}'.format(line) for line in lines)
+    for section in sorted(settings):
+        text.extend(['', '[{}]'.format(section)])
+        text.extend('{} = {}'.format(key, value) for key, value in sorted(settings[section].items()))
+    return '\n'.join(text) + '\n'
+
+if __name__ == '__main__':
+    import argparse
+    from halsession import HalSession
+    parser = argparse.ArgumentParser(description='Record servo thread jitter and execution time and recommend the shortest SERVO_PERIOD '
+                                     'and DPLL timer this PC can hold.')
+    parser.add_argument('--ini', help='INI to read [EMCMOT]SERVO_PERIOD from (a *_specific.ini is merged over its base INI)')
+    parser.add_argument('--period', type=int, help='servo period in ns (default: from --ini, or 1000000)')
+    parser.add_argument('--seconds', type=float, default=60, help='how long to record (default: 60)')
+    parser.add_argument('--probe', action='store_true', help='use a userspace timer even if HAL is running')
+    parser.add_argument('--clock', type=float, help='clock (Hz) HAL counts thread times in, default worked out or from /proc/cpuinfo')
+    parser.add_argument('--halcmd', default=os.path.expanduser('~/tmc/bin/halcmd'), help='halcmd (halsampler is expected next to it)')
+    parser.add_argument('-o', '--overlay', help='write the recommended values as an INI overlay to this file')
+    parser.add_argument('--apply', action='store_true', help='write the recommended values into the INI given with --ini')
+    parser.add_argument('--save', help='write the histograms as JSON to this file')
+    args = parser.parse_args()
+    if args.apply and not args.ini:
+        sys.exit('--apply needs --ini')
+    values = IniCache().values(args.ini) if args.ini else {}
+    period = args.period
+    if period is None:
+        try:
+            period = int(float(values.get('EMCMOT', {}).get('SERVO_PERIOD')))
+        except (TypeError, ValueError):
+            period = None
+    period = period or 1000000
+    execution = Histogram()
+    tmax = None
+    functions = {}
+    dropped = 0
+    probe = args.probe or not os.path.exists(args.halcmd)
+    if not probe:
+        session = HalSession(args.halcmd)
+        latency = ServoLatency(session, period, clock=args.clock)
+        try:
+            print('Recording the servo thread for {:g} s'.format(args.seconds))
+            latency.record(args.seconds)
+            jitter, execution, tmax, functions, dropped = latency.jitter, latency.execution, latency.tmax, latency.functions, latency.dropped
+        except ValueError as error:
+            print('{}, using a userspace timer instead'.format(error))
+            probe = True
+        finally:
+            session.close()
+    if probe:
+        jitter = Histogram()
+        print('Probing a {:.0f} us userspace timer for {:g} s'.format(period / 1000.0, args.seconds))
+        timerProbe(period, args.seconds, jitter)
+    lines, settings = report(period, jitter, execution, tmax, functions, probe, dropped)
+    print('\n'.join(lines))
+    if args.overlay:
+        with open(args.overlay, 'w') as file:
+            file.write(overlayText(os.path.basename(args.ini or 'the servo thread'), lines, settings))
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump({'period': period, 'probe': probe, 'jitter': jitter.data(), 'execution': execution.data(),
+                       'tmax': tmax, 'functions': functions}, file, indent=4, sort_keys=True)
+    # only what the INI (or its base) already sets, a config without a DPLL keeps running without one
+    if args.apply and not probe:
+        iniFile = IniFile.read(args.ini)
+        changed = 0
+        for section in sorted(settings):
+            for key, value in sorted(settings[section].items()):
+                if key in values.get(section, {}) and iniFile.get(section, key) != value:
+                    iniFile.set(section, key, value)
+                    changed += 1
+        if changed:
+            iniFile.write(args.ini)
+    elif args.apply:
+        print('Not applied, a userspace timer says nothing about the realtime thread')
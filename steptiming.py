@@ -0,0 +1,175 @@
+'''
+steptiming works out the tightest hostmot2 stepgen timings a ClearPath motor
+accepts and the highest velocity each axis can then be stepped at.
+
+Copyright (C) 2023, 2024, 2025, 2026 Gregory D Carl
+
+This program is free software; you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with this program; if not, write to the Free Software Foundation, Inc.,
+51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+'''
+
+import sys
+import os
+import re
+import math
+from inimodel import IniFile
+
+# Step and direction input limits of the ClearPath SD motors, from Teknic's ClearPath-SD manual:
+# minimum step pulse high and low time, direction setup and hold around a step edge (ns) and the
+# highest step rate (Hz) the motor takes
+clearPathModels = {
+    'SDSK': {'STEPLEN': 250, 'STEPSPACE': 250, 'DIRSETUP': 1000, 'DIRHOLD': 1000, 'maxRate': 2000000},
+    'SDHP': {'STEPLEN': 250, 'STEPSPACE': 250, 'DIRSETUP': 1000, 'DIRHOLD': 1000, 'maxRate': 2000000},
+}
+
+# Clock the hostmot2 stepgen times its pulses with (ClockLow, Hz), the timings are whole ticks of it
+boardClocks = {'5i25': 100000000, '7i92': 100000000, '7i92T': 100000000}
+
+timingKeys = ['STEPLEN', 'STEPSPACE', 'DIRSETUP', 'DIRHOLD']
+
+# The board a specific INI is for, from its name (the 7i92 configs run a 7i92 or a 7i92T)
+def iniBoard(path):
+    return '7i92' if '7i92' in os.path.basename(path) else '5i25'
+
+class StepTiming:
+
+    # margin is applied to every minimum of the model before it is rounded up to the board clock,
+    # the motor inputs are opto-isolated and a long cable rounds off the edges
+    def __init__(self, model='SDSK', board='5i25', margin=1.5, clock=None):
+        if model not in clearPathModels:
+            raise ValueError('Unknown ClearPath model: {}'.format(model))
+        if clock is None and board not in boardClocks:
+            raise ValueError('Unknown board: {}'.format(board))
+        self.model = model
+        self.board = board
+        self.margin = margin
+        self.clock = clock or boardClocks[board]
+        self.limits = clearPathModels[model]
+
+    # A time in ns rounded up to whole clock ticks, hostmot2 truncates to ticks when it loads it
+    def ticks(self, nanoseconds):
+        ticks = int(math.ceil(nanoseconds * self.clock / 1e9 - 1e-9))
+        return int(math.ceil(ticks * 1e9 / self.clock - 1e-9))
+
+    def timings(self):
+        return dict((key, self.ticks(self.limits[key] * self.margin)) for key in timingKeys)
+
+    # Highest step rate (Hz) of the timings: a step needs STEPLEN high and STEPSPACE low, the
+    # direction times only apply around a reversal
+    def stepRate(self, timings):
+        return min(1e9 / (timings['STEPLEN'] + timings['STEPSPACE']), self.limits['maxRate'])
+
+    # One entry per [AXIS_n] that is stepped (has SCALE and STEPLEN) in {section: {key: value}}:
+    #   {'axis', 'scale', 'current', 'timings', 'rate', 'maxVel', 'currentRate', 'currentMaxVel', 'maxVelocity',
+    #    'stepgenMaxVel', 'binding'}
+    # velocities are in machine units per second, binding is what limits the step rate
+    def axes(self, values):
+        timings = self.timings()
+        axes = []
+        for section in sorted(values, key=lambda name: [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', name)]):
+            if not re.match(r'^AXIS_\d+$', section) or 'SCALE' not in values[section] or 'STEPLEN' not in values[section]:
+                continue
+            entries = values[section]
+            try:
+                scale = abs(float(entries['SCALE']))
+                current = dict((key, float(entries[key])) for key in timingKeys if key in entries)
+            except ValueError:
+                continue
+            if not scale:
+                continue
+            rate = self.stepRate(timings)
+            binding = 'the {} step rate limit'.format(self.model) if rate == self.limits['maxRate'] else 'STEPLEN + STEPSPACE'
+            axis = {'axis': section, 'scale': scale, 'current': current, 'timings': timings, 'rate': rate, 'maxVel': rate / scale,
+                    'currentRate': None, 'currentMaxVel': None, 'binding': binding,
+                    'maxVelocity': floatOrNone(entries.get('MAX_VELOCITY')), 'stepgenMaxVel': floatOrNone(entries.get('STEPGEN_MAX_VEL'))}
+            if 'STEPLEN' in current and 'STEPSPACE' in current and current['STEPLEN'] + current['STEPSPACE'] > 0:
+                axis['currentRate'] = 1e9 / (current['STEPLEN'] + current['STEPSPACE'])
+                axis['currentMaxVel'] = axis['currentRate'] / scale
+            axes.append(axis)
+        return axes
+
+    # Lines that explain the limits of every axis
+    def explain(self, axes):
+        lines = ['ClearPath {} on a {} ({:g} MHz stepgen clock), {:g}x the minimum pulse timing'.format(
+            self.model, self.board, self.clock / 1e6, self.margin)]
+        for axis in axes:
+            timings = axis['timings']
+            lines.append('{}: STEPLEN {} + STEPSPACE {} ns, DIRSETUP {} / DIRHOLD {} ns, {:.0f} kHz limited by {}'.format(
+                axis['axis'], timings['STEPLEN'], timings['STEPSPACE'], timings['DIRSETUP'], timings['DIRHOLD'],
+                axis['rate'] / 1e3, axis['binding']))
+            lines.append('    at SCALE {:g} the step rate allows {:.3f} units/s ({:.0f} units/min)'.format(
+                axis['scale'], axis['maxVel'], axis['maxVel'] * 60))
+            if axis['currentMaxVel'] is not None:
+                lines.append('    the current timings allow {:.3f} units/s ({:.0f} kHz)'.format(axis['currentMaxVel'], axis['currentRate'] / 1e3))
+            if axis['stepgenMaxVel'] is not None:
+                used = axis['stepgenMaxVel'] / axis['maxVel'] * 100
+                if axis['stepgenMaxVel'] > axis['maxVel']:
+                    lines.append('    STEPGEN_MAX_VEL {:g} is more than the timings allow, lower it to {:.3f}'.format(
+                        axis['stepgenMaxVel'], axis['maxVel']))
+                else:
+                    lines.append('    STEPGEN_MAX_VEL {:g} uses {:.0f}% of it, MAX_VELOCITY {} is limited by the motor and '
+                                 'mechanics, not by step timing'.format(axis['stepgenMaxVel'], used,
+                                                                        '?' if axis['maxVelocity'] is None else '{:g}'.format(axis['maxVelocity'])))
+        return lines
+
+    # INI text with the timings of every axis, laid over a specific INI by apply()
+    def overlay(self, axes, name):
+        lines = ['# Step timings for {} written by PathPirate'.format(name)]
+        lines.extend('# {}'.format(line) for line in self.explain(axes))
+        for axis in axes:
+            lines.append('')
+            lines.append('[{}]'.format(axis['axis']))
+            lines.extend('{} = {}'.format(key, axis['timings'][key]) for key in timingKeys)
+        return '\n'.join(lines) + '\n'
+
+    # Set the timings of every axis in an IniFile, returns the number of keys that changed
+    def apply(self, iniFile, axes):
+        changed = 0
+        for axis in axes:
+            for key in timingKeys:
+                value = str(axis['timings'][key])
+                if iniFile.get(axis['axis'], key) != value:
+                    iniFile.set(axis['axis'], key, value)
+                    changed += 1
+        return changed
+
+def floatOrNone(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Work out the tightest ClearPath step timings and the velocity they allow for each axis of an INI.')
+    parser.add_argument('ini', help='INI to read SCALE and the current timings of the stepped axes from')
+    parser.add_argument('--model', default='SDSK', choices=sorted(clearPathModels), help='ClearPath model (default: SDSK)')
+    parser.add_argument('--board', choices=sorted(boardClocks), help='Mesa board, default from the INI name')
+    parser.add_argument('--clock', type=float, help='stepgen clock in Hz if it is not the usual one of the board')
+    parser.add_argument('--margin', type=float, default=1.5, help='factor applied to the minimum timings (default: 1.5)')
+    parser.add_argument('-o', '--overlay', help='write the timings as an INI overlay to this file')
+    parser.add_argument('--apply', action='store_true', help='write the timings into the INI itself')
+    args = parser.parse_args()
+    stepTiming = StepTiming(args.model, args.board or iniBoard(args.ini), args.margin, args.clock)
+    iniFile = IniFile.read(args.ini)
+    axes = stepTiming.axes(iniFile.values())
+    if not axes:
+        sys.exit('{} has no [AXIS_n] with SCALE and STEPLEN'.format(args.ini))
+    print('\n'.join(stepTiming.explain(axes)))
+    if args.overlay:
+        with open(args.overlay, 'w') as file:
+            file.write(stepTiming.overlay(axes, os.path.basename(args.ini)))
+    if args.apply:
+        if stepTiming.apply(iniFile, axes):
+            iniFile.write(args.ini)
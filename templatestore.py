@@ -0,0 +1,314 @@
+'''
+templatestore keeps the per-version PathPirate config templates as one base
+set plus a small patch per version.
+
+Copyright (C) 2023, 2024, 2025, 2026 Gregory D Carl
+
+This program is free software; you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with this program; if not, write to the Free Software Foundation, Inc.,
+51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+'''
+
+import sys
+import os
+import io
+import re
+import json
+import difflib
+import hashlib
+import time
+
+# Layout of the store:
+#   templates/index.json             base version and the sha256 of every file of every version
+#   templates/base/<name>            full copy of each file for the base version
+#   templates/<version>/<name>.patch unified diff (no context) from the base file, only when they differ
+# Rebuilt files are written to a small cache so repeated runs do not patch again. Several processes
+# share the cache (pathpiratecli runs a pool), so a file is only pruned once no run can still be
+# using it: never one this store handed out, never one any process used in the last keepSeconds.
+class TemplateStore:
+
+    hunkHeader = re.compile(r'^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@')
+
+    def __init__(self, storeDir, cacheDir, cacheSize=8, keepSeconds=3600):
+        self.storeDir = storeDir
+        self.cacheDir = cacheDir
+        self.cacheSize = cacheSize
+        self.keepSeconds = keepSeconds
+        self.handedOut = set()
+        self.indexFile = os.path.join(storeDir, 'index.json')
+        self.baseDir = os.path.join(storeDir, 'base')
+        self.index = None
+
+    def loadIndex(self):
+        if self.index is None:
+            if os.path.exists(self.indexFile):
+                with open(self.indexFile, 'r') as jsonFile:
+                    self.index = json.load(jsonFile)
+            else:
+                self.index = {'base': None, 'files': {}}
+        return self.index
+
+    def versions(self):
+        return sorted(self.loadIndex()['files'].keys(), key=self.versionKey)
+
+    def names(self, version):
+        return sorted(self.loadIndex()['files'].get(version, {}).keys())
+
+    # 'v2.9.x' sorts before 'v2.10.0'
+    def versionKey(self, version):
+        return [int(part) if part.isdigit() else -1 for part in version.lstrip('v').split('.')]
+
+    def readText(self, path):
+        with io.open(path, 'r', encoding='utf-8', newline='') as file:
+            return file.read()
+
+    def writeText(self, path, text):
+        folder = os.path.dirname(path)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        # unique per process, several PathPirate processes can share the cache
+        tempPath = '{}.{}.tmp'.format(path, os.getpid())
+        with io.open(tempPath, 'w', encoding='utf-8', newline='') as file:
+            file.write(text)
+        os.rename(tempPath, path)
+
+    def digest(self, text):
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def saveIndex(self):
+        with open(self.indexFile, 'w') as jsonFile:
+            json.dump(self.index, jsonFile, indent=4, sort_keys=True)
+            jsonFile.write('\n')
+
+    # Create the store from version folders laid out like files/configs/<version>/<name>, e.g. the
+    # output of extract() after the base version changed
+    def build(self, sourceDir, baseVersion):
+        self.index = {'base': baseVersion, 'files': {}}
+        versions = [entry for entry in os.listdir(sourceDir) if entry.startswith('v2.') and os.path.isdir(os.path.join(sourceDir, entry))]
+        for name in os.listdir(os.path.join(sourceDir, baseVersion)):
+            self.writeText(os.path.join(self.baseDir, name), self.readText(os.path.join(sourceDir, baseVersion, name)))
+        for version in versions:
+            self.storeVersion(version, os.path.join(sourceDir, version))
+        self.saveIndex()
+
+    # Add a new version (or replace one) from a folder holding its full files. Only that version is
+    # patched against the base that is already stored, the other versions are left as they are.
+    def addVersion(self, version, sourceDir):
+        if self.loadIndex()['base'] is None:
+            raise ValueError('The store has no base version yet, build it first')
+        self.storeVersion(version, sourceDir)
+        self.saveIndex()
+
+    # The patch of every file of one version against the base, plus its digest in the index
+    def storeVersion(self, version, sourceDir):
+        files = {}
+        for name in sorted(os.listdir(sourceDir)):
+            text = self.readText(os.path.join(sourceDir, name))
+            files[name] = self.digest(text)
+            patchPath = os.path.join(self.storeDir, version, '{}.patch'.format(name))
+            basePath = os.path.join(self.baseDir, name)
+            baseText = self.readText(basePath) if os.path.exists(basePath) else ''
+            if text != baseText:
+                self.writeText(patchPath, self.makePatch(baseText, text, name))
+            elif os.path.exists(patchPath):
+                os.remove(patchPath)
+        # patches of files a replaced version no longer has
+        versionDir = os.path.join(self.storeDir, version)
+        if os.path.isdir(versionDir):
+            for entry in os.listdir(versionDir):
+                if entry.endswith('.patch') and entry[:-len('.patch')] not in files:
+                    os.remove(os.path.join(versionDir, entry))
+        self.loadIndex()['files'][version] = files
+
+    def makePatch(self, baseText, text, name):
+        patch = []
+        for line in difflib.unified_diff(baseText.splitlines(True), text.splitlines(True), 'base/{}'.format(name), name, n=0):
+            if line.endswith('\n'):
+                patch.append(line)
+            else:
+                patch.append('{}\n\\ No newline at end of file\n'.format(line))
+        return ''.join(patch)
+
+    # Apply a unified diff to the base text, every removed line must match exactly
+    def applyPatch(self, baseText, patchText):
+        base = baseText.splitlines(True)
+        lines = patchText.splitlines(True)
+        entries = []
+        for number, line in enumerate(lines):
+            if line.startswith('\\'):
+                continue
+            if number + 1 < len(lines) and lines[number + 1].startswith('\\'):
+                line = line[:-1]
+            entries.append(line)
+        out = []
+        pos = 0
+        index = 0
+        inHunk = False
+        for line in entries:
+            if not inHunk and (line.startswith('---') or line.startswith('+++')):
+                continue
+            match = self.hunkHeader.match(line)
+            if match:
+                inHunk = True
+                oldStart = int(match.group(1))
+                oldLength = 1 if match.group(2) is None else int(match.group(2))
+                index = oldStart - 1 if oldLength > 0 else oldStart
+                if index < pos:
+                    raise ValueError('Patch hunks are out of order')
+                out.extend(base[pos:index])
+                pos = index
+                continue
+            if line.startswith('-'):
+                if index >= len(base) or base[index] != line[1:]:
+                    raise ValueError('Patch does not match base at line {}'.format(index + 1))
+                index += 1
+                pos = index
+            elif line.startswith('+'):
+                out.append(line[1:])
+            elif line.startswith(' '):
+                out.append(base[index])
+                index += 1
+                pos = index
+        out.extend(base[pos:])
+        return ''.join(out)
+
+    # Rebuild the text of one file for one version straight from the store
+    def rebuild(self, version, name):
+        files = self.loadIndex()['files']
+        if version not in files or name not in files[version]:
+            return None
+        basePath = os.path.join(self.baseDir, name)
+        text = self.readText(basePath) if os.path.exists(basePath) else ''
+        patchPath = os.path.join(self.storeDir, version, '{}.patch'.format(name))
+        if os.path.exists(patchPath):
+            text = self.applyPatch(text, self.readText(patchPath))
+        if self.digest(text) != files[version][name]:
+            raise ValueError('Rebuilt {}/{} does not match the stored digest'.format(version, name))
+        return text
+
+    # Path to the rebuilt file for a version. The path is returned even if the version is not
+    # in the store so callers can report it as a missing file.
+    def getFile(self, version, name):
+        path = os.path.join(self.cacheDir, version, name)
+        files = self.loadIndex()['files']
+        if version not in files or name not in files[version]:
+            return path
+        self.handedOut.add(os.path.abspath(path))
+        try:
+            if os.path.exists(path) and self.digest(self.readText(path)) == files[version][name]:
+                os.utime(path, None)
+                return path
+        except (IOError, OSError):
+            # pruned by another process between the checks, rebuilt below
+            pass
+        try:
+            text = self.rebuild(version, name)
+        except ValueError:
+            return path
+        self.writeText(path, text)
+        self.pruneCache()
+        return path
+
+    # Keep only the most recently used files in the cache, files that may still be in use are kept
+    # on top of those
+    def pruneCache(self):
+        cached = []
+        for root, dirs, names in os.walk(self.cacheDir):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    if not name.endswith('.tmp'):
+                        cached.append((os.path.getmtime(path), path))
+                except OSError:
+                    pass
+        cached.sort(reverse=True)
+        recent = time.time() - self.keepSeconds
+        for modified, path in cached[self.cacheSize:]:
+            if modified >= recent or os.path.abspath(path) in self.handedOut:
+                continue
+            try:
+                os.remove(path)
+                folder = os.path.dirname(path)
+                if not os.listdir(folder):
+                    os.rmdir(folder)
+            except OSError:
+                # already pruned by another process
+                pass
+
+    # Rebuild every file of every version and compare it with the stored digest, and with the
+    # original file too when a version folder is present in compareDir
+    def verify(self, compareDir=None):
+        results = []
+        for version in self.versions():
+            for name in self.names(version):
+                try:
+                    text = self.rebuild(version, name)
+                    ok = True
+                    message = 'OK'
+                except ValueError as e:
+                    text = None
+                    ok = False
+                    message = str(e)
+                original = os.path.join(compareDir, version, name) if compareDir else None
+                if ok and original and os.path.exists(original):
+                    with open(original, 'rb') as file:
+                        if file.read() != text.encode('utf-8'):
+                            ok = False
+                            message = 'differs from {}'.format(original)
+                results.append((version, name, ok, message))
+        return results
+
+    # Write the full files of every version back out, e.g. to inspect or diff them
+    def extract(self, outputDir):
+        for version in self.versions():
+            for name in self.names(version):
+                self.writeText(os.path.join(outputDir, version, name), self.rebuild(version, name))
+
+if __name__ == '__main__':
+    configDir = os.path.join(os.path.realpath(os.path.dirname(__file__)), 'files/configs')
+    store = TemplateStore(os.path.join(configDir, 'templates'), os.path.join(configDir, '.cache'))
+    usage = ('usage: python templatestore.py add <version> <folder> | build <base version> [source folder] | '
+             'verify [compare folder] | extract <output folder>')
+    if len(sys.argv) < 2 or sys.argv[1] not in ['add', 'build', 'verify', 'extract']:
+        print(usage)
+        sys.exit(1)
+    if sys.argv[1] == 'add':
+        if len(sys.argv) != 4:
+            print(usage)
+            sys.exit(1)
+        try:
+            store.addVersion(sys.argv[2], sys.argv[3])
+        except ValueError as e:
+            sys.exit(str(e))
+        print('{} added to the template store from {}'.format(sys.argv[2], sys.argv[3]))
+    elif sys.argv[1] == 'build':
+        if len(sys.argv) not in [3, 4]:
+            print(usage)
+            sys.exit(1)
+        sourceDir = sys.argv[3] if len(sys.argv) == 4 else configDir
+        store.build(sourceDir, sys.argv[2])
+        print('Template store built from {} with base {}'.format(sourceDir, sys.argv[2]))
+    elif sys.argv[1] == 'verify':
+        failed = 0
+        for version, name, ok, message in store.verify(sys.argv[2] if len(sys.argv) > 2 else None):
+            print('{:8} {:34} {}'.format(version, name, message))
+            if not ok:
+                failed += 1
+        print('{} file(s) failed verification'.format(failed))
+        sys.exit(1 if failed else 0)
+    else:
+        if len(sys.argv) != 3:
+            print(usage)
+            sys.exit(1)
+        store.extract(sys.argv[2])
+        print('All versions extracted to {}'.format(sys.argv[2]))
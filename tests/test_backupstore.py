@@ -0,0 +1,105 @@
+import os
+
+from backupstore import BackupStore
+
+def writeText(path, text):
+    with open(path, 'w') as file:
+        file.write(text)
+
+def readText(path):
+    with open(path, 'r') as file:
+        return file.read()
+
+def blobs(store):
+    if not os.path.exists(store.objectDir):
+        return []
+    return sorted(name for folder in os.listdir(store.objectDir) for name in os.listdir(os.path.join(store.objectDir, folder)))
+
+# one generation per change, as pathpirate does for every operation
+def change(store, path, text, label):
+    store.beginGeneration(label)
+    if os.path.exists(path):
+        store.backup(path)
+    else:
+        store.created(path)
+    writeText(path, text)
+
+def test_restore_original(tmp_path):
+    root = str(tmp_path)
+    ini = os.path.join(root, 'mill.ini')
+    hal = os.path.join(root, 'encoder.hal')
+    writeText(ini, 'original')
+    os.chmod(ini, 0o640)
+    store = BackupStore(root)
+    change(store, ini, 'first', 'first')
+    change(store, hal, 'created', 'second')
+    change(store, ini, 'third', 'third')
+    store = BackupStore(root)
+    assert [label for label, _, _ in store.listGenerations()] == ['first', 'second', 'third']
+    restored, removed = store.restore()
+    assert restored == [ini]
+    assert removed == [hal]
+    assert readText(ini) == 'original'
+    assert os.stat(ini).st_mode & 0o777 == 0o640
+    assert not os.path.exists(store.storeDir)
+
+def test_restore_one_generation(tmp_path):
+    root = str(tmp_path)
+    ini = os.path.join(root, 'mill.ini')
+    writeText(ini, 'original')
+    store = BackupStore(root)
+    change(store, ini, 'first', 'first')
+    change(store, ini, 'second', 'second')
+    store.restore(1)
+    assert readText(ini) == 'first'
+    assert [label for label, _, _ in store.listGenerations()] == ['first']
+    assert len(blobs(store)) == 1
+    assert store.original(ini) is not None
+    assert readText(store.original(ini)) == 'original'
+
+def test_prune_keeps_original(tmp_path):
+    root = str(tmp_path)
+    ini = os.path.join(root, 'mill.ini')
+    writeText(ini, 'version 0')
+    store = BackupStore(root, maxGenerations=3)
+    for number in range(1, 7):
+        change(store, ini, 'version {}'.format(number), 'change {}'.format(number))
+    labels = [label for label, _, _ in store.listGenerations()]
+    assert len(labels) == 3
+    assert labels[0] == 'change 1'
+    assert labels[1] == 'change 2 + change 3 + change 4 + change 5'
+    assert labels[2] == 'change 6'
+    # the merged generation undoes everything it holds, back to what change 1 left
+    store.restore(1)
+    assert readText(ini) == 'version 1'
+    store.restore()
+    assert readText(ini) == 'version 0'
+
+def test_discard_generation(tmp_path):
+    root = str(tmp_path)
+    ini = os.path.join(root, 'mill.ini')
+    writeText(ini, 'original')
+    store = BackupStore(root)
+    change(store, ini, 'first', 'first')
+    store.beginGeneration('undone')
+    store.backup(ini)
+    store.created(os.path.join(root, 'encoder.hal'))
+    assert len(store.listGenerations()) == 2
+    store.discardGeneration()
+    assert [label for label, _, _ in BackupStore(root).listGenerations()] == ['first']
+    assert len(blobs(store)) == 1
+    # nothing to drop once a generation was begun and not used, or after it was dropped
+    store.beginGeneration('unused')
+    store.discardGeneration()
+    store.discardGeneration()
+    assert [label for label, _, _ in BackupStore(root).listGenerations()] == ['first']
+
+def test_same_content_is_stored_once(tmp_path):
+    root = str(tmp_path)
+    for name in ['a.hal', 'b.hal']:
+        writeText(os.path.join(root, name), 'same')
+    store = BackupStore(root)
+    store.beginGeneration('both')
+    store.backup(os.path.join(root, 'a.hal'))
+    store.backup(os.path.join(root, 'b.hal'))
+    assert len(blobs(store)) == 1
@@ -0,0 +1,92 @@
+import os
+
+from inimodel import IniFile, IniCache
+
+# comments, odd spacing, CRLF lines, a repeated section and key and no newline at the end
+ORIGINAL = (b'# PathPilot mill\n'
+            b'[EMC]\n'
+            b'VERSION=1.1   ; comment\n'
+            b'\n'
+            b'[HAL]\r\n'
+            b'HALFILE = tormach_mill_mesa.hal\r\n'
+            b'HALFILE   =   pathpilot.hal\r\n'
+            b'POSTGUI_HALFILE = postgui.hal\r\n'
+            b'\r\n'
+            b'[AXIS_0]\n'
+            b'MAX_VELOCITY = 1.0\n'
+            b'[AXIS_0]\n'
+            b'MAX_VELOCITY = 2.0\n'
+            b'# \xb0 not utf-8\n'
+            b'HOME = 0.0')
+
+def writeBytes(path, data):
+    with open(path, 'wb') as file:
+        file.write(data)
+
+def readBytes(path):
+    with open(path, 'rb') as file:
+        return file.read()
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / 'mill.ini')
+    writeBytes(path, ORIGINAL)
+    iniFile = IniFile.read(path)
+    assert iniFile.getAll('HAL', 'HALFILE') == ['tormach_mill_mesa.hal', 'pathpilot.hal']
+    assert iniFile.get('AXIS_0', 'MAX_VELOCITY') == '2.0'
+    iniFile.write()
+    assert readBytes(path) == ORIGINAL
+
+def test_set_keeps_the_rest(tmp_path):
+    path = str(tmp_path / 'mill.ini')
+    writeBytes(path, ORIGINAL)
+    iniFile = IniFile.read(path)
+    iniFile.set('HAL', 'POSTGUI_HALFILE', 'pathpirate.hal')
+    iniFile.set('AXIS_0', 'MAX_VELOCITY', '3.0')
+    iniFile.write()
+    assert readBytes(path) == (ORIGINAL
+        .replace(b'POSTGUI_HALFILE = postgui.hal\r\n', b'POSTGUI_HALFILE = pathpirate.hal\r\n')
+        .replace(b'MAX_VELOCITY = 2.0\n', b'MAX_VELOCITY = 3.0\n'))
+
+def test_insert_and_remove_keep_the_rest(tmp_path):
+    path = str(tmp_path / 'mill.ini')
+    writeBytes(path, ORIGINAL)
+    iniFile = IniFile.read(path)
+    assert iniFile.insertAfter('HAL', 'HALFILE', 'encoder.hal', 'HALFILE', 'tormach_mill_mesa.hal')
+    assert not iniFile.insertAfter('HAL', 'HALFILE', 'encoder.hal', 'HALFILE', 'missing.hal')
+    iniFile.write()
+    assert readBytes(path) == ORIGINAL.replace(b'mesa.hal\r\n', b'mesa.hal\r\nHALFILE = encoder.hal\r\n')
+    iniFile = IniFile.read(path)
+    assert iniFile.removeLines('HAL', 'HALFILE', 'encoder.hal') == 1
+    iniFile.write()
+    assert readBytes(path) == ORIGINAL
+
+def test_add_lines(tmp_path):
+    path = str(tmp_path / 'mill.ini')
+    writeBytes(path, ORIGINAL)
+    iniFile = IniFile.read(path)
+    iniFile.set('EMC', 'DEBUG', '0')
+    iniFile.addLines('PATHPIRATE', ['VERSION = 1'])
+    iniFile.write()
+    assert readBytes(path) == (ORIGINAL
+        .replace(b'comment\n', b'comment\nDEBUG = 0\n')
+        + b'\n[PATHPIRATE]\nVERSION = 1\n')
+    assert IniFile.read(path).get('PATHPIRATE', 'VERSION') == '1'
+
+def test_write_keeps_mode(tmp_path):
+    path = str(tmp_path / 'mill.ini')
+    writeBytes(path, ORIGINAL)
+    os.chmod(path, 0o640)
+    iniFile = IniFile.read(path)
+    iniFile.set('EMC', 'VERSION', '1.2')
+    iniFile.write()
+    assert os.stat(path).st_mode & 0o777 == 0o640
+    assert os.listdir(str(tmp_path)) == ['mill.ini']
+
+def test_cache_overlays_base(tmp_path):
+    writeBytes(str(tmp_path / 'mill.ini'), ORIGINAL)
+    writeBytes(str(tmp_path / 'mill_specific.ini'), b'[INI_CONFIG]\nBASE_INI_FILE = mill.ini\n[AXIS_0]\nHOME = 1.0\n')
+    cache = IniCache()
+    values = cache.values(str(tmp_path / 'mill_specific.ini'))
+    assert values['AXIS_0'] == {'MAX_VELOCITY': '2.0', 'HOME': '1.0'}
+    assert values['HAL']['POSTGUI_HALFILE'] == 'postgui.hal'
+    assert cache.get(str(tmp_path / 'mill.ini')) is cache.get(str(tmp_path / 'mill.ini'))
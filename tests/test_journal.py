@@ -0,0 +1,80 @@
+import os
+
+from backupstore import BackupStore
+from journal import Transaction, rollback
+
+def writeText(path, text):
+    with open(path, 'w') as file:
+        file.write(text)
+
+def readText(path):
+    with open(path, 'r') as file:
+        return file.read()
+
+# a config folder with two files, and a transaction that changes both and creates a third
+def makeTransaction(root):
+    for name in ['mill.ini', 'mill.hal']:
+        writeText(os.path.join(root, name), 'original {}'.format(name))
+    backups = BackupStore(root)
+    backups.beginGeneration('test')
+    transaction = Transaction(root, backups, 'test')
+    transaction.write(os.path.join(root, 'mill.ini'), 'new ini')
+    transaction.write(os.path.join(root, 'mill.hal'), 'new hal')
+    transaction.write(os.path.join(root, 'encoder.hal'), 'created')
+    return transaction
+
+def listing(root):
+    return sorted(name for name in os.listdir(root) if name != '.pathpirate')
+
+def test_commit(tmp_path):
+    root = str(tmp_path)
+    transaction = makeTransaction(root)
+    changed = transaction.commit()
+    assert changed == [os.path.join(root, name) for name in ['encoder.hal', 'mill.hal', 'mill.ini']]
+    assert readText(os.path.join(root, 'mill.ini')) == 'new ini'
+    assert readText(os.path.join(root, 'encoder.hal')) == 'created'
+    assert listing(root) == ['encoder.hal', 'mill.hal', 'mill.ini']
+    assert not os.path.exists(transaction.journalFile)
+    assert rollback(root, BackupStore(root)) is None
+
+def test_abort(tmp_path):
+    root = str(tmp_path)
+    transaction = makeTransaction(root)
+    transaction.abort()
+    assert listing(root) == ['mill.hal', 'mill.ini']
+    assert readText(os.path.join(root, 'mill.ini')) == 'original mill.ini'
+    assert not os.path.exists(transaction.journalFile)
+
+# stopped while staging: nothing was renamed, the staged files are removed
+def test_rollback_staging(tmp_path):
+    root = str(tmp_path)
+    makeTransaction(root)
+    label, changed = rollback(root, BackupStore(root))
+    assert label == 'test'
+    assert changed == []
+    assert listing(root) == ['mill.hal', 'mill.ini']
+    assert readText(os.path.join(root, 'mill.hal')) == 'original mill.hal'
+
+# stopped part way through the renames of a commit: every file is put back from the backups
+def test_rollback_interrupted_commit(tmp_path):
+    root = str(tmp_path)
+    transaction = makeTransaction(root)
+    transaction.save('committing', sync=True)
+    for relPath in ['encoder.hal', 'mill.hal']:
+        os.rename(transaction.absolute(transaction.files[relPath]['staged']), transaction.absolute(relPath))
+    label, changed = rollback(root, BackupStore(root))
+    assert label == 'test'
+    assert changed == [os.path.join(root, name) for name in ['encoder.hal', 'mill.hal']]
+    assert listing(root) == ['mill.hal', 'mill.ini']
+    assert readText(os.path.join(root, 'mill.ini')) == 'original mill.ini'
+    assert readText(os.path.join(root, 'mill.hal')) == 'original mill.hal'
+    assert not os.path.exists(transaction.journalFile)
+    assert rollback(root, BackupStore(root)) is None
+
+# a staging journal is written without fsync, one cut short is dropped
+def test_rollback_unreadable_journal(tmp_path):
+    root = str(tmp_path)
+    transaction = makeTransaction(root)
+    writeText(transaction.journalFile, '{"label": "te')
+    assert rollback(root, BackupStore(root)) is None
+    assert not os.path.exists(transaction.journalFile)
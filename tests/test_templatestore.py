@@ -0,0 +1,101 @@
+import io
+import os
+
+import pytest
+
+from templatestore import TemplateStore
+
+def writeText(path, text):
+    folder = os.path.dirname(path)
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    with io.open(path, 'w', encoding='utf-8', newline='') as file:
+        file.write(text)
+
+def readText(path):
+    with io.open(path, 'r', encoding='utf-8', newline='') as file:
+        return file.read()
+
+BASE = u'[EMC]\nVERSION = 1.1\n\n[DISPLAY]\nMAX_FEED_OVERRIDE = 2.0\n'
+
+# three versions: the base, one with a changed and an added line, one with CRLF line endings and
+# no newline at the end
+def makeSource(sourceDir):
+    writeText(os.path.join(sourceDir, 'v2.9.0', 'mill.ini'), BASE)
+    writeText(os.path.join(sourceDir, 'v2.9.0', 'mill.hal'), u'loadrt trivkins\n')
+    writeText(os.path.join(sourceDir, 'v2.10.0', 'mill.ini'), BASE.replace(u'2.0', u'1.5') + u'[KINS]\nJOINTS = 4\n')
+    writeText(os.path.join(sourceDir, 'v2.10.0', 'mill.hal'), u'loadrt trivkins\n')
+    writeText(os.path.join(sourceDir, 'v2.11.0', 'mill.ini'), BASE.replace(u'\n', u'\r\n').rstrip())
+    writeText(os.path.join(sourceDir, 'v2.11.0', 'mill.hal'), u'loadrt trivkins coordinates=XYZA\n')
+
+def test_patch_round_trip(tmp_path):
+    store = TemplateStore(str(tmp_path / 'templates'), str(tmp_path / 'cache'))
+    changed = BASE.replace(u'VERSION = 1.1\n', u'VERSION = 1.1\nDEBUG = 0\n').rstrip(u'\n')
+    patch = store.makePatch(BASE, changed, 'mill.ini')
+    assert store.applyPatch(BASE, patch) == changed
+    assert store.applyPatch(BASE, store.makePatch(BASE, u'', 'mill.ini')) == u''
+
+def test_patch_must_match_base(tmp_path):
+    store = TemplateStore(str(tmp_path / 'templates'), str(tmp_path / 'cache'))
+    patch = store.makePatch(BASE, BASE.replace(u'2.0', u'1.5'), 'mill.ini')
+    with pytest.raises(ValueError):
+        store.applyPatch(BASE.replace(u'2.0', u'3.0'), patch)
+
+def test_build_verify_against_source(tmp_path):
+    sourceDir = str(tmp_path / 'configs')
+    makeSource(sourceDir)
+    store = TemplateStore(str(tmp_path / 'templates'), str(tmp_path / 'cache'))
+    store.build(sourceDir, 'v2.9.0')
+    assert store.versions() == ['v2.9.0', 'v2.10.0', 'v2.11.0']
+    # files that match the base get no patch
+    assert not os.path.exists(str(tmp_path / 'templates' / 'v2.9.0'))
+    assert not os.path.exists(str(tmp_path / 'templates' / 'v2.10.0' / 'mill.hal.patch'))
+    results = store.verify(sourceDir)
+    assert len(results) == 6
+    assert all(ok for version, name, ok, message in results), results
+    # a store that no longer matches the source is reported
+    writeText(os.path.join(sourceDir, 'v2.10.0', 'mill.ini'), BASE)
+    failed = [(version, name) for version, name, ok, message in store.verify(sourceDir) if not ok]
+    assert failed == [('v2.10.0', 'mill.ini')]
+
+def test_extract_and_get_file(tmp_path):
+    sourceDir = str(tmp_path / 'configs')
+    makeSource(sourceDir)
+    store = TemplateStore(str(tmp_path / 'templates'), str(tmp_path / 'cache'))
+    store.build(sourceDir, 'v2.9.0')
+    outputDir = str(tmp_path / 'extracted')
+    TemplateStore(str(tmp_path / 'templates'), str(tmp_path / 'cache')).extract(outputDir)
+    for version in ['v2.9.0', 'v2.10.0', 'v2.11.0']:
+        for name in ['mill.ini', 'mill.hal']:
+            assert readText(os.path.join(outputDir, version, name)) == readText(os.path.join(sourceDir, version, name))
+    path = store.getFile('v2.11.0', 'mill.ini')
+    assert readText(path) == readText(os.path.join(sourceDir, 'v2.11.0', 'mill.ini'))
+    assert store.getFile('v2.12.0', 'mill.ini') == str(tmp_path / 'cache' / 'v2.12.0' / 'mill.ini')
+
+def test_add_version_keeps_the_others(tmp_path):
+    sourceDir = str(tmp_path / 'configs')
+    makeSource(sourceDir)
+    store = TemplateStore(str(tmp_path / 'templates'), str(tmp_path / 'cache'))
+    store.build(sourceDir, 'v2.9.0')
+    newDir = str(tmp_path / 'new')
+    writeText(os.path.join(newDir, 'mill.ini'), BASE + u'[NEW]\nKEY = 1\n')
+    store = TemplateStore(str(tmp_path / 'templates'), str(tmp_path / 'cache'))
+    store.addVersion('v2.12.0', newDir)
+    store = TemplateStore(str(tmp_path / 'templates'), str(tmp_path / 'cache'))
+    assert store.versions() == ['v2.9.0', 'v2.10.0', 'v2.11.0', 'v2.12.0']
+    assert store.names('v2.12.0') == ['mill.ini']
+    assert store.rebuild('v2.12.0', 'mill.ini') == BASE + u'[NEW]\nKEY = 1\n'
+    assert all(ok for version, name, ok, message in store.verify(sourceDir))
+
+def test_add_version_needs_a_base(tmp_path):
+    store = TemplateStore(str(tmp_path / 'templates'), str(tmp_path / 'cache'))
+    with pytest.raises(ValueError):
+        store.addVersion('v2.12.0', str(tmp_path))
+
+# every file of every version PathPirate ships rebuilds to its digest
+def test_shipped_store(tmp_path):
+    configDir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'files', 'configs')
+    store = TemplateStore(os.path.join(configDir, 'templates'), str(tmp_path))
+    results = store.verify()
+    assert results
+    assert [result for result in results if not result[2]] == []
@@ -0,0 +1,55 @@
+import os
+
+from textpatch import TextPatcher
+
+def writeBytes(path, data):
+    with open(path, 'wb') as file:
+        file.write(data)
+
+def readBytes(path):
+    with open(path, 'rb') as file:
+        return file.read()
+
+# every offset of the match against the block boundary, including one that starts in one block
+# and ends in the next
+def test_rewrite_match_across_blocks(tmp_path):
+    patcher = TextPatcher(str(tmp_path))
+    path = str(tmp_path / 'file.hal')
+    edits = [['net estop', 'net e-stop']]
+    for offset in range(12):
+        original = b'x' * offset + b'net estop\n' + b'y' * 20 + b'net estop'
+        writeBytes(path, original)
+        counts = patcher.rewrite(path, edits, blockSize=8)
+        assert counts == [2]
+        assert readBytes(path) == original.replace(b'net estop', b'net e-stop')
+        assert not os.path.exists('{}.pathpirate.tmp'.format(path))
+
+def test_rewrite_matches_apply(tmp_path):
+    patcher = TextPatcher(str(tmp_path))
+    path = str(tmp_path / 'file.ini')
+    edits = [['AXIS_0', 'JOINT_0'], ['AXIS_0_HOME', 'JOINT_0_HOME'], ['X', 'Y']]
+    original = b'[AXIS_0]\nAXIS_0_HOME = 1\r\nX = 2\n' * 50
+    writeBytes(path, original)
+    expected, expectedCounts = patcher.apply(original, [[old.encode(), new.encode()] for old, new in edits])
+    counts = patcher.rewrite(path, edits, blockSize=5)
+    assert counts == expectedCounts
+    assert readBytes(path) == expected
+
+def test_rewrite_to_output_keeps_source(tmp_path):
+    patcher = TextPatcher(str(tmp_path))
+    path = str(tmp_path / 'file.hal')
+    output = str(tmp_path / 'file.hal.new')
+    writeBytes(path, b'old text')
+    assert patcher.rewrite(path, [['old', 'new']], output, blockSize=3) == [1]
+    assert readBytes(path) == b'old text'
+    assert readBytes(output) == b'new text'
+
+def test_rewrite_without_match_leaves_file(tmp_path):
+    patcher = TextPatcher(str(tmp_path))
+    path = str(tmp_path / 'file.hal')
+    writeBytes(path, b'nothing to change')
+    before = os.stat(path).st_mtime
+    assert patcher.rewrite(path, [['absent', 'present']], blockSize=4) == [0]
+    assert readBytes(path) == b'nothing to change'
+    assert os.stat(path).st_mtime == before
+    assert os.listdir(str(tmp_path)) == ['file.hal']
@@ -0,0 +1,181 @@
+'''
+textpatch applies the PathPirate text replacements described by the patch
+files in files/patches, all replacements of a file in one pass.
+
+Copyright (C) 2023, 2024, 2025, 2026 Gregory D Carl
+
+This program is free software; you can redistribute it and/or modify it
+under the terms of the GNU General Public License as published by the
+Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along
+with this program; if not, write to the Free Software Foundation, Inc.,
+51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+'''
+
+import sys
+import os
+import re
+import io
+import json
+import mmap
+from shutil import copymode
+
+# Every <operation>.json in the patch folder holds a list of patches for that operation:
+#   {'name': ..., 'files': [<PathPirate path attribute>, ...], 'versions': {'from': 'v2.10.0', 'before': 'v2.14.1'},
+#    'machines': [...], 'marker': <text present once the file is patched>, 'edits': [[old, new], ...]}
+# 'from' is inclusive and 'before' exclusive, either can be left out, as can 'machines' (any machine).
+# A patch can also have 'parameters': {<name>: <default>}, every '{<name>}' in its new texts is
+# replaced with the value PathPirate works out for it, or the default (see fill()).
+class TextPatcher:
+
+    def __init__(self, patchDir):
+        self.patchDir = patchDir
+        self.operations = None
+        self.matchers = {}
+
+    def load(self):
+        if self.operations is None:
+            self.operations = {}
+            for name in sorted(os.listdir(self.patchDir)):
+                if name.endswith('.json'):
+                    with io.open(os.path.join(self.patchDir, name), 'r', encoding='utf-8') as jsonFile:
+                        patches = json.load(jsonFile)
+                    for patch in patches:
+                        patch['marker'] = self.native(patch['marker'])
+                        patch['edits'] = [[self.native(old), self.native(new)] for old, new in patch['edits']]
+                        if 'parameters' in patch:
+                            patch['parameters'] = dict((str(name), self.native(value)) for name, value in patch['parameters'].items())
+                    self.operations[name[:-5]] = patches
+        return self.operations
+
+    # json gives unicode on Python 2 where the files are read as str
+    def native(self, text):
+        if sys.version_info[0] < 3:
+            return text.encode('utf-8')
+        return text
+
+    # (operation, patch) for every patch that applies to this version (a version tuple) and machine
+    def patches(self, version, machine, versionTuple):
+        selected = []
+        for operation, patches in sorted(self.load().items()):
+            for patch in patches:
+                versions = patch.get('versions', {})
+                if 'from' in versions and version < versionTuple(versions['from']):
+                    continue
+                if 'before' in versions and version >= versionTuple(versions['before']):
+                    continue
+                if 'machines' in patch and machine not in patch['machines']:
+                    continue
+                selected.append((operation, patch))
+        return selected
+
+    # A copy of a patch with its parameters filled in from {name: text}, the patch itself if it has none
+    def fill(self, patch, parameters=None):
+        if 'parameters' not in patch:
+            return patch
+        values = dict(patch['parameters'])
+        values.update((name, self.native(value)) for name, value in (parameters or {}).items() if name in values)
+        edits = []
+        for old, new in patch['edits']:
+            for name, value in values.items():
+                new = new.replace('{%s}' % name, value)
+            edits.append([old, new])
+        filled = dict(patch)
+        filled['edits'] = edits
+        return filled
+
+    # One regular expression for all the old texts, longest first so a text that starts with
+    # another one still wins. Built once per set of edits.
+    def matcher(self, edits):
+        key = tuple(old for old, _ in edits)
+        if key not in self.matchers:
+            olds = sorted(set(key), key=len, reverse=True)
+            separator = b'|' if isinstance(olds[0], bytes) else '|'
+            self.matchers[key] = re.compile(separator.join(re.escape(old) for old in olds))
+        return self.matchers[key]
+
+    # Apply every replacement in one pass over the text, returns the new text and the number of
+    # matches of each replacement. Text written by one replacement is never matched by another.
+    def apply(self, text, edits):
+        indexes = self.indexes(edits)
+        counts = [0] * len(edits)
+        def replace(match):
+            index = indexes[match.group(0)]
+            counts[index] += 1
+            return edits[index][1]
+        text = self.matcher(edits).sub(replace, text)
+        return text, counts
+
+    # first edit of each old text
+    def indexes(self, edits):
+        indexes = {}
+        for index, (old, _) in enumerate(edits):
+            indexes.setdefault(old, index)
+        return indexes
+
+    # apply() for a file without reading it into memory: blocks are streamed through the matcher into
+    # a temp file next to it, which only replaces the file (atomically) if something was changed.
+    # With output the result goes there instead (e.g. a transaction's staged file) and path is kept.
+    # A match may start in one block and end in the next, so the last len(longest old) - 1 bytes of
+    # a block are only written once the next block shows whether a match starts there.
+    def rewrite(self, path, edits, output=None, blockSize=65536):
+        edits = [[toBytes(old), toBytes(new)] for old, new in edits]
+        counts = [0] * len(edits)
+        if not edits:
+            return counts
+        matcher = self.matcher(edits)
+        indexes = self.indexes(edits)
+        keep = max(len(old) for old, _ in edits) - 1
+        output = output or path
+        tempFile = '{}.pathpirate.tmp'.format(output)
+        try:
+            with open(path, 'rb') as source:
+                with open(tempFile, 'wb') as target:
+                    pending = b''
+                    while True:
+                        block = source.read(blockSize)
+                        data = pending + block
+                        # a match starting before safe is complete, later ones wait for the next block
+                        safe = max(len(data) - keep, 0) if block else len(data)
+                        position = 0
+                        for match in matcher.finditer(data):
+                            if match.start() >= safe:
+                                break
+                            index = indexes[match.group(0)]
+                            counts[index] += 1
+                            target.write(data[position:match.start()])
+                            target.write(edits[index][1])
+                            position = match.end()
+                        end = max(position, safe)
+                        target.write(data[position:end])
+                        pending = data[end:]
+                        if not block:
+                            break
+            if any(counts):
+                copymode(path, tempFile)
+                os.rename(tempFile, output)
+        finally:
+            if os.path.exists(tempFile):
+                os.remove(tempFile)
+        return counts
+
+def toBytes(text):
+    return text if isinstance(text, bytes) else text.encode('utf-8')
+
+# True if the file holds the text, searched through mmap so the file is never read into a string
+def fileContains(path, text):
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return False
+        data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return data.find(toBytes(text)) != -1
+        finally:
+            data.close()